@@ -0,0 +1,71 @@
+"""Throughput and fp32 drift of the embedding backends on synthetic chat text.
+
+Every backend in --backends encodes the same --texts messages of a
+synthetic chat (after one warm-up call) at each --batch-sizes value. The
+report gives texts per second and, for the quantized backends, the cosine
+similarity of their embeddings to the fp32 'torch' ones (mean and worst
+text), which is how far search and the cluster map can move when switching
+EMBEDDING_BACKEND.
+
+Usage (from backend/):
+    python -m benchmarks.embedding_backends --texts 2000 --batch-sizes 32 64 128
+    python -m benchmarks.embedding_backends --backends torch int8 --processes 4
+"""
+import argparse
+import os
+import time
+
+from benchmarks.synthetic_chat import iter_export_lines
+from services.embedding_engine import EmbeddingEngine
+
+
+def chat_texts(n, seed):
+    """The first n message texts of a synthetic chat"""
+    texts = []
+    for line in iter_export_lines(n * 2, seed=seed):
+        _, sep, text = line.partition(': ')
+        if sep:
+            texts.append(text)
+        if len(texts) == n:
+            break
+    return texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', nargs='+', choices=EmbeddingEngine.BACKENDS, default=list(EmbeddingEngine.BACKENDS))
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[64])
+    parser.add_argument('--processes', type=int, default=0)
+    parser.add_argument('--texts', type=int, default=2000)
+    parser.add_argument('--model', default=os.environ.get('EMBEDDING_MODEL', 'all-mpnet-base-v2'))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    texts = chat_texts(args.texts, args.seed)
+    # fp32 embeddings first, so the other backends are compared without a second model load each
+    backends = sorted(args.backends, key=lambda backend: backend != 'torch')
+    baseline = None
+
+    print(f'{"backend":<8} {"batch":>6} {"texts/s":>9} {"mean cos":>9} {"min cos":>9}')
+    for backend in backends:
+        for batch_size in args.batch_sizes:
+            engine = EmbeddingEngine(args.model, batch_size=batch_size, backend=backend, processes=args.processes)
+            try:
+                engine.encode(texts[:batch_size])  # warm up
+                start = time.perf_counter()
+                embeddings = engine.encode(texts)
+                seconds = time.perf_counter() - start
+
+                if backend == 'torch':
+                    baseline = embeddings if baseline is None else baseline
+                    mean_cos, min_cos = '', ''
+                else:
+                    drift = engine.measure_drift(texts, embeddings, baseline=baseline)
+                    mean_cos, min_cos = f'{drift["mean_cosine"]:.5f}', f'{drift["min_cosine"]:.5f}'
+            finally:
+                engine.close()
+            print(f'{backend:<8} {batch_size:>6} {len(texts) / seconds:>9.1f} {mean_cos:>9} {min_cos:>9}')
+
+
+if __name__ == '__main__':
+    main()
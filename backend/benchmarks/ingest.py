@@ -0,0 +1,139 @@
+"""Write throughput of store_messages against the real vec0 schema, per SQLite setting.
+
+The first line per size is the baseline: the original ingest, one INSERT
+per message and per embedding in a single transaction, into the original
+schema (unpartitioned vec0, no FTS or rollups, default rollback journal).
+Every configuration then stores the same synthetic chat of --messages rows
+(768-d unit vectors, short texts) into a fresh database, --repeat times,
+and reports the best rows per second. A configuration is a journal mode
+(the server uses WAL), a synchronous level (the server uses NORMAL) and a
+store_messages batch size. This is the measurement DatabaseService.PRAGMAS
+and batch_size should be tuned from: a plain BLOB table in place of vec0
+writes far fewer pages per vector and does not predict it.
+
+Usage (from backend/):
+    python -m benchmarks.ingest --messages 10000 100000
+    python -m benchmarks.ingest --journal wal delete --synchronous normal full --batch-sizes 1000 5000 20000
+"""
+import argparse
+import itertools
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pysqlite3 as sqlite3
+import sqlite_vec
+
+from benchmarks.vector_search import DIM, synthetic_chat
+from services.database import DatabaseService
+
+
+def processed_messages(n, seed):
+    rng = np.random.default_rng(seed)
+    embeddings = synthetic_chat(rng, n)
+    return [
+        {
+            'timestamp': f'2024-01-01T{i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}',
+            'sender': f'user{i % 5}',
+            'message': f'message {i} about topic {i % 20}',
+            'sentiment': 0.0,
+            'cluster_x': None,
+            'cluster_y': None,
+            'embedding': embeddings[i]
+        }
+        for i in range(n)
+    ]
+
+
+def run_baseline(workdir, processed_data):
+    """Seconds for the per-row ingest store_messages did before batching"""
+    conn = sqlite3.connect(os.path.join(workdir, f'baseline_{time.perf_counter_ns()}.db'))
+    try:
+        conn.enable_load_extension(True)
+        sqlite_vec.load(conn)
+        conn.enable_load_extension(False)
+        conn.executescript(f'''
+            CREATE TABLE messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id TEXT NOT NULL, timestamp DATETIME NOT NULL,
+                sender TEXT NOT NULL, message TEXT NOT NULL, sentiment REAL, cluster_x REAL, cluster_y REAL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE VIRTUAL TABLE message_embeddings USING vec0(id INTEGER PRIMARY KEY, embedding FLOAT[{DIM}]);
+            CREATE TABLE chats (id TEXT PRIMARY KEY, name TEXT, message_count INTEGER,
+                                created_at DATETIME DEFAULT CURRENT_TIMESTAMP);
+            CREATE INDEX idx_chat_id ON messages(chat_id);
+            CREATE INDEX idx_timestamp ON messages(timestamp);
+            CREATE INDEX idx_sender ON messages(sender);
+        ''')
+
+        start = time.perf_counter()
+        cursor = conn.cursor()
+        cursor.execute('INSERT OR REPLACE INTO chats (id, name, message_count) VALUES (?, ?, ?)',
+                       ('bench', 'Chat bench', len(processed_data)))
+        for data in processed_data:
+            cursor.execute('''
+                INSERT INTO messages (chat_id, timestamp, sender, message, sentiment, cluster_x, cluster_y)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', ('bench', data['timestamp'], data['sender'], data['message'],
+                  data['sentiment'], data['cluster_x'], data['cluster_y']))
+            cursor.execute('INSERT INTO message_embeddings (id, embedding) VALUES (?, ?)',
+                           (cursor.lastrowid, np.asarray(data['embedding'], dtype=np.float32).tobytes()))
+        conn.commit()
+        return time.perf_counter() - start
+    finally:
+        conn.close()
+
+
+def run(workdir, processed_data, journal, synchronous, batch_size):
+    """Seconds for one store_messages of processed_data into a fresh database"""
+    db_path = os.path.join(workdir, f'ingest_{journal}_{synchronous}_{batch_size}_{time.perf_counter_ns()}.db')
+    # synchronous is set on every pooled connection, so override it in PRAGMAS
+    service = type('BenchDatabaseService', (DatabaseService,), {
+        'PRAGMAS': dict(DatabaseService.PRAGMAS, synchronous=synchronous.upper())
+    })
+    db = service(db_path=db_path, batch_size=batch_size)
+    try:
+        # journal_mode is stored in the database file; init_database set WAL
+        with db._connection() as conn:
+            conn.execute(f'PRAGMA journal_mode = {journal}')
+        start = time.perf_counter()
+        db.store_messages('bench', processed_data)
+        return time.perf_counter() - start
+    finally:
+        db.pool.close_all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--journal', nargs='+', default=['wal', 'delete'])
+    parser.add_argument('--synchronous', nargs='+', default=['normal'])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[5000], help='store_messages batch sizes (server: 5000)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--keep', action='store_true', help='keep the scratch directory')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_ingest_')
+    try:
+        print(f'{"messages":>8} {"journal":<8} {"sync":<7} {"batch":>6} {"rows/s":>9}')
+        for n in args.messages:
+            processed_data = processed_messages(n, args.seed)
+            seconds = min(run_baseline(workdir, processed_data) for _ in range(args.repeat))
+            print(f'{n:>8} {"per-row baseline":<23} {n / seconds:>9.0f}')
+            for journal, synchronous, batch_size in itertools.product(args.journal, args.synchronous, args.batch_sizes):
+                seconds = min(
+                    run(workdir, processed_data, journal, synchronous, batch_size) for _ in range(args.repeat)
+                )
+                print(f'{n:>8} {journal:<8} {synchronous:<7} {batch_size:>6} {n / seconds:>9.0f}')
+    finally:
+        if args.keep:
+            print(f'Scratch files kept in {workdir}')
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
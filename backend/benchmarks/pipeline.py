@@ -0,0 +1,266 @@
+"""End-to-end ingest and query timings on synthetic WhatsApp exports.
+
+For each size, a deterministic export (see benchmarks.synthetic_chat) is
+written to a scratch directory and pushed through the pipeline one step at
+a time: parse_whatsapp_chat, generate_embeddings, generate_clusters,
+calculate_sentiment and store_messages. The stored chat is then hit with
+every read and search method of DatabaseService, --repeat calls each.
+
+--encoder hashing swaps the sentence-transformers model for a feature-hashing
+stand-in with the same 768 dimensions: nothing to download and seconds
+instead of hours at 1M messages, at the price of meaningless embed timings
+and search quality. Everything downstream of the encoder is timed as usual.
+
+Results are written as JSON (--output). With --baseline, each timing is
+compared to a previous run's and the ones slower by more than --tolerance
+are listed, exiting with status 1.
+
+Usage (from backend/):
+    python -m benchmarks.pipeline --sizes 1000 10000 100000 --encoder hashing --output baseline.json
+    python -m benchmarks.pipeline --sizes 1000 10000 100000 --encoder hashing --baseline baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import zlib
+from datetime import datetime
+
+import numpy as np
+
+from benchmarks.synthetic_chat import write_export
+from services.database import DatabaseService
+from services.language_processing import LanguageProcessingService
+from services.vector_store import EMBEDDING_DIM
+from services.whatsapp_parser import parse_whatsapp_chat
+
+EMBED_CHUNK = 10000
+BATCH_SEARCHES = 16
+
+
+class HashingEngine:
+    """Stand-in for EmbeddingEngine: L2-normalized feature-hashed bag of words"""
+
+    def __init__(self, dim=EMBEDDING_DIM):
+        self.dim = dim
+        self.model = None
+        self._texts = 0
+        self._seconds = 0.0
+
+    @property
+    def name(self):
+        return f'hashing-{self.dim}'
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, texts):
+        start = time.perf_counter()
+        embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for token in text.lower().split():
+                # crc32 rather than hash(): string hashing is salted per process
+                h = zlib.crc32(token.encode('utf-8'))
+                embeddings[i, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings /= np.maximum(norms, 1e-12)
+        self._texts += len(texts)
+        self._seconds += time.perf_counter() - start
+        return embeddings
+
+    def stats(self):
+        return {'model': self.name, 'texts': self._texts, 'seconds': round(self._seconds, 3)}
+
+    def close(self):
+        pass
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def latency_summary(latencies):
+    ms = np.asarray(latencies) * 1000
+    return {
+        'calls': len(latencies),
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(ms, 95)), 3),
+        'mean_ms': round(float(ms.mean()), 3)
+    }
+
+
+def ingest(lp_service, db, chat_id, path, skip_clusters=False):
+    """Run each pipeline step on the export at path; returns (timings, texts)"""
+    timings = {}
+    with open(path, encoding='utf-8') as f:
+        messages, timings['parse_whatsapp_chat'] = timed(parse_whatsapp_chat, f)
+    texts = [message['message'] for message in messages]
+
+    # generate_embeddings returns Python lists; converting chunk by chunk keeps
+    # 1M x 768 floats from ever existing as lists at once
+    embeddings = np.empty((len(texts), lp_service.engine.get_sentence_embedding_dimension()), dtype=np.float32)
+    timings['generate_embeddings'] = 0.0
+    for start in range(0, len(texts), EMBED_CHUNK):
+        chunk, seconds = timed(lp_service.generate_embeddings, texts[start:start + EMBED_CHUNK])
+        embeddings[start:start + len(chunk)] = chunk
+        timings['generate_embeddings'] += seconds
+
+    if skip_clusters:
+        coordinates = [{'x': None, 'y': None, 'cluster': None}] * len(texts)
+    else:
+        coordinates, timings['generate_clusters'] = timed(lp_service.generate_clusters, embeddings, lp_service.n_clusters)
+    sentiments, timings['calculate_sentiment'] = timed(lp_service.calculate_sentiment, texts)
+
+    processed_data = [
+        dict(message, embedding=embedding, sentiment=sentiment,
+             cluster_x=point['x'], cluster_y=point['y'], cluster=point['cluster'])
+        for message, embedding, sentiment, point in zip(messages, embeddings, sentiments, coordinates)
+    ]
+    _, timings['store_messages'] = timed(db.store_messages, chat_id, processed_data)
+    return {name: {'seconds': round(seconds, 3)} for name, seconds in timings.items()}, texts
+
+
+def query_cases(lp_service, db, chat_id, texts, rng, repeat):
+    """name -> callable(i) for every read and search method, i in range(repeat)"""
+    queries = [texts[rng.randrange(len(texts))] for _ in range(repeat)]
+    query_embeddings = lp_service.encode(queries, use_cache=False)
+    with db._connection() as conn:
+        first_id, last_id = conn.execute('SELECT MIN(id), MAX(id) FROM messages WHERE chat_id = ?', (chat_id,)).fetchone()
+    message_ids = [rng.randint(first_id, last_id) for _ in range(repeat)]
+    extent = db.get_map_extent(chat_id)
+
+    cases = {
+        'get_chats': lambda i: db.get_chats(),
+        'get_chat_stats': lambda i: db.get_chat_stats(chat_id),
+        'get_timeline': lambda i: db.get_timeline(chat_id, 'day'),
+        'get_sentiment_timeline': lambda i: db.get_sentiment_timeline(chat_id, 'week'),
+        'iter_messages_page': lambda i: list(db.iter_messages(chat_id, limit=1000)),
+        'get_message': lambda i: db.get_message(chat_id, message_ids[i]),
+        'get_map_extent': lambda i: db.get_map_extent(chat_id),
+        'search_similar_messages': lambda i: db.search_similar_messages(chat_id, query_embeddings[i], 10),
+        'search_similar_messages_batch': lambda i: db.search_similar_messages_batch([
+            (chat_id, query_embeddings[(i + j) % repeat], 10) for j in range(BATCH_SEARCHES)
+        ]),
+        'search_similar_messages_by_id': lambda i: db.search_similar_messages_by_id(chat_id, message_ids[i], 10),
+        'keyword_search': lambda i: db.keyword_search(chat_id, queries[i], 10, match_all=False),
+        'hybrid_search': lambda i: db.hybrid_search(chat_id, queries[i], query_embeddings[i], 10)
+    }
+    if extent is not None:
+        # Full point list the map used to load, next to the level-of-detail reads that replaced it
+        cases['get_cluster_coordinates'] = lambda i: db.get_cluster_coordinates(chat_id)
+        cases['get_cluster_map'] = lambda i: db.get_cluster_map(chat_id, extent)
+        cases['get_cluster_map_zoomed'] = lambda i: db.get_cluster_map(chat_id, extent, viewport=(
+            extent['x0'], extent['y0'],
+            (extent['x0'] + extent['x1']) / 2, (extent['y0'] + extent['y1']) / 2
+        ), zoom=2)
+    return cases
+
+
+def run_size(lp_service, n_messages, args, workdir):
+    path = write_export(os.path.join(workdir, f'chat_{n_messages}.txt'), n_messages, args.seed)
+    db = DatabaseService(db_path=os.path.join(workdir, f'bench_{n_messages}.db'))
+    chat_id = f'bench_{n_messages}'
+    try:
+        ingest_timings, texts = ingest(lp_service, db, chat_id, path, args.skip_clusters)
+
+        rng = random.Random(args.seed)
+        query_timings = {}
+        for name, case in query_cases(lp_service, db, chat_id, texts, rng, args.repeat).items():
+            case(0)  # warm the page cache and statement cache
+            query_timings[name] = latency_summary([timed(case, i)[1] for i in range(args.repeat)])
+        _, seconds = timed(lambda: sum(1 for _ in db.iter_messages(chat_id)))
+        query_timings['iter_messages_all'] = {'calls': 1, 'p50_ms': round(seconds * 1000, 3)}
+
+        return {
+            'messages': len(texts),
+            'export_bytes': os.path.getsize(path),
+            'db_bytes': db.file_size(),
+            'ingest': ingest_timings,
+            'queries': query_timings
+        }
+    finally:
+        db.pool.close_all()
+
+
+def regressions(baseline, current, tolerance):
+    """(size, step, metric, before, after) for each timing slower than before * (1 + tolerance)"""
+    found = []
+    for size, result in current['sizes'].items():
+        before = baseline.get('sizes', {}).get(size)
+        if before is None:
+            continue
+        for section, metric in (('ingest', 'seconds'), ('queries', 'p50_ms')):
+            for step, timing in result[section].items():
+                old = before.get(section, {}).get(step, {}).get(metric)
+                if old and timing.get(metric, 0) > old * (1 + tolerance):
+                    found.append((size, step, metric, old, timing[metric]))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--encoder', choices=['model', 'hashing'], default='model')
+    parser.add_argument('--model', default=os.environ.get('EMBEDDING_MODEL', 'all-mpnet-base-v2'))
+    parser.add_argument('--repeat', type=int, default=50, help='calls per read/search method')
+    parser.add_argument('--skip-clusters', action='store_true', help='skip UMAP/KMeans (and the map reads)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='JSON of a previous run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown vs the baseline')
+    parser.add_argument('--keep', action='store_true', help='keep the scratch directory')
+    args = parser.parse_args()
+
+    engine = HashingEngine() if args.encoder == 'hashing' else None
+    lp_service = LanguageProcessingService(model_name=args.model, engine=engine)
+
+    results = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'encoder': lp_service.engine.name,
+        'seed': args.seed,
+        'repeat': args.repeat,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'sizes': {}
+    }
+    workdir = tempfile.mkdtemp(prefix='bench_pipeline_')
+    try:
+        for n_messages in args.sizes:
+            print(f'{n_messages} messages...', file=sys.stderr)
+            result = run_size(lp_service, n_messages, args, workdir)
+            results['sizes'][str(n_messages)] = result
+            for step, timing in result['ingest'].items():
+                print(f'  {step:<32} {timing["seconds"]:>10.3f} s', file=sys.stderr)
+            for step, timing in result['queries'].items():
+                print(f'  {step:<32} {timing["p50_ms"]:>10.3f} ms p50', file=sys.stderr)
+    finally:
+        if args.keep:
+            print(f'Scratch files kept in {workdir}', file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = regressions(json.load(f), results, args.tolerance)
+        for size, step, metric, before, after in slower:
+            print(f'REGRESSION {size} {step}: {metric} {before} -> {after}', file=sys.stderr)
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Latency and throughput of search query encoding under concurrent clients.
+
+Each client thread encodes --per-client distinct queries one at a time, as
+/api/embeddings/search does for an uncached query. Every concurrency level
+is run without batching (each request calls the model itself) and through
+a MicroBatcher for each --wait-ms window, reporting p50/p99 latency, queries
+per second, mean batch size and mean queueing delay.
+
+Usage (from backend/):
+    python -m benchmarks.query_batching --clients 1 8 32 --wait-ms 1 2 5
+    python -m benchmarks.query_batching --encoder hashing
+"""
+import argparse
+import os
+import threading
+import time
+
+import numpy as np
+
+from benchmarks.pipeline import HashingEngine
+from benchmarks.synthetic_chat import iter_export_lines
+from services.language_processing import LanguageProcessingService
+from services.micro_batcher import MicroBatcher
+
+
+def make_queries(n, seed):
+    """n distinct query texts taken from a synthetic chat"""
+    queries = []
+    for line in iter_export_lines(n * 2, seed=seed):
+        _, sep, text = line.partition(': ')
+        if sep and len(text.split()) > 2:
+            queries.append(f'{text} #{len(queries)}')
+        if len(queries) == n:
+            break
+    return queries
+
+
+def run(encode, queries, clients):
+    """Per-query latencies and wall-clock seconds of clients threads sharing queries"""
+    latencies = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(clients + 1)
+
+    def client(own):
+        local = []
+        barrier.wait()
+        for query in own:
+            start = time.perf_counter()
+            encode([query])
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client, args=(queries[i::clients],)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--wait-ms', type=float, nargs='+', default=[2.0])
+    parser.add_argument('--max-batch', type=int, default=32)
+    parser.add_argument('--per-client', type=int, default=50)
+    parser.add_argument('--encoder', choices=['model', 'hashing'], default='model')
+    parser.add_argument('--model', default=os.environ.get('EMBEDDING_MODEL', 'all-mpnet-base-v2'))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    engine = HashingEngine() if args.encoder == 'hashing' else None
+    lp_service = LanguageProcessingService(model_name=args.model, engine=engine)
+
+    def encode(texts):
+        return lp_service.encode(texts, use_cache=False)
+
+    encode(make_queries(8, args.seed + 1))  # warm up the model
+
+    print(f'{"clients":>7} {"mode":<12} {"p50 ms":>8} {"p99 ms":>8} {"QPS":>8} {"batch":>6} {"queue ms":>9}')
+    for clients in args.clients:
+        queries = make_queries(clients * args.per_client, args.seed)
+        modes = [('unbatched', None)] + [(f'wait {wait:g}ms', wait) for wait in args.wait_ms]
+        for name, wait in modes:
+            if wait is None:
+                latencies, seconds = run(encode, queries, clients)
+                batch, queue_ms = 1.0, 0.0
+            else:
+                batcher = MicroBatcher(encode, max_wait_ms=wait, max_batch=args.max_batch)
+                latencies, seconds = run(batcher.encode, queries, clients)
+                stats = batcher.stats()
+                batch, queue_ms = stats['mean_batch_texts'], stats['mean_queue_ms']
+            ms = np.asarray(latencies) * 1000
+            print(f'{clients:>7} {name:<12} {np.percentile(ms, 50):>8.2f} {np.percentile(ms, 99):>8.2f} '
+                  f'{len(latencies) / seconds:>8.1f} {batch:>6.1f} {queue_ms:>9.2f}')
+
+
+if __name__ == '__main__':
+    main()
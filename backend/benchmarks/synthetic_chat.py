@@ -0,0 +1,122 @@
+"""Deterministic synthetic WhatsApp exports for benchmarks.
+
+Messages come from a fixed cast of senders with Zipf-like activity, word
+counts drawn from a log-normal distribution (mostly short replies, a long
+tail of paragraphs), bursty timestamps (quick exchanges separated by hours
+of silence) and topics that drift over the conversation, so embeddings
+cluster the way real chats do. A few messages are media placeholders,
+multi-line or carry sentiment words for VADER. The same seed always gives
+the same file.
+
+Usage (from backend/):
+    python -m benchmarks.synthetic_chat 100000 -o chat.txt --format ios
+"""
+import argparse
+import random
+from datetime import datetime, timedelta
+
+NAMES = [
+    'Ana Souza', 'Bruno Lima', 'Carla Mendes', 'Diego Alves', 'Elisa Rocha',
+    'Felipe Costa', 'Gabriela Dias', 'Hugo Martins', 'Isabela Nunes', 'João Pereira',
+    'Karen Gomes', 'Lucas Ribeiro', 'Marina Castro', 'Nina Barros', 'Otávio Freitas',
+    'Paula Teixeira', 'Rafael Moreira', 'Sofia Cardoso', 'Tiago Araújo', 'Vitória Pinto'
+]
+
+TOPICS = [
+    'dinner restaurant pizza reservation table hungry menu tonight order food',
+    'game match score team goal league season coach player stadium',
+    'exam deadline assignment professor class grade study library report',
+    'trip flight hotel beach weekend tickets airport luggage booking',
+    'movie series episode watch cinema trailer actor netflix season',
+    'work meeting project client deadline office report manager call',
+    'birthday party gift cake celebration surprise friends invite',
+    'weather rain sun cold hot forecast umbrella storm',
+    'music concert band album song playlist guitar festival',
+    'family mom dad sister brother visit sunday lunch home'
+]
+
+FILLER = (
+    'i you we it the a to and of is are was so just really now later '
+    'today tomorrow yes no maybe ok sure what when where why how can do '
+    'think know see get go come need want like have'
+).split()
+
+SENTIMENT_WORDS = ['great', 'love', 'awesome', 'happy', 'thanks', 'bad', 'hate', 'terrible', 'sad', 'sorry']
+
+SHORT_REPLIES = ['ok', 'kkkk', 'haha', 'yes', 'no', 'sure', 'thanks!', 'lol', '👍', 'on my way']
+
+MEDIA = '<Media omitted>'
+
+HEADERS = {
+    'android': lambda ts: ts.strftime('%d/%m/%Y, %H:%M') + ' - ',
+    'ios': lambda ts: ts.strftime('[%d/%m/%Y, %H:%M:%S] ')
+}
+
+
+def iter_export_lines(n_messages, seed=0, export_format='android', senders=8,
+                      start=datetime(2022, 1, 1, 8, 0)):
+    """Yield the lines of a synthetic export holding n_messages messages"""
+    rng = random.Random(seed)
+    names = NAMES[:max(2, min(senders, len(NAMES)))]
+    weights = [1 / (rank + 1) ** 1.1 for rank in range(len(names))]
+    topics = [topic.split() for topic in TOPICS]
+    header = HEADERS[export_format]
+
+    timestamp = start
+    topic = rng.randrange(len(topics))
+    yield header(timestamp) + 'Messages and calls are end-to-end encrypted. No one outside of this chat can read them.'
+
+    for _ in range(n_messages):
+        if rng.random() < 0.85:
+            timestamp += timedelta(seconds=rng.expovariate(1 / 45))
+        else:
+            timestamp += timedelta(seconds=rng.expovariate(1 / 10800))
+        if rng.random() < 0.05:
+            topic = rng.randrange(len(topics))
+
+        sender = rng.choices(names, weights)[0]
+        yield header(timestamp) + sender + ': ' + _message_text(rng, topics[topic])
+
+
+def _message_text(rng, topic_words):
+    roll = rng.random()
+    if roll < 0.03:
+        return MEDIA
+    if roll < 0.15:
+        return rng.choice(SHORT_REPLIES)
+
+    n_words = min(200, max(1, int(rng.lognormvariate(1.8, 0.8))))
+    words = [
+        rng.choice(topic_words) if rng.random() < 0.35 else rng.choice(FILLER)
+        for _ in range(n_words)
+    ]
+    if rng.random() < 0.2:
+        words.insert(rng.randrange(len(words) + 1), rng.choice(SENTIMENT_WORDS))
+    if n_words > 12 and rng.random() < 0.1:
+        # Multi-line message: continuation lines carry no header
+        words[n_words // 2] += '\n'
+    text = ' '.join(words).replace('\n ', '\n')
+    return text[0].upper() + text[1:] + rng.choice(['', '', '.', '!', '?', ' 😂'])
+
+
+def write_export(path, n_messages, seed=0, export_format='android', senders=8):
+    with open(path, 'w', encoding='utf-8') as f:
+        for line in iter_export_lines(n_messages, seed, export_format, senders):
+            f.write(line + '\n')
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('messages', type=int)
+    parser.add_argument('-o', '--output', default='synthetic_chat.txt')
+    parser.add_argument('--format', choices=sorted(HEADERS), default='android')
+    parser.add_argument('--senders', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    write_export(args.output, args.messages, args.seed, args.format, args.senders)
+    print(f'Wrote {args.messages} messages to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
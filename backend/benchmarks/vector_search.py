@@ -0,0 +1,191 @@
+"""Recall and latency of chat-scoped KNN against brute-force ground truth.
+
+Builds a throwaway database with synthetic embeddings spread over several
+chats, then for random queries compares:
+  partitioned - message_vectors with the chat_id partition key (current)
+  global      - the previous layout: KNN over one unpartitioned vec0 table,
+                filtered by chat afterwards
+
+With --matrix, chat-scoped search through vec0 (float storage) is compared
+with the memory-mapped NumPy backend (MatrixStore) on the same queries.
+
+With --storage, the database is then converted to each listed vector storage
+mode in turn and the file size, QPS and recall@k of chat-scoped search are
+reported per mode.
+
+Usage (from backend/):
+    python -m benchmarks.vector_search --chats 20 --per-chat 5000 --queries 100
+    python -m benchmarks.vector_search --chats 5 --per-chat 200000 --matrix
+    python -m benchmarks.vector_search --storage float int8 bit
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from services.database import DatabaseService
+from services.matrix_store import MatrixStore
+from services.vector_store import VectorStore
+
+DIM = 768
+
+
+def synthetic_chat(rng, n, n_topics=20):
+    """Unit vectors drawn around a few topic centroids, like real chat embeddings"""
+    centroids = rng.standard_normal((n_topics, DIM)).astype(np.float32)
+    vectors = centroids[rng.integers(0, n_topics, n)] + 0.5 * rng.standard_normal((n, DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def build(db, rng, chats, per_chat):
+    vectors = {}
+    for c in range(chats):
+        chat_id = f'bench_{c}'
+        emb = synthetic_chat(rng, per_chat)
+        db.store_messages(chat_id, [
+            {
+                'timestamp': f'2024-01-01T00:00:{i % 60:02d}',
+                'sender': f'user{i % 5}',
+                'message': f'message {i}',
+                'sentiment': 0.0,
+                'cluster_x': None,
+                'cluster_y': None,
+                'embedding': emb[i]
+            }
+            for i in range(per_chat)
+        ])
+        with db._connection() as conn:
+            ids = [row[0] for row in conn.execute('SELECT id FROM messages WHERE chat_id = ? ORDER BY id', (chat_id,))]
+        vectors[chat_id] = (np.array(ids), emb)
+    return vectors
+
+
+def build_global_table(db):
+    with db._connection() as conn:
+        conn.execute('CREATE VIRTUAL TABLE global_vectors USING vec0(id INTEGER PRIMARY KEY, embedding FLOAT[768])')
+        conn.execute('INSERT INTO global_vectors (id, embedding) SELECT id, embedding FROM message_vectors')
+        conn.commit()
+
+
+def global_knn(db, chat_id, query_blob, k):
+    with db._connection() as conn:
+        rows = conn.execute('''
+            SELECT m.id FROM global_vectors v JOIN messages m ON m.id = v.id
+            WHERE v.embedding MATCH ? AND m.chat_id = ? AND v.k = ?
+            ORDER BY v.distance
+        ''', (query_blob, chat_id, k)).fetchall()
+    return [row[0] for row in rows]
+
+
+def make_queries(rng, vectors, n, k):
+    """(chat_id, query, true top-k ids) triples with brute-force ground truth"""
+    queries = []
+    chat_ids = list(vectors)
+    for _ in range(n):
+        chat_id = chat_ids[rng.integers(len(chat_ids))]
+        ids, emb = vectors[chat_id]
+        query = emb[rng.integers(len(emb))] + 0.1 * rng.standard_normal(DIM).astype(np.float32)
+        distances = np.linalg.norm(emb - query, axis=1)
+        queries.append((chat_id, query, set(ids[np.argsort(distances)[:k]].tolist())))
+    return queries
+
+
+def compare_backends(db, vectors, queries, k):
+    """p50/p95 latency and recall@k of vec0 against MatrixStore for the same chat-scoped queries"""
+    matrices = MatrixStore(db.db_path)
+    for chat_id, (ids, emb) in vectors.items():
+        matrices.write(chat_id, ids, emb)
+
+    results = {'vec0': ([], []), 'matrix': ([], [])}
+    for chat_id, query, truth in queries:
+        # Cold first search per chat maps the file; keep it out of the latencies
+        matrices.knn(chat_id, query, k)
+        with db._connection() as conn:
+            start = time.perf_counter()
+            found = [message_id for message_id, _ in db.vectors.knn(conn, chat_id, query, k)]
+            results['vec0'][0].append(time.perf_counter() - start)
+            results['vec0'][1].append(len(truth & set(found)) / k)
+
+        start = time.perf_counter()
+        found = [message_id for message_id, _ in matrices.knn(chat_id, query, k)]
+        results['matrix'][0].append(time.perf_counter() - start)
+        results['matrix'][1].append(len(truth & set(found)) / k)
+
+    print(f'\n{"backend":<8} {"recall@%d" % k:>10} {"p50 ms":>8} {"p95 ms":>8}')
+    for name, (latencies, recalls) in results.items():
+        print(f'{name:<8} {np.mean(recalls):>10.3f} {percentile(latencies, 50):>8.2f} {percentile(latencies, 95):>8.2f}')
+    for chat_id in vectors:
+        matrices.delete(chat_id)
+
+
+def compare_storage(db, queries, storages, k):
+    print(f'\n{"storage":<8} {"size MB":>9} {"QPS":>8} {"recall@%d" % k:>10} {"p95 ms":>8}')
+    for storage in storages:
+        size = db.convert_vector_storage(storage)['bytes_after']
+        latencies, recalls = [], []
+        for chat_id, query, truth in queries:
+            start = time.perf_counter()
+            found = [r['id'] for r in db.search_similar_messages(chat_id, query, k)]
+            latencies.append(time.perf_counter() - start)
+            recalls.append(len(truth & set(found)) / k)
+        print(f'{storage:<8} {size / 1024 / 1024:>9.1f} {len(latencies) / sum(latencies):>8.1f} '
+              f'{np.mean(recalls):>10.3f} {percentile(latencies, 95):>8.2f}')
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) * 1000 if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chats', type=int, default=20)
+    parser.add_argument('--per-chat', type=int, default=5000)
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--matrix', action='store_true', help='compare vec0 with the memory-mapped NumPy backend')
+    parser.add_argument('--storage', nargs='*', choices=VectorStore.STORAGES, default=[],
+                        help='vector storage modes to compare after the layout comparison')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    tmpdir = tempfile.mkdtemp(prefix='bench_vec_')
+    db = DatabaseService(db_path=os.path.join(tmpdir, 'bench.db'))
+
+    print(f'Building {args.chats} chats x {args.per_chat} vectors...')
+    vectors = build(db, rng, args.chats, args.per_chat)
+    build_global_table(db)
+
+    results = {'partitioned': ([], []), 'global': ([], [])}
+    queries = make_queries(rng, vectors, args.queries, args.k)
+    for chat_id, query, truth in queries:
+        query_blob = query.astype(np.float32).tobytes()
+
+        start = time.perf_counter()
+        found = [r['id'] for r in db.search_similar_messages(chat_id, query, args.k)]
+        results['partitioned'][0].append(time.perf_counter() - start)
+        results['partitioned'][1].append(len(truth & set(found)) / args.k)
+
+        start = time.perf_counter()
+        found = global_knn(db, chat_id, query_blob, args.k)
+        results['global'][0].append(time.perf_counter() - start)
+        results['global'][1].append(len(truth & set(found)) / args.k)
+
+    print(f'{"layout":<12} {"recall@%d" % args.k:>10} {"p50 ms":>8} {"p95 ms":>8}')
+    for name, (latencies, recalls) in results.items():
+        print(f'{name:<12} {np.mean(recalls):>10.3f} {percentile(latencies, 50):>8.2f} {percentile(latencies, 95):>8.2f}')
+
+    if args.matrix:
+        compare_backends(db, vectors, queries, args.k)
+
+    if args.storage:
+        with db._connection() as conn:
+            conn.execute('DROP TABLE global_vectors')
+            conn.commit()
+        compare_storage(db, queries, args.storage, args.k)
+
+
+if __name__ == '__main__':
+    main()
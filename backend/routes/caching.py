@@ -0,0 +1,79 @@
+"""Conditional GET for read routes whose content only changes with a chat's version.
+
+A response's ETag is derived from the content version (bumped by every
+write, see DatabaseService.get_chat_version) and the request path with its
+query string, so a client holding the current ETag gets a 304 for the cost
+of one primary-key lookup. Serialized bodies are kept in a byte-bounded
+LRU under the same key; keys carry the version, so entries never go stale
+and a write only makes them unreachable until they are evicted. Bodies
+over a quarter of the budget are not kept, so one huge response cannot
+flush every hot one.
+"""
+import hashlib
+import json
+import os
+
+from flask import Response, request
+
+from services import registry
+from services.lru_cache import TTLCache
+
+# Scope of the chat list, which changes with any chat
+ALL_CHATS = '*'
+
+RESPONSE_CACHE_BYTES = int(os.environ.get('RESPONSE_CACHE_MB', 64)) * 1024 * 1024
+MAX_CACHED_BODY_BYTES = RESPONSE_CACHE_BYTES // 4
+
+response_cache = TTLCache(max_size=100000, ttl=float('inf'), max_bytes=RESPONSE_CACHE_BYTES)
+# Entries of older versions are unreachable anyway; free their memory now
+registry.get_db_service().add_change_listener(
+    lambda chat_id: response_cache.invalidate(lambda key: key[0] in (chat_id, ALL_CHATS))
+)
+
+
+def cached_json(scope, version, build):
+    """JSON response for build(), or 304 if the client's If-None-Match is current.
+
+    build() returns JSON-serializable data or an already serialized body and
+    is only called on a cache miss. With version None (unknown chat) the
+    response is built every time and carries no ETag.
+    """
+    if version is None:
+        return json_response(serialize(build()))
+
+    etag = version_etag(scope, version)
+    if etag in request.if_none_match:
+        return conditional(Response(status=304), etag)
+
+    key = (scope, etag)
+    body = response_cache.get(key)
+    if body is None:
+        body = serialize(build())
+        if len(body) <= MAX_CACHED_BODY_BYTES:
+            response_cache.set(key, body, len(body))
+    return conditional(json_response(body), etag)
+
+
+def version_etag(scope, version):
+    """ETag of the current request's response at a content version"""
+    digest = hashlib.sha1(f'{version}|{request.full_path}'.encode('utf-8')).hexdigest()[:16]
+    return f'{scope}-v{version}-{digest}'
+
+
+def conditional(response, etag):
+    """Mark a response with its ETag, cacheable but to be revalidated on every use"""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def serialize(data):
+    if isinstance(data, bytes):
+        return data
+    if isinstance(data, str):
+        return data.encode('utf-8')
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+def json_response(body):
+    return Response(body, mimetype='application/json')
@@ -1,39 +1,265 @@
 from flask import Blueprint, request, jsonify
-from services.database import DatabaseService
-from services.language_processing import LanguageProcessingService
+import time
+from routes.caching import cached_json
+from services import registry
+from services.embedding_cache import normalize_text
+from services.lru_cache import TTLCache
 
 embeddings_bp = Blueprint('embeddings', __name__)
-db_service = DatabaseService()
-lp_service = LanguageProcessingService()
+db_service = registry.get_db_service()
+
+# Repeated and paged searches skip the model (and the KNN) entirely. Result
+# lists are dropped whenever their chat is written; the TTL bounds staleness
+# from writes made by other worker processes.
+query_embedding_cache = TTLCache(max_size=2048, ttl=3600)
+search_result_cache = TTLCache(max_size=512, ttl=300)
+# Map extents fix each chat's binning grid; recomputing one scans the chat's index
+map_extent_cache = TTLCache(max_size=256, ttl=3600)
+MAX_BATCH_QUERIES = 256
+MAX_SEARCH_LIMIT = 1000
+MAX_MAP_POINTS = 5000
+MAX_MAP_ZOOM = 6
+db_service.add_change_listener(
+    lambda chat_id: search_result_cache.invalidate(lambda key: key[0] == chat_id)
+)
+db_service.add_change_listener(
+    lambda chat_id: map_extent_cache.invalidate(lambda key: key == chat_id)
+)
+
+
+def get_query_embedding(query):
+    """Embedding of a search query, served from the in-memory LRU when possible"""
+    return get_query_embeddings([query])[0]
+
+
+def get_query_embeddings(queries):
+    """Embeddings of several queries; the ones not in the LRU are encoded in one (micro-batched) call"""
+    lp_service = registry.get_language_processing_service()
+    keys = [(lp_service.engine.name, normalize_text(query)) for query in queries]
+    embeddings = [query_embedding_cache.get(key) for key in keys]
+
+    missing = {}
+    for i, (key, embedding) in enumerate(zip(keys, embeddings)):
+        if embedding is None:
+            missing.setdefault(key, []).append(i)
+    if missing:
+        # Encoded together with the queries of concurrent requests
+        encoded = registry.get_query_batcher().encode([queries[positions[0]] for positions in missing.values()])
+        for (key, positions), embedding in zip(missing.items(), encoded):
+            query_embedding_cache.set(key, embedding)
+            for i in positions:
+                embeddings[i] = embedding
+    return embeddings
+
+
+def parse_batch_searches(data):
+    """(query, chat_ids, limit) per entry of a batch search body, defaults taken from the top level"""
+    entries = data.get('queries')
+    if not isinstance(entries, list) or not entries:
+        raise ValueError('queries must be a non-empty list')
+    if len(entries) > MAX_BATCH_QUERIES:
+        raise ValueError(f'At most {MAX_BATCH_QUERIES} queries per batch')
+
+    searches = []
+    for i, entry in enumerate(entries):
+        if isinstance(entry, str):
+            entry = {'query': entry}
+        if not isinstance(entry, dict) or not isinstance(entry.get('query'), str) or not entry['query'].strip():
+            raise ValueError(f'queries[{i}] needs a query string')
+
+        chat_ids = entry.get('chat_ids') or data.get('chat_ids')
+        chat_id = entry.get('chat_id') or data.get('chat_id')
+        if not chat_ids:
+            chat_ids = [chat_id] if chat_id else []
+        if not isinstance(chat_ids, list) or not chat_ids:
+            raise ValueError(f'queries[{i}] needs a chat_id or chat_ids')
+
+        limit = entry.get('limit', data.get('limit', 10))
+        if not isinstance(limit, int) or not 1 <= limit <= MAX_SEARCH_LIMIT:
+            raise ValueError(f'queries[{i}] limit must be between 1 and {MAX_SEARCH_LIMIT}')
+
+        searches.append((entry['query'], list(dict.fromkeys(chat_ids)), limit))
+    return searches
+
 
 @embeddings_bp.route('/search', methods=['POST'])
 def search_messages():
     """Search for similar messages using vector similarity"""
+    data = request.get_json(silent=True) or {}
+    query = data.get('query')
+    chat_id = data.get('chat_id')
+    limit = data.get('limit', 10)
+    if not isinstance(query, str) or not query.strip() or not chat_id:
+        return jsonify({'error': 'Query and chat_id are required'}), 400
+    if not isinstance(limit, int) or not 1 <= limit <= MAX_SEARCH_LIMIT:
+        return jsonify({'error': f'limit must be between 1 and {MAX_SEARCH_LIMIT}'}), 400
+
     try:
-        data = request.get_json()
-        query = data.get('query')
-        chat_id = data.get('chat_id')
-        limit = data.get('limit', 10)
-        
-        if not query or not chat_id:
-            return jsonify({'error': 'Query and chat_id are required'}), 400
-        
-        # Generate embedding for search query
-        query_embedding = lp_service.generate_embeddings([query])[0]
-        
-        # Search similar messages
-        results = db_service.search_similar_messages(chat_id, query_embedding, limit)
+        result_key = (chat_id, normalize_text(query), limit)
+        results = search_result_cache.get(result_key)
+        if results is None:
+            # Generate embedding for search query
+            query_embedding = get_query_embedding(query)
+            
+            # Search similar messages
+            results = db_service.search_similar_messages(chat_id, query_embedding, limit)
+            search_result_cache.set(result_key, results)
         
         return jsonify(results)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@embeddings_bp.route('/search/batch', methods=['POST'])
+def search_messages_batch():
+    """Run many similarity searches, over one or several chats each, in one request.
+
+    Uncached queries are encoded in a single model call and every KNN runs
+    over one pooled connection. Results come back in request order; with
+    several chats, each query's hits are merged by distance.
+    """
+    try:
+        searches = parse_batch_searches(request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        # Each (chat, query, limit) lookup shares the single-search result cache
+        lookups = {}
+        for query, chat_ids, limit in searches:
+            for chat_id in chat_ids:
+                result_key = (chat_id, normalize_text(query), limit)
+                if result_key not in lookups:
+                    lookups[result_key] = (query, search_result_cache.get(result_key))
+
+        pending = [key for key, (_, results) in lookups.items() if results is None]
+        if pending:
+            embeddings = get_query_embeddings([lookups[key][0] for key in pending])
+            found = db_service.search_similar_messages_batch([
+                (key[0], embedding, key[2]) for key, embedding in zip(pending, embeddings)
+            ])
+            for key, results in zip(pending, found):
+                search_result_cache.set(key, results)
+                lookups[key] = (lookups[key][0], results)
+
+        response = []
+        for query, chat_ids, limit in searches:
+            hits = [
+                dict(result, chat_id=chat_id)
+                for chat_id in chat_ids
+                for result in lookups[(chat_id, normalize_text(query), limit)][1]
+            ]
+            if len(chat_ids) > 1:
+                hits = sorted(hits, key=lambda hit: hit['distance'])[:limit]
+            response.append({'query': query, 'results': hits})
+
+        return jsonify({'results': response})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@embeddings_bp.route('/search/hybrid', methods=['POST'])
+def search_messages_hybrid():
+    """Search a chat by keywords and meaning at once, fusing BM25 and vector ranks (RRF).
+
+    The Server-Timing header reports the milliseconds spent encoding the
+    query, in each ranking and in the fusion.
+    """
+    data = request.get_json(silent=True) or {}
+    query = data.get('query')
+    chat_id = data.get('chat_id')
+    limit = data.get('limit', 10)
+    if not isinstance(query, str) or not query.strip() or not chat_id:
+        return jsonify({'error': 'Query and chat_id are required'}), 400
+    if not isinstance(limit, int) or not 1 <= limit <= MAX_SEARCH_LIMIT:
+        return jsonify({'error': f'limit must be between 1 and {MAX_SEARCH_LIMIT}'}), 400
+
+    try:
+        start = time.perf_counter()
+        query_embedding = get_query_embedding(query)
+        timings = {'embed_ms': round((time.perf_counter() - start) * 1000, 3)}
+        results, search_timings = db_service.hybrid_search(chat_id, query, query_embedding, limit)
+        timings.update(search_timings)
+
+        response = jsonify(results)
+        response.headers['Server-Timing'] = server_timing(timings)
+        return response
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+def server_timing(timings):
+    """Server-Timing header value for {'<name>_ms': milliseconds}"""
+    return ', '.join(f"{name[:-3]};dur={ms}" for name, ms in timings.items())
+
+@embeddings_bp.route('/<chat_id>/project', methods=['POST'])
+def project_queries(chat_id):
+    """Place search queries on a chat's cluster map with its saved UMAP and KMeans models"""
+    data = request.get_json(silent=True) or {}
+    queries = data.get('queries') or ([data['query']] if data.get('query') else [])
+    if not isinstance(queries, list) or not queries or not all(isinstance(q, str) and q.strip() for q in queries):
+        return jsonify({'error': 'query or queries is required'}), 400
+    if len(queries) > MAX_BATCH_QUERIES:
+        return jsonify({'error': f'At most {MAX_BATCH_QUERIES} queries per request'}), 400
+
+    try:
+        projection = registry.get_projection_store().load(chat_id)
+        if projection is None:
+            return jsonify({'error': 'No saved cluster map for this chat'}), 404
+
+        embeddings = get_query_embeddings(queries)
+        coordinates = registry.get_language_processing_service().project(projection, embeddings)
+        return jsonify([
+            {'query': query, 'x': point['x'], 'y': point['y'], 'cluster': point['cluster']}
+            for query, point in zip(queries, coordinates)
+        ])
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@embeddings_bp.route('/<chat_id>/map', methods=['GET'])
+def get_cluster_map(chat_id):
+    """Level-of-detail cluster map: density bins when zoomed out, points when zoomed in.
+
+    Query parameters: x0, y0, x1, y1 (viewport in map coordinates, the
+    whole map by default), zoom (grid level, 0-MAX_MAP_ZOOM) and max_points.
+    Points carry no message text; fetch it per point from
+    /api/messages/<chat_id>/<message_id>.
+    """
+    try:
+        zoom = max(0, min(request.args.get('zoom', 0, type=int), MAX_MAP_ZOOM))
+        max_points = max(1, min(request.args.get('max_points', MAX_MAP_POINTS, type=int), MAX_MAP_POINTS))
+        bounds = [request.args.get(name, type=float) for name in ('x0', 'y0', 'x1', 'y1')]
+        if any(value is None for value in bounds) and any(value is not None for value in bounds):
+            raise ValueError('Viewport needs all of x0, y0, x1, y1')
+        viewport = tuple(bounds) if bounds[0] is not None else None
+        if viewport and (viewport[0] > viewport[2] or viewport[1] > viewport[3]):
+            raise ValueError('Viewport must have x0 <= x1 and y0 <= y1')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def build():
+        extent = map_extent_cache.get(chat_id)
+        if extent is None:
+            extent = db_service.get_map_extent(chat_id)
+            if extent is None:
+                return {'extent': None, 'zoom': zoom, 'mode': 'points', 'total': 0,
+                        'points': [], 'bins': [], 'clusters': []}
+            map_extent_cache.set(chat_id, extent)
+
+        result = db_service.get_cluster_map(chat_id, extent, viewport, zoom, max_points)
+        result.update(extent=extent, zoom=zoom)
+        return result
+
+    try:
+        return cached_json(chat_id, db_service.get_chat_version(chat_id), build)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @embeddings_bp.route('/<chat_id>/clusters', methods=['GET'])
 def get_clusters(chat_id):
     """Get cluster coordinates for visualization"""
     try:
-        clusters = db_service.get_cluster_coordinates(chat_id)
-        return jsonify(clusters)
+        return cached_json(
+            chat_id, db_service.get_chat_version(chat_id), lambda: db_service.get_cluster_coordinates(chat_id)
+        )
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1,29 +1,140 @@
-from flask import Blueprint, request, jsonify
-from services.database import DatabaseService
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from datetime import datetime
-import re
-from services.language_processing import LanguageProcessingService
+import base64
+import json
+import os
+import tempfile
+import time
+from routes.caching import ALL_CHATS, cached_json, conditional, version_etag
+from services import registry
+from services.jobs import JobService, QueueFullError
+from services.whatsapp_parser import iter_message_batches, iter_new_message_batches
 
-language_processing_service = LanguageProcessingService()
 messages_bp = Blueprint('messages', __name__)
-db_service = DatabaseService()
+db_service = registry.get_db_service()
+
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 5000
+
+# Uploads are processed in the background; cap concurrent jobs so a burst of
+# uploads cannot take every core away from the search endpoints
+UPLOAD_STAGES = ('parse', 'embed', 'sentiment', 'cluster', 'store')
+job_service = JobService(
+    max_workers=int(os.environ.get('UPLOAD_MAX_WORKERS', 1)),
+    max_pending=int(os.environ.get('UPLOAD_MAX_PENDING', 20))
+)
 
 @messages_bp.route('/chats', methods=['GET'])
 def get_chats():
     """Get list of all chats"""
     try:
-        chats = db_service.get_chats()
-        return jsonify(chats)
+        return cached_json(ALL_CHATS, db_service.get_chats_version(), db_service.get_chats)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @messages_bp.route('/<chat_id>', methods=['GET'])
 def get_messages(chat_id):
-    """Get messages for a specific chat"""
+    """Get one page of messages for a chat.
+
+    Query parameters: limit (page size, capped at MAX_PAGE_SIZE), cursor (the
+    next_cursor of the previous page) and fields (comma-separated columns).
+    The page is streamed as {"messages": [...], "next_cursor": ...}, with
+    next_cursor null on the last page. Pages of stored chats carry an ETag,
+    and a current If-None-Match is answered with 304 before any row is read.
+    """
+    try:
+        page_size = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+        page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+        after = decode_cursor(request.args.get('cursor'))
+        fields = request.args.get('fields')
+        columns = db_service.message_columns(fields.split(',') if fields else None)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        version = db_service.get_chat_version(chat_id)
+        etag = version_etag(chat_id, version) if version is not None else None
+        if etag is not None and etag in request.if_none_match:
+            return conditional(Response(status=304), etag)
+        
+        # One extra row tells whether another page follows
+        rows = db_service.iter_messages(chat_id, after=after, limit=page_size + 1, columns=columns)
+        response = Response(stream_with_context(stream_page(rows, page_size)), mimetype='application/json')
+        return conditional(response, etag) if etag is not None else response
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+def stream_page(rows, page_size, chunk_rows=500):
+    """Serialize a page of rows as chunked JSON, ending with the next-page cursor"""
+    yield '{"messages": ['
+    count = 0
+    last = None
+    next_cursor = None
+    chunk = []
+    try:
+        for row in rows:
+            if count == page_size:
+                next_cursor = encode_cursor(last)
+                break
+            chunk.append(json.dumps(row))
+            last = row
+            count += 1
+            if len(chunk) == chunk_rows:
+                yield ('' if count == len(chunk) else ',') + ','.join(chunk)
+                chunk = []
+    finally:
+        # Hand the pooled connection back even if the page was cut short
+        rows.close()
+    if chunk:
+        yield ('' if count == len(chunk) else ',') + ','.join(chunk)
+    yield '], "next_cursor": %s}' % json.dumps(next_cursor)
+
+
+def encode_cursor(row):
+    raw = json.dumps([row['timestamp'], row['id']]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        timestamp, message_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return str(timestamp), int(message_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+@messages_bp.route('/<chat_id>/<int:message_id>', methods=['GET'])
+def get_message(chat_id, message_id):
+    """Get a single message with its text, e.g. for a point picked on the cluster map"""
+    try:
+        message = db_service.get_message(chat_id, message_id)
+        if message is None:
+            return jsonify({'error': 'Message not found'}), 404
+        return jsonify(message)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@messages_bp.route('/<chat_id>/search', methods=['GET'])
+def keyword_search(chat_id):
+    """Full-text search of a chat's messages, best BM25 match first.
+
+    Query parameters: q (terms, all of which must match unless any=1) and
+    limit (capped at MAX_PAGE_SIZE).
+    """
+    query = request.args.get('q', '')
+    if not query.strip():
+        return jsonify({'error': 'q is required'}), 400
+    limit = max(1, min(request.args.get('limit', 50, type=int), MAX_PAGE_SIZE))
+    match_all = request.args.get('any') != '1'
+
     try:
-        limit = request.args.get('limit', type=int)
-        messages = db_service.get_messages(chat_id, limit)
-        return jsonify(messages)
+        start = time.perf_counter()
+        results = db_service.keyword_search(chat_id, query, limit, match_all=match_all)
+        response = jsonify(results)
+        response.headers['Server-Timing'] = f'bm25;dur={round((time.perf_counter() - start) * 1000, 3)}'
+        return response
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -31,13 +142,44 @@ def get_messages(chat_id):
 def get_chat_stats(chat_id):
     """Get aggregated statistics for a chat"""
     try:
-        stats = db_service.get_chat_stats(chat_id)
-        return jsonify(stats)
+        return cached_json(chat_id, db_service.get_chat_version(chat_id), lambda: db_service.get_chat_stats(chat_id))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@messages_bp.route('/<chat_id>/timeline', methods=['GET'])
+def get_chat_timeline(chat_id):
+    """Get message counts per sender, bucketed by day, week or month"""
+    try:
+        granularity = request.args.get('granularity', 'day')
+        return cached_json(
+            chat_id, db_service.get_chat_version(chat_id), lambda: db_service.get_timeline(chat_id, granularity)
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@messages_bp.route('/<chat_id>/sentiment', methods=['GET'])
+def get_chat_sentiment(chat_id):
+    """Get average/min/max sentiment, bucketed by day, week or month"""
+    try:
+        granularity = request.args.get('granularity', 'day')
+        return cached_json(
+            chat_id, db_service.get_chat_version(chat_id), lambda: db_service.get_sentiment_timeline(chat_id, granularity)
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @messages_bp.route('', methods=['POST'])
 def upload_chat():
+    """Queue an uploaded chat for processing and return its job id.
+
+    With mode=append and the chat_id of an existing chat, the file is taken
+    as a newer export of that chat and only the messages after the stored
+    ones are processed and added.
+    """
     try:
         if 'file' not in request.files:
             return jsonify({'error': 'No file provided'}), 400
@@ -46,49 +188,104 @@ def upload_chat():
         if file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
         
-        # Read and parse WhatsApp chat file
-        content = file.read().decode('utf-8')
-        messages = parse_whatsapp_chat(content)
+        append = request.form.get('mode') == 'append'
+        if append:
+            chat_id = request.form.get('chat_id')
+            if not chat_id:
+                return jsonify({'error': 'chat_id is required to append'}), 400
+            if not db_service.chat_exists(chat_id):
+                return jsonify({'error': 'Chat not found'}), 404
+        else:
+            chat_id = f"chat_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
         
-        processed_data = language_processing_service.process_chat_data(messages)
-        # Store in database
-        chat_id = f"chat_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        db_service.store_messages(chat_id, processed_data)
+        # The request stream is gone once we return, so spool the upload to disk
+        fd, path = tempfile.mkstemp(prefix='chat_upload_', suffix='.txt')
+        with os.fdopen(fd, 'wb') as f:
+            file.save(f)
+        
+        try:
+            job_id = job_service.submit(process_upload, UPLOAD_STAGES, path, chat_id, append)
+        except QueueFullError as e:
+            os.remove(path)
+            return jsonify({'error': str(e)}), 429
         
         return jsonify({
             'success': True,
-            'chat_id': chat_id,
-            'message_count': len(messages)
-        })
+            'job_id': job_id,
+            'chat_id': chat_id
+        }), 202
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
-def parse_whatsapp_chat(content):
-    """Parse WhatsApp chat export format"""
-    messages = []
-    lines = content.split('\n')
-    
-    # WhatsApp format: [DD/MM/YYYY, HH:MM:SS] Sender: Message
-    pattern = r'\[(\d{2}/\d{2}/\d{4}), (\d{2}:\d{2}:\d{2})\] ([^:]+): (.+)'
-    
-    for line in lines:
-        match = re.match(pattern, line)
-        if match:
-            date_str, time_str, sender, message = match.groups()
+@messages_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Get status and per-stage progress of an upload job"""
+    job = job_service.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+
+def process_upload(job, path, chat_id, append=False):
+    """Background job: parse -> embed -> sentiment -> cluster -> store.
+
+    When appending, messages the chat already holds are dropped right after
+    parsing, and the rest are placed on the chat's saved map by transform,
+    so the cost of the model stages follows the new messages only.
+    """
+    try:
+        total_bytes = os.path.getsize(path) or 1
+        projection_store = registry.get_projection_store()
+        projection = None
+        tail = None
+        if append:
+            projection = projection_store.load(chat_id)
+            tail = db_service.get_chat_tail(chat_id)
+        
+        with open(path, 'rb') as raw:
+            def batches():
+                # Batch k has been embedded and scored once the pipeline asks
+                # for batch k + 1, so the parse position tracks all three stages
+                for batch in iter_message_batches(raw):
+                    done = raw.tell() / total_bytes
+                    yield batch
+                    for stage in ('parse', 'embed', 'sentiment'):
+                        job.report(stage, done)
+                job.report('parse', 1.0)
             
-            # Parse datetime
-            datetime_str = f"{date_str} {time_str}"
-            try:
-                timestamp = datetime.strptime(datetime_str, '%d/%m/%Y %H:%M:%S')
-            except ValueError:
-                continue
+            parsed = batches()
+            if tail is not None:
+                parsed = iter_new_message_batches(parsed, *tail)
             
-            messages.append({
-                'timestamp': timestamp.isoformat(),
-                'sender': sender.strip(),
-                'message': message.strip()
-            })
-    
-    return messages
\ No newline at end of file
+            language_processing_service = registry.get_language_processing_service()
+            processed_data, fitted, timings = language_processing_service.analyze_message_batches(
+                parsed, progress_callback=job.report, projection=projection, refit=not append
+            )
+        
+        if append and projection is None and processed_data:
+            # Chats stored before projections were saved: place new messages
+            # next to their nearest neighbours on the existing map
+            coordinates = db_service.neighbour_coordinates(chat_id, [data['embedding'] for data in processed_data])
+            for data, (x, y) in zip(processed_data, coordinates):
+                data['cluster_x'], data['cluster_y'] = x, y
+        
+        job.report('store', 0.0)
+        store_start = time.perf_counter()
+        if processed_data or not append:
+            db_service.store_messages(chat_id, processed_data, append=append)
+        if fitted is not None and not append:
+            projection_store.save(chat_id, fitted)
+        timings['store'] = {'seconds': round(time.perf_counter() - store_start, 3)}
+        job.report('store', 1.0)
+        
+        return {
+            'chat_id': chat_id,
+            'message_count': len(processed_data),
+            'appended': append,
+            'cluster_stats': fitted.get('fit_stats') if fitted is not None and not append else None,
+            'timings': timings
+        }
+    finally:
+        os.remove(path)
@@ -1,9 +1,14 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
+import os
+import time
 
 # Import our services and routes
+from services import registry
+from services.metrics import REGISTRY
 from routes.messages import messages_bp
-from routes.embeddings import embeddings_bp
+from routes.embeddings import embeddings_bp, query_embedding_cache, search_result_cache
+from routes.caching import response_cache
 
 app = Flask(__name__)
 CORS(app)
@@ -12,10 +17,92 @@ CORS(app)
 app.register_blueprint(messages_bp, url_prefix='/api/messages')
 app.register_blueprint(embeddings_bp, url_prefix='/api/embeddings')
 
+REQUEST_SECONDS = REGISTRY.histogram('chat_http_request_seconds', 'Request handling time by route, method and status')
+
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def observe_request(response):
+    # Streamed bodies (message pages) are timed up to their first chunk
+    start = g.pop('request_start', None)
+    if start is not None:
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            route=request.url_rule.rule if request.url_rule else 'unmatched',
+            method=request.method,
+            status=response.status_code
+        )
+    return response
+
+
+def component_stats():
+    """stats() of the pool, caches and, once loaded, the models"""
+    stats = {
+        'db_pool': registry.get_db_service().pool_stats(),
+        'embedding_cache': registry.get_embedding_cache().stats(),
+        'query_embedding_cache': query_embedding_cache.stats(),
+        'search_result_cache': search_result_cache.stats(),
+        'projection_cache': registry.get_projection_store().stats(),
+        'response_cache': response_cache.stats()
+    }
+    if registry.get_db_service().matrices is not None:
+        stats['matrix_store'] = registry.get_db_service().matrices.stats()
+    if registry.language_processing_loaded():
+        lp_service = registry.get_language_processing_service()
+        stats['embedding_engine'] = lp_service.engine.stats()
+        stats['sentiment'] = lp_service.sentiment.stats()
+        stats['query_batcher'] = registry.get_query_batcher().stats()
+    return stats
+
+
+REGISTRY.add_collector(lambda: {'chat_' + name: stats for name, stats in component_stats().items()})
+
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    return jsonify({'status': 'OK', 'message': 'WhatsApp Chat Backend is running'})
+    """Liveness: the process is up and serving, whether or not the model is loaded.
+
+    Probed often, so it does no pool or cache work; component stats are in /api/metrics.
+    """
+    return jsonify({
+        'status': 'OK',
+        'message': 'WhatsApp Chat Backend is running',
+        'ready': registry.readiness()['ready']
+    })
+
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Span histograms, counters and component stats in the Prometheus text format"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/metrics/slow-queries', methods=['GET'])
+def slow_queries():
+    """Recent statements over SLOW_QUERY_MS with their EXPLAIN QUERY PLAN, newest first"""
+    log = registry.get_db_service().slow_queries
+    if log is None:
+        return jsonify({'error': 'Slow query log is disabled, set SLOW_QUERY_MS to enable it'}), 404
+    return jsonify({'threshold_ms': log.threshold_ms, 'queries': log.entries()})
+
+
+@app.route('/api/health/ready', methods=['GET'])
+def readiness_check():
+    """Readiness: 200 once the language model is loaded, 503 until then"""
+    readiness = registry.readiness()
+    return jsonify(readiness), 200 if readiness['ready'] else 503
 
 
 if __name__ == '__main__':
+    # Load the model in the background so /api/health answers immediately;
+    # set MODEL_WARMUP=0 to load it on the first request that needs it instead.
+    # With debug on, the reloader's parent process only watches files and
+    # restarts the child that serves (WERKZEUG_RUN_MAIN=true), so only the
+    # child warms up.
+    if os.environ.get('MODEL_WARMUP', '1') == '1' and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        registry.warmup(background=True)
     app.run(debug=True, port=5002)
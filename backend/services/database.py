@@ -2,200 +2,995 @@ import pysqlite3 as sqlite3
 import sqlite_vec
 import numpy as np
 import datetime
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from services.matrix_store import MatrixStore
+from services.metrics import REGISTRY, SlowQueryLog
+from services.vector_store import VectorStore
+
+STATEMENT_SECONDS = REGISTRY.histogram(
+    'chat_db_statement_seconds', 'SQLite statement execution time by operation and table'
+)
+METHOD_SECONDS = REGISTRY.histogram(
+    'chat_db_method_seconds', 'DatabaseService call time by method'
+)
+
+_STATEMENT_OP = re.compile(r'\s*(\w+)')
+_STATEMENT_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE(?:\s+IF\s+NOT\s+EXISTS)?)\s+(\w+)', re.IGNORECASE)
+_EXPLAINABLE = ('select', 'with', 'insert', 'update', 'delete', 'replace')
+_statement_labels = {}
+
+
+def statement_labels(sql):
+    """Low-cardinality labels for a statement: its first keyword and first table"""
+    labels = _statement_labels.get(sql)
+    if labels is None:
+        op = _STATEMENT_OP.match(sql)
+        table = _STATEMENT_TABLE.search(sql)
+        labels = {'op': op.group(1).lower() if op else '', 'table': table.group(1) if table else ''}
+        # IN (?, ?, ...) lists make some statements unique per call
+        if len(_statement_labels) >= 4096:
+            _statement_labels.clear()
+        _statement_labels[sql] = labels
+    return labels
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor timing each statement into chat_db_statement_seconds.
+
+    SQLite runs a query up to its first row in execute, so for SELECTs the
+    span covers the time to the first row, not the fetches after it.
+    """
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.connection.observe(sql, parameters, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self.connection.observe(sql, None, time.perf_counter() - start)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose statements are timed; with a slow_query_log, the ones
+    over its threshold are recorded with their EXPLAIN QUERY PLAN"""
+
+    slow_query_log = None
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def observe(self, sql, parameters, seconds):
+        STATEMENT_SECONDS.observe(seconds, **statement_labels(sql))
+        log = self.slow_query_log
+        if log is not None and seconds * 1000 >= log.threshold_ms:
+            log.record(sql, seconds, self.query_plan(sql, parameters))
+
+    def query_plan(self, sql, parameters):
+        if parameters is None or statement_labels(sql)['op'] not in _EXPLAINABLE:
+            return None
+        try:
+            # A plain cursor, so the EXPLAIN itself is neither timed nor logged
+            rows = sqlite3.Cursor(self).execute('EXPLAIN QUERY PLAN ' + sql, parameters).fetchall()
+        except sqlite3.Error as e:
+            return [f'unavailable: {e}']
+        return [row[3] for row in rows]
+
+
+class ConnectionPool:
+    """Bounded pool of SQLite connections that are created once and reused.
+
+    Connections keep sqlite-vec loaded and their pragmas applied, and the
+    sqlite3 statement cache of each connection survives between requests.
+    """
+
+    def __init__(self, factory, max_size=8, timeout=30.0, health_check_interval=30.0):
+        self.factory = factory
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+        self._discarded = 0
+
+    def acquire(self):
+        """Check out a healthy connection, waiting if all max_size are in use"""
+        start = time.perf_counter()
+        waited = False
+
+        while True:
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_create = self._created < self.max_size
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    try:
+                        conn = self.factory()
+                    except Exception:
+                        with self._lock:
+                            self._created -= 1
+                        raise
+                    break
+                waited = True
+                try:
+                    conn, last_used = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise TimeoutError(f'No database connection available after {self.timeout}s')
+
+            if time.monotonic() - last_used < self.health_check_interval or self._is_healthy(conn):
+                break
+            self._discard(conn)
+
+        wait = time.perf_counter() - start
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            if waited:
+                self._waits += 1
+                self._wait_time += wait
+                self._max_wait_time = max(self._max_wait_time, wait)
+        return conn
+
+    def release(self, conn, broken=False):
+        """Return a connection to the pool, rolling back any open transaction"""
+        with self._lock:
+            self._in_use -= 1
+
+        if not broken:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error:
+                broken = True
+
+        if broken:
+            self._discard(conn)
+        else:
+            self._idle.put((conn, time.monotonic()))
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except (sqlite3.InterfaceError, sqlite3.OperationalError, sqlite3.ProgrammingError):
+            broken = not self._is_healthy(conn)
+            raise
+        finally:
+            self.release(conn, broken=broken)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_size': self.max_size,
+                'created': self._created,
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'total_wait_ms': round(self._wait_time * 1000, 3),
+                'max_wait_ms': round(self._max_wait_time * 1000, 3),
+                'discarded': self._discarded
+            }
+
+    def close_all(self):
+        """Close every idle connection; connections in use are closed on release"""
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._created -= 1
+            self._discarded += 1
+
+    @staticmethod
+    def _is_healthy(conn):
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+
+# One pool per database file and connection settings, and one set of change
+# listeners per database file, shared by every DatabaseService pointing at it
+_pools = {}
+_change_listeners = {}
+_pools_lock = threading.Lock()
+
 
 class DatabaseService:  
-    def __init__(self, db_path='chat_data.db'):
+    # Per-connection tuning; WAL itself is persistent and set in init_database.
+    # synchronous=NORMAL is durable across application crashes in WAL mode and
+    # only risks the last commits on power loss. WAL is here so readers keep
+    # going during an ingest, not for write throughput, which it can lower
+    # (every vector page is written twice); measure changes to these and to
+    # batch_size against vec0 with benchmarks.ingest.
+    PRAGMAS = {
+        'synchronous': 'NORMAL',
+        'cache_size': -64000,        # KiB (negative) -> 64 MB page cache
+        'mmap_size': 268435456,      # 256 MB memory-mapped reads
+        'temp_store': 'MEMORY',
+        'wal_autocheckpoint': 10000, # pages between automatic checkpoints (default 1000)
+        'busy_timeout': 5000         # ms to wait for the writer lock
+    }
+
+    MESSAGE_COLUMNS = ('id', 'timestamp', 'sender', 'message', 'sentiment', 'cluster_x', 'cluster_y')
+
+    def __init__(self, db_path='chat_data.db', batch_size=5000, pool_size=8, vector_storage=None,
+                 slow_query_ms=None, matrix_max_messages=0):
         self.db_path = db_path
+        self.batch_size = batch_size
+        self.vector_storage = vector_storage
+        self.vectors = None
+        # Chats of up to matrix_max_messages messages are also kept as memory-mapped
+        # float32 matrices and searched exactly with NumPy instead of vec0
+        self.matrix_max_messages = matrix_max_messages or 0
+        self.matrices = MatrixStore(db_path) if self.matrix_max_messages > 0 else None
+        self._matrix_builder = None
+        self._matrix_builds = set()
+        # Statements slower than slow_query_ms are kept with their query plans
+        self.slow_queries = SlowQueryLog(slow_query_ms) if slow_query_ms else None
+        with _pools_lock:
+            # Services on one database share connections only if they would
+            # have opened them the same way (a subclass may change PRAGMAS)
+            pool_key = (db_path, tuple(self.PRAGMAS.items()))
+            if pool_key not in _pools:
+                _pools[pool_key] = ConnectionPool(self._connect, max_size=pool_size)
+            self.pool = _pools[pool_key]
+            self._change_listeners = _change_listeners.setdefault(db_path, [])
         self.init_database()
     
     def _connect(self):
         """Create a new SQLite connection with sqlite-vec loaded."""
-        conn = sqlite3.connect(self.db_path)
+        # Pooled connections move between request threads, one at a time
+        conn = sqlite3.connect(
+            self.db_path, check_same_thread=False, cached_statements=256, factory=InstrumentedConnection
+        )
         # Load sqlite-vec extension for each new connection to ensure vec0 is available
         conn.enable_load_extension(True)
         sqlite_vec.load(conn)
         conn.enable_load_extension(False)
+        for name, value in self.PRAGMAS.items():
+            conn.execute(f'PRAGMA {name} = {value}')
         return conn
 
+    @contextmanager
+    def _connection(self):
+        """Check out a pooled connection for the duration of a with block"""
+        with self.pool.connection() as conn:
+            # The pool may be shared with other services on this database;
+            # statements of this checkout go to this service's slow query log
+            conn.slow_query_log = self.slow_queries
+            yield conn
+
+    def add_change_listener(self, callback):
+        """Register callback(chat_id), called after any write to a chat's messages"""
+        self._change_listeners.append(callback)
+
+    def _notify_chat_changed(self, chat_id):
+        for callback in list(self._change_listeners):
+            callback(chat_id)
+
+    def pool_stats(self):
+        """Connection pool statistics (connections in use, waits, wait time)"""
+        return self.pool.stats()
+
     def init_database(self):
         """Initialize database"""
-        conn = self._connect()
-        cursor = conn.cursor()
-        
-        # Create messages table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chat_id TEXT NOT NULL,
-                timestamp DATETIME NOT NULL,
-                sender TEXT NOT NULL,
-                message TEXT NOT NULL,
-                sentiment REAL,
-                cluster_x REAL,
-                cluster_y REAL,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            
+            # WAL lets dashboards keep reading while a large chat is being written
+            cursor.execute('PRAGMA journal_mode = WAL')
+            
+            # Create messages table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    chat_id TEXT NOT NULL,
+                    timestamp DATETIME NOT NULL,
+                    sender TEXT NOT NULL,
+                    message TEXT NOT NULL,
+                    sentiment REAL,
+                    cluster_x REAL,
+                    cluster_y REAL,
+                    cluster INTEGER,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
 
-        # Ensure vector table exists with correct embedding dimension
-        cursor.execute('''
-            CREATE VIRTUAL TABLE IF NOT EXISTS message_embeddings
-            USING vec0(
-                id INTEGER PRIMARY KEY,
-                embedding FLOAT[768]
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS settings (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )
+            ''')
+            
+            # Vector table partitioned by chat: a KNN with chat_id = ? only scans
+            # that chat's vectors instead of picking neighbours across all chats
+            self.vectors = VectorStore(self._resolve_vector_storage(conn))
+            self.vectors.create_tables(conn)
+            self._migrate_global_vector_table(conn)
+            
+            # Full-text index over the message text. It is an external-content
+            # table reading text from messages, kept in sync by store_messages;
+            # chat_id is stored unindexed to filter matches by chat
+            fts_exists = cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'"
+            ).fetchone() is not None
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts
+                USING fts5(
+                    message,
+                    chat_id UNINDEXED,
+                    content = 'messages',
+                    content_rowid = 'id',
+                    tokenize = 'unicode61 remove_diacritics 2'
+                )
+            ''')
+            if not fts_exists:
+                cursor.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+            
+            # Create chats table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS chats (
+                    id TEXT PRIMARY KEY,
+                    name TEXT,
+                    message_count INTEGER,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    version INTEGER NOT NULL DEFAULT 1
+                )
+            ''')
+            
+            # Content version, bumped by every write to the chat; read routes
+            # derive their ETags from it
+            columns = [row[1] for row in cursor.execute('PRAGMA table_info(chats)')]
+            if 'version' not in columns:
+                cursor.execute('ALTER TABLE chats ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+            
+            # Embeddings keyed by model + hash of the normalized text, shared by all chats
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS embedding_cache (
+                    model TEXT NOT NULL,
+                    text_hash BLOB NOT NULL,
+                    embedding BLOB NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (model, text_hash)
+                ) WITHOUT ROWID
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_used ON embedding_cache(last_used)')
+            
+            # Per-day, per-sender message counts and sentiment aggregates that the
+            # timeline and sentiment charts are served from
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS chat_rollups (
+                    chat_id TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    sender TEXT NOT NULL,
+                    message_count INTEGER NOT NULL,
+                    sentiment_count INTEGER NOT NULL,
+                    sentiment_sum REAL NOT NULL,
+                    sentiment_min REAL,
+                    sentiment_max REAL,
+                    PRIMARY KEY (chat_id, day, sender)
+                ) WITHOUT ROWID
+            ''')
+            
+            # Keyset pagination walks (chat_id, timestamp, id) as one index range
+            # scan; the composite index also serves every chat_id-only lookup
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_chat_timestamp_id ON messages(chat_id, timestamp, id)')
+            cursor.execute('DROP INDEX IF EXISTS idx_chat_id')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_timestamp ON messages(timestamp)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_sender ON messages(sender)')
+            
+            # Cluster labels were not stored before the level-of-detail map
+            columns = [row[1] for row in cursor.execute('PRAGMA table_info(messages)')]
+            if 'cluster' not in columns:
+                cursor.execute('ALTER TABLE messages ADD COLUMN cluster INTEGER')
+            
+            # Compact map index: viewport queries range-scan cluster_x within a
+            # chat and read y, label, sentiment and sender from the index alone
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_chat_map
+                ON messages(chat_id, cluster_x, cluster_y, cluster, sentiment, sender)
+            ''')
+            
+            # Backfill rollups for databases created before the table existed
+            if cursor.execute('SELECT 1 FROM chat_rollups LIMIT 1').fetchone() is None:
+                self._rebuild_rollups(conn)
+            
+            conn.commit()
+    
+    def _resolve_vector_storage(self, conn):
+        """Vector storage mode recorded in the database, set on first use"""
+        stored = self.get_setting(conn, 'vector_storage')
+        if stored is None:
+            # Databases created before the setting existed hold float vectors
+            existing = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'message_vectors'"
+            ).fetchone()
+            stored = 'float' if existing else (self.vector_storage or 'float')
+            self.set_setting(conn, 'vector_storage', stored)
+        elif self.vector_storage and self.vector_storage != stored:
+            raise ValueError(
+                f'{self.db_path} stores {stored} vectors, not {self.vector_storage}; '
+                f'convert it with python -m tools.convert_vector_storage'
             )
-        ''')
+        return stored
+    
+    @staticmethod
+    def get_setting(conn, key, default=None):
+        row = conn.execute('SELECT value FROM settings WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+    
+    @staticmethod
+    def set_setting(conn, key, value):
+        conn.execute('''
+            INSERT INTO settings (key, value) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        ''', (key, str(value)))
+    
+    @METHOD_SECONDS.timer('method')
+    def convert_vector_storage(self, storage, batch_size=None):
+        """Re-encode every stored vector into another storage mode and shrink the file.
+
+        Vectors are staged as float32 in a plain table, the vector tables are
+        recreated for the new mode and refilled, all in one transaction, then
+        the file is vacuumed. Returns the database size before and after.
+        """
+        batch_size = batch_size or self.batch_size
+        target = VectorStore(storage)
+        size_before = self.file_size()
+        if storage == self.vectors.storage:
+            return {'storage': storage, 'bytes_before': size_before, 'bytes_after': size_before}
+        
+        with self._connection() as conn:
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.execute('CREATE TEMP TABLE vector_staging (id INTEGER PRIMARY KEY, chat_id TEXT, embedding BLOB)')
+                for rows in self.vectors.iter_all(conn, batch_size):
+                    conn.executemany(
+                        'INSERT INTO vector_staging (id, chat_id, embedding) VALUES (?, ?, ?)',
+                        ((message_id, chat_id, vector.tobytes()) for message_id, chat_id, vector in rows)
+                    )
+                
+                self.vectors.drop_tables(conn)
+                target.create_tables(conn)
+                cursor = conn.execute('SELECT id, chat_id, embedding FROM vector_staging ORDER BY id')
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    target.insert(conn.cursor(), (
+                        (row[0], row[1], np.frombuffer(row[2], dtype=np.float32)) for row in rows
+                    ))
+                conn.execute('DROP TABLE vector_staging')
+                self.set_setting(conn, 'vector_storage', storage)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            
+            self.vectors = target
+            self.vector_storage = storage
+            conn.execute('VACUUM')
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
         
-        # Create chats table
+        # Cached search results hold distances computed from the old vectors
+        for chat_id in [chat['id'] for chat in self.get_chats()]:
+            self._notify_chat_changed(chat_id)
+        return {'storage': storage, 'bytes_before': size_before, 'bytes_after': self.file_size()}
+    
+    def file_size(self):
+        """Bytes on disk of the database file and its WAL"""
+        return sum(
+            os.path.getsize(path) for path in (self.db_path, self.db_path + '-wal')
+            if os.path.exists(path)
+        )
+    
+    @METHOD_SECONDS.timer('method')
+    def store_messages(self, chat_id, processed_data, batch_size=None, append=False):
+        """Store messages and their embeddings in the database.
+
+        Rows are written with executemany in transactions of batch_size
+        messages, so readers are only blocked for one batch at a time. The id
+        range for the whole chat is reserved up front, and the chat row is
+        written with the last batch so it only shows up once complete. With
+        append, the messages are added to an existing chat and its count.
+        """
+        batch_size = batch_size or self.batch_size
+        total = len(processed_data)
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            first_id = None
+            
+            try:
+                cursor.execute('BEGIN IMMEDIATE')
+                first_id = self._reserve_message_ids(cursor, total)
+            
+                for start in range(0, total, batch_size):
+                    if start > 0:
+                        cursor.execute('BEGIN IMMEDIATE')
+                    batch = processed_data[start:start + batch_size]
+                    ids = range(first_id + start, first_id + start + len(batch))
+                
+                    cursor.executemany('''
+                        INSERT INTO messages (id, chat_id, timestamp, sender, message, sentiment, cluster_x, cluster_y, cluster)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', (
+                        (
+                            message_id,
+                            chat_id,
+                            data['timestamp'],
+                            data['sender'],
+                            data['message'],
+                            data['sentiment'],
+                            data['cluster_x'],
+                            data['cluster_y'],
+                            data.get('cluster')
+                        )
+                        for message_id, data in zip(ids, batch)
+                    ))
+                    self.vectors.insert(cursor, (
+                        (message_id, chat_id, data['embedding'])
+                        for message_id, data in zip(ids, batch)
+                    ))
+                    cursor.execute('''
+                        INSERT INTO messages_fts (rowid, message, chat_id)
+                        SELECT id, message, chat_id FROM messages WHERE id >= ? AND id < ?
+                    ''', (ids.start, ids.stop))
+                
+                    self._add_to_rollups(cursor, chat_id, batch)
+                
+                    if start + batch_size < total:
+                        conn.commit()
+            
+                # Store chat info
+                if append:
+                    cursor.execute(
+                        'UPDATE chats SET message_count = message_count + ?, version = version + 1 WHERE id = ?',
+                        (total, chat_id)
+                    )
+                else:
+                    cursor.execute('''
+                        INSERT OR REPLACE INTO chats (id, name, message_count, version)
+                        VALUES (?, ?, ?, COALESCE((SELECT version FROM chats WHERE id = ?), 0) + 1)
+                    ''', (chat_id, f"Chat {chat_id}", total, chat_id))
+            
+                conn.commit()
+                self._update_matrix(conn, chat_id, first_id, processed_data, append)
+                self._notify_chat_changed(chat_id)
+                return True
+            
+            except Exception as e:
+                conn.rollback()
+                if first_id is not None:
+                    self._delete_message_range(conn, first_id, first_id + total)
+                    self._rebuild_rollups(conn, chat_id)
+                    self._bump_version(conn, chat_id)
+                    conn.commit()
+                    self._notify_chat_changed(chat_id)
+                raise e
+    
+    def _update_matrix(self, conn, chat_id, first_id, processed_data, append=False):
+        """Write, extend or drop the chat's search matrix after an ingest, by chat size"""
+        if self.matrices is None:
+            return
+        count = conn.execute('SELECT message_count FROM chats WHERE id = ?', (chat_id,)).fetchone()[0]
+        try:
+            if count > self.matrix_max_messages:
+                self.matrices.delete(chat_id)
+            elif append and self.matrices.rows(chat_id) != count - len(processed_data):
+                # No matrix for the stored part (e.g. stored before matrices)
+                self._rebuild_matrix(conn, chat_id)
+            elif processed_data or not append:
+                ids = np.arange(first_id, first_id + len(processed_data), dtype=np.int64)
+                vectors = np.empty((len(processed_data), self.vectors.dim), dtype=np.float32)
+                for i, data in enumerate(processed_data):
+                    vectors[i] = data['embedding']
+                self.matrices.write(chat_id, ids, vectors, append=append)
+        except Exception:
+            # The rows are committed: fall back to vec0 rather than fail the ingest
+            self.matrices.delete(chat_id)
+
+    def _rebuild_matrix(self, conn, chat_id):
+        ids, vectors = self.vectors.fetch_chat(conn, chat_id)
+        self.matrices.write(chat_id, ids, vectors)
+
+    @METHOD_SECONDS.timer('method')
+    def build_matrix(self, chat_id):
+        """(Re)build a chat's search matrix from its stored vectors, if the chat is small enough.
+
+        Returns whether the chat is now searched through its matrix.
+        """
+        if self.matrices is None:
+            return False
+        with self._connection() as conn:
+            row = conn.execute('SELECT message_count FROM chats WHERE id = ?', (chat_id,)).fetchone()
+            if row is None or row[0] > self.matrix_max_messages:
+                return False
+            self._rebuild_matrix(conn, chat_id)
+        return True
+
+    def _vector_knn(self, conn, chat_id, query_embedding, k):
+        """(id, distance) of a chat's k nearest messages, from its matrix when it has a current one.
+
+        A small chat without a current matrix (stored before matrices, by a
+        tool with them disabled, or whose matrix update never landed) gets
+        one built in the background and is served by vec0 meanwhile.
+        """
+        if self.matrices is not None:
+            row = conn.execute('SELECT message_count FROM chats WHERE id = ?', (chat_id,)).fetchone()
+            if row is not None and row[0] <= self.matrix_max_messages:
+                if self.matrices.rows(chat_id) == row[0]:
+                    return self.matrices.knn(chat_id, query_embedding, k)
+                self._schedule_matrix_build(chat_id)
+        return self.vectors.knn(conn, chat_id, query_embedding, k)
+
+    def _schedule_matrix_build(self, chat_id):
+        with _pools_lock:
+            if chat_id in self._matrix_builds:
+                return
+            self._matrix_builds.add(chat_id)
+            if self._matrix_builder is None:
+                # One build at a time: each reads a whole chat's vectors
+                self._matrix_builder = ThreadPoolExecutor(max_workers=1, thread_name_prefix='matrix-build')
+        self._matrix_builder.submit(self._build_matrix_job, chat_id)
+
+    def _build_matrix_job(self, chat_id):
+        try:
+            self.build_matrix(chat_id)
+        except Exception:
+            # Searches keep using vec0; the next one schedules another try
+            pass
+        finally:
+            with _pools_lock:
+                self._matrix_builds.discard(chat_id)
+
+    def _reserve_message_ids(self, cursor, count):
+        """Reserve count contiguous message ids and return the first one.
+
+        Bumping sqlite_sequence inside the write transaction keeps concurrent
+        ingests (and AUTOINCREMENT inserts) out of the reserved range.
+        """
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS chats (
-                id TEXT PRIMARY KEY,
-                name TEXT,
-                message_count INTEGER,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            SELECT MAX(
+                COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'messages'), 0),
+                COALESCE((SELECT MAX(id) FROM messages), 0)
             )
         ''')
+        first_id = cursor.fetchone()[0] + 1
         
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_chat_id ON messages(chat_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_timestamp ON messages(timestamp)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_sender ON messages(sender)')
+        cursor.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'messages'", (first_id + count - 1,))
+        if cursor.rowcount == 0:
+            cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('messages', ?)", (first_id + count - 1,))
+        return first_id
+    
+    def _migrate_global_vector_table(self, conn):
+        """Move vectors from the old unpartitioned message_embeddings table, if present"""
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'message_embeddings'"
+        ).fetchone()
+        if exists is None:
+            return
         
-        conn.commit()
-        conn.close()
+        cursor = conn.execute('''
+            SELECT e.id, m.chat_id, e.embedding
+            FROM message_embeddings e
+            JOIN messages m ON m.id = e.id
+        ''')
+        while True:
+            rows = cursor.fetchmany(self.batch_size)
+            if not rows:
+                break
+            self.vectors.insert(conn.cursor(), (
+                (row[0], row[1], np.frombuffer(row[2], dtype=np.float32)) for row in rows
+            ))
+        conn.execute('DROP TABLE message_embeddings')
     
-    def store_messages(self, chat_id, processed_data):
-        """Store messages and their embeddings in the database"""
-        conn = self._connect()
-        cursor = conn.cursor()
+    def _add_to_rollups(self, cursor, chat_id, batch):
+        """Fold a batch of messages into the per-day, per-sender rollup rows"""
+        groups = {}
+        for data in batch:
+            key = (data['timestamp'][:10], data['sender'])
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = [0, 0, 0.0, None, None]
+            group[0] += 1
+            sentiment = data['sentiment']
+            if sentiment is not None:
+                group[1] += 1
+                group[2] += sentiment
+                group[3] = sentiment if group[3] is None else min(group[3], sentiment)
+                group[4] = sentiment if group[4] is None else max(group[4], sentiment)
         
-        try:
-            # Store chat info
-            cursor.execute('''
-                INSERT OR REPLACE INTO chats (id, name, message_count)
-                VALUES (?, ?, ?)
-            ''', (chat_id, f"Chat {chat_id}", len(processed_data)))
-            
-            # Store messages
-            for data in processed_data:
-                embedding = np.array(data['embedding'], dtype=np.float32)
-                embedding_blob = embedding.tobytes()
-                
-                cursor.execute('''
-                    INSERT INTO messages (chat_id, timestamp, sender, message, sentiment, cluster_x, cluster_y)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    chat_id,
-                    data['timestamp'],
-                    data['sender'],
-                    data['message'],
-                    data['sentiment'],
-                    data['cluster_x'],
-                    data['cluster_y']
-                ))
+        cursor.executemany('''
+            INSERT INTO chat_rollups
+                (chat_id, day, sender, message_count, sentiment_count, sentiment_sum, sentiment_min, sentiment_max)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(chat_id, day, sender) DO UPDATE SET
+                message_count = message_count + excluded.message_count,
+                sentiment_count = sentiment_count + excluded.sentiment_count,
+                sentiment_sum = sentiment_sum + excluded.sentiment_sum,
+                sentiment_min = MIN(COALESCE(sentiment_min, excluded.sentiment_min), COALESCE(excluded.sentiment_min, sentiment_min)),
+                sentiment_max = MAX(COALESCE(sentiment_max, excluded.sentiment_max), COALESCE(excluded.sentiment_max, sentiment_max))
+        ''', ((chat_id, day, sender, *group) for (day, sender), group in groups.items()))
     
-                message_id = cursor.lastrowid
-                cursor.execute('INSERT INTO message_embeddings (id, embedding) VALUES (?, ?)', (message_id, embedding_blob))
-
+    def _rebuild_rollups(self, conn, chat_id=None, day=None, sender=None):
+        """Recompute rollup rows from messages, for everything or one chat / day / sender"""
+        message_where = []
+        rollup_where = []
+        params = []
+        if chat_id is not None:
+            message_where.append('chat_id = ?')
+            rollup_where.append('chat_id = ?')
+            params.append(chat_id)
+        if day is not None:
+            # Range on timestamp so the (chat_id, timestamp, id) index is used
+            message_where.append('timestamp >= ? AND timestamp < ?')
+            rollup_where.append('day >= ? AND day < ?')
+            params.extend([day, day + 'U'])
+        if sender is not None:
+            message_where.append('sender = ?')
+            rollup_where.append('sender = ?')
+            params.append(sender)
+        
+        def where_sql(conditions):
+            return (' WHERE ' + ' AND '.join(conditions)) if conditions else ''
+        
+        conn.execute('DELETE FROM chat_rollups' + where_sql(rollup_where), params)
+        conn.execute(f'''
+            INSERT INTO chat_rollups
+                (chat_id, day, sender, message_count, sentiment_count, sentiment_sum, sentiment_min, sentiment_max)
+            SELECT chat_id, substr(timestamp, 1, 10), sender, COUNT(*), COUNT(sentiment),
+                   COALESCE(SUM(sentiment), 0), MIN(sentiment), MAX(sentiment)
+            FROM messages{where_sql(message_where)}
+            GROUP BY chat_id, substr(timestamp, 1, 10), sender
+        ''', params)
+    
+    def _delete_message_range(self, conn, first_id, end_id):
+        """Remove rows of a partially committed ingest"""
+        self.vectors.delete_range(conn, first_id, end_id)
+        # External-content FTS rows are removed by replaying the indexed values
+        conn.execute('''
+            INSERT INTO messages_fts (messages_fts, rowid, message, chat_id)
+            SELECT 'delete', id, message, chat_id FROM messages WHERE id >= ? AND id < ?
+        ''', (first_id, end_id))
+        conn.execute('DELETE FROM messages WHERE id >= ? AND id < ?', (first_id, end_id))
+        conn.commit()
+    
+    @METHOD_SECONDS.timer('method')
+    def get_cached_embeddings(self, model, text_hashes):
+        """Look up cached embedding blobs by text hash and mark them as recently used"""
+        found = {}
+        now = time.time()
+        with self._connection() as conn:
+            # Stay well below SQLite's host parameter limit
+            for start in range(0, len(text_hashes), 500):
+                chunk = text_hashes[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                cursor = conn.execute(f'''
+                    SELECT text_hash, embedding FROM embedding_cache
+                    WHERE model = ? AND text_hash IN ({placeholders})
+                ''', (model, *chunk))
+                found.update(cursor.fetchall())
             
-            conn.commit()
-            return True
+            if found:
+                conn.executemany(
+                    'UPDATE embedding_cache SET last_used = ? WHERE model = ? AND text_hash = ?',
+                    ((now, model, text_hash) for text_hash in found)
+                )
+                conn.commit()
+        return found
+    
+    @METHOD_SECONDS.timer('method')
+    def store_cached_embeddings(self, model, entries, max_entries=None):
+        """Insert (text_hash, embedding_blob) pairs, then evict least recently used rows over max_entries"""
+        now = time.time()
+        with self._connection() as conn:
+            try:
+                conn.executemany('''
+                    INSERT OR REPLACE INTO embedding_cache (model, text_hash, embedding, last_used)
+                    VALUES (?, ?, ?, ?)
+                ''', ((model, text_hash, blob, now) for text_hash, blob in entries))
+                
+                evicted = 0
+                if max_entries is not None:
+                    count = conn.execute('SELECT COUNT(*) FROM embedding_cache').fetchone()[0]
+                    if count > max_entries:
+                        evicted = conn.execute('''
+                            DELETE FROM embedding_cache WHERE (model, text_hash) IN (
+                                SELECT model, text_hash FROM embedding_cache
+                                ORDER BY last_used LIMIT ?
+                            )
+                        ''', (count - max_entries,)).rowcount
+                
+                conn.commit()
+                return evicted
             
-        except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
+            except Exception as e:
+                conn.rollback()
+                raise e
     
+    @METHOD_SECONDS.timer('method')
     def get_chats(self):
         """Get list of all chats"""
-        conn = self._connect()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, name, message_count, created_at
-            FROM chats
-            ORDER BY created_at DESC
-        ''')
-        
-        chats = []
-        for row in cursor.fetchall():
-            chats.append({
-                'id': row[0],
-                'name': row[1],
-                'message_count': row[2],
-                'created_at': row[3]
-            })
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT id, name, message_count, created_at
+                FROM chats
+                ORDER BY created_at DESC
+            ''')
+            
+            chats = []
+            for row in cursor.fetchall():
+                chats.append({
+                    'id': row[0],
+                    'name': row[1],
+                    'message_count': row[2],
+                    'created_at': row[3]
+                })
         
-        conn.close()
         return chats
     
+    @staticmethod
+    def _bump_version(conn, chat_id):
+        conn.execute('UPDATE chats SET version = version + 1 WHERE id = ?', (chat_id,))
+
+    @METHOD_SECONDS.timer('method')
+    def get_chat_version(self, chat_id):
+        """Content version of a chat, or None if it does not exist"""
+        with self._connection() as conn:
+            row = conn.execute('SELECT version FROM chats WHERE id = ?', (chat_id,)).fetchone()
+        return row[0] if row else None
+
+    @METHOD_SECONDS.timer('method')
+    def get_chats_version(self):
+        """Version of the chat list: changes whenever a chat is added or written"""
+        with self._connection() as conn:
+            count, total = conn.execute('SELECT COUNT(*), TOTAL(version) FROM chats').fetchone()
+        return f'{count}.{int(total)}'
+
+    @METHOD_SECONDS.timer('method')
+    def chat_exists(self, chat_id):
+        with self._connection() as conn:
+            return conn.execute('SELECT 1 FROM chats WHERE id = ?', (chat_id,)).fetchone() is not None
+
+    @METHOD_SECONDS.timer('method')
+    def get_chat_tail(self, chat_id):
+        """Timestamp of a chat's latest messages and their (sender, message) pairs.
+
+        Export timestamps only have minute (or second) resolution, so every
+        message sharing the last timestamp is returned. None for an empty chat.
+        """
+        with self._connection() as conn:
+            last = conn.execute('SELECT MAX(timestamp) FROM messages WHERE chat_id = ?', (chat_id,)).fetchone()[0]
+            if last is None:
+                return None
+            rows = conn.execute('''
+                SELECT sender, message FROM messages
+                WHERE chat_id = ? AND timestamp = ?
+                ORDER BY id
+            ''', (chat_id, last)).fetchall()
+            return last, [(row[0], row[1]) for row in rows]
+
     def get_messages(self, chat_id, limit=None):
         """Get messages for a specific chat"""
-        conn = self._connect()
-        cursor = conn.cursor()
-        
-        query = '''
-            SELECT id, timestamp, sender, message, sentiment, cluster_x, cluster_y
-            FROM messages
-            WHERE chat_id = ?
-            ORDER BY timestamp
-        '''
-        
-        if limit:
-            query += f' LIMIT {limit}'
-        
-        cursor.execute(query, (chat_id,))
+        return list(self.iter_messages(chat_id, limit=limit))
+    
+    def iter_messages(self, chat_id, after=None, limit=None, columns=None, fetch_size=1000):
+        """Yield messages of a chat in (timestamp, id) order without materializing them.
+
+        after is a (timestamp, id) keyset cursor: only rows strictly after it
+        are returned. columns projects the output; id and timestamp are always
+        included since they make up the cursor. Rows are pulled from the
+        SQLite cursor fetch_size at a time, and the pooled connection is held
+        until the generator is exhausted or closed.
+        """
+        columns = self.message_columns(columns)
+        query = f'SELECT {", ".join(columns)} FROM messages WHERE chat_id = ?'
+        params = [chat_id]
         
-        messages = []
-        for row in cursor.fetchall():
-            messages.append({
-                'id': row[0],
-                'timestamp': row[1],
-                'sender': row[2],
-                'message': row[3],
-                'sentiment': row[4],
-                'cluster_x': row[5],
-                'cluster_y': row[6]
-            })
+        if after is not None:
+            query += ' AND (timestamp, id) > (?, ?)'
+            params.extend(after)
+        query += ' ORDER BY timestamp, id'
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
         
-        conn.close()
-        return messages
+        with self._connection() as conn:
+            cursor = conn.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(zip(columns, row))
     
+    def message_columns(self, columns=None):
+        """Validate a column projection for iter_messages, keeping id and timestamp first"""
+        if not columns:
+            return list(self.MESSAGE_COLUMNS)
+        unknown = set(columns) - set(self.MESSAGE_COLUMNS)
+        if unknown:
+            raise ValueError(f'Unknown message fields: {", ".join(sorted(unknown))}')
+        return ['id', 'timestamp'] + [c for c in self.MESSAGE_COLUMNS[2:] if c in columns]
+    
+    @METHOD_SECONDS.timer('method')
     def get_chat_stats(self, chat_id):
         """Get aggregated statistics for a chat"""
-        conn = self._connect()
-        cursor = conn.cursor()
-        
-        # Message count by sender
-        cursor.execute('''
-            SELECT sender, COUNT(*) as count
-            FROM messages
-            WHERE chat_id = ?
-            GROUP BY sender
-            ORDER BY count DESC
-        ''', (chat_id,))
-        
-        sender_stats = []
-        for row in cursor.fetchall():
-            sender_stats.append({
-                'sender': row[0],
-                'count': row[1]
-            })
-        
-        # Total message count
-        cursor.execute('SELECT COUNT(*) FROM messages WHERE chat_id = ?', (chat_id,))
-        total_messages = cursor.fetchone()[0]
-        
-        # Date range
-        cursor.execute('''
-            SELECT MIN(timestamp), MAX(timestamp)
-            FROM messages
-            WHERE chat_id = ?
-        ''', (chat_id,))
-        
-        date_range = cursor.fetchone()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            
+            # Message count by sender
+            cursor.execute('''
+                SELECT sender, COUNT(*) as count
+                FROM messages
+                WHERE chat_id = ?
+                GROUP BY sender
+                ORDER BY count DESC
+            ''', (chat_id,))
+            
+            sender_stats = []
+            for row in cursor.fetchall():
+                sender_stats.append({
+                    'sender': row[0],
+                    'count': row[1]
+                })
+            
+            # Total message count
+            cursor.execute('SELECT COUNT(*) FROM messages WHERE chat_id = ?', (chat_id,))
+            total_messages = cursor.fetchone()[0]
+            
+            # Date range
+            cursor.execute('''
+                SELECT MIN(timestamp), MAX(timestamp)
+                FROM messages
+                WHERE chat_id = ?
+            ''', (chat_id,))
+            
+            date_range = cursor.fetchone()
         
-        conn.close()
         
         return {
             'total_messages': total_messages,
@@ -206,165 +1001,468 @@ class DatabaseService:
             }
         }
     
+    # SQL expressions mapping a rollup day (YYYY-MM-DD) to its bucket label
+    BUCKETS = {
+        'day': 'day',
+        'week': "date(day, 'weekday 0', '-6 days')",   # Monday starting the week
+        'month': 'substr(day, 1, 7)'
+    }
+    
+    def _bucket_expression(self, granularity):
+        if granularity not in self.BUCKETS:
+            raise ValueError(f'Unknown granularity {granularity!r}, expected one of {", ".join(self.BUCKETS)}')
+        return self.BUCKETS[granularity]
+    
+    @METHOD_SECONDS.timer('method')
+    def get_timeline(self, chat_id, granularity='day'):
+        """Message counts per sender per day, week or month, served from chat_rollups"""
+        bucket = self._bucket_expression(granularity)
+        with self._connection() as conn:
+            cursor = conn.execute(f'''
+                SELECT {bucket} AS bucket, sender, SUM(message_count)
+                FROM chat_rollups
+                WHERE chat_id = ?
+                GROUP BY bucket, sender
+                ORDER BY bucket
+            ''', (chat_id,))
+            rows = cursor.fetchall()
+        
+        buckets = []
+        index = {}
+        senders = {}
+        for label, sender, count in rows:
+            if label not in index:
+                index[label] = len(buckets)
+                buckets.append(label)
+            senders.setdefault(sender, {})[index[label]] = count
+        
+        return {
+            'granularity': granularity,
+            'buckets': buckets,
+            'senders': {
+                sender: [counts.get(i, 0) for i in range(len(buckets))]
+                for sender, counts in senders.items()
+            }
+        }
+    
+    @METHOD_SECONDS.timer('method')
+    def get_sentiment_timeline(self, chat_id, granularity='day'):
+        """Average, min and max sentiment per day, week or month, served from chat_rollups"""
+        bucket = self._bucket_expression(granularity)
+        with self._connection() as conn:
+            cursor = conn.execute(f'''
+                SELECT {bucket} AS bucket, SUM(sentiment_count), SUM(sentiment_sum),
+                       MIN(sentiment_min), MAX(sentiment_max)
+                FROM chat_rollups
+                WHERE chat_id = ?
+                GROUP BY bucket
+                HAVING SUM(sentiment_count) > 0
+                ORDER BY bucket
+            ''', (chat_id,))
+            rows = cursor.fetchall()
+        
+        return {
+            'granularity': granularity,
+            'buckets': [
+                {
+                    'bucket': row[0],
+                    'count': row[1],
+                    'avg': row[2] / row[1],
+                    'min': row[3],
+                    'max': row[4]
+                }
+                for row in rows
+            ]
+        }
+    
+    @METHOD_SECONDS.timer('method')
     def search_similar_messages(self, chat_id, query_embedding, limit=10):
         """Search for similar messages using sqlite-vec vector index"""
-        conn = self._connect()
-        cursor = conn.cursor()
+        with self._connection() as conn:
+            return self._knn(conn, chat_id, query_embedding, limit)
 
-        query_blob = np.array(query_embedding, dtype=np.float32).tobytes()
 
-        cursor.execute('''
-            SELECT 
-                m.id,
-                m.timestamp,
-                m.sender,
-                m.message,
-                v.distance
-            FROM message_embeddings v
-            JOIN messages m ON m.id = v.id
-            WHERE v.embedding MATCH ? AND m.chat_id = ? AND v.k = ?
-            ORDER BY v.distance ASC
-        ''', (query_blob, chat_id, limit))
-
-        results = [
-            {
-                'id': row[0],
-                'timestamp': row[1],
-                'sender': row[2],
-                'message': row[3],
-                'distance': float(row[4])
-            }
+    @METHOD_SECONDS.timer('method')
+    def search_similar_messages_batch(self, searches):
+        """Run (chat_id, query_embedding, limit) searches over one connection, results in order"""
+        # Statements on one SQLite connection run one at a time, and the pool
+        # is better left to concurrent requests than split across one batch
+        with self._connection() as conn:
+            return [self._knn(conn, chat_id, embedding, limit) for chat_id, embedding, limit in searches]
+
+    @METHOD_SECONDS.timer('method')
+    def neighbour_coordinates(self, chat_id, embeddings, k=5):
+        """Map position of each embedding as the mean coordinates of its k nearest messages.
+
+        Places new messages on the map of a chat whose fitted projection was not saved.
+        """
+        coordinates = []
+        with self._connection() as conn:
+            for embedding in embeddings:
+                ids = [message_id for message_id, _ in self._vector_knn(conn, chat_id, embedding, k)]
+                points = conn.execute(f'''
+                    SELECT cluster_x, cluster_y FROM messages
+                    WHERE id IN ({','.join('?' * len(ids))}) AND cluster_x IS NOT NULL
+                ''', ids).fetchall() if ids else []
+                if points:
+                    coordinates.append((
+                        sum(point[0] for point in points) / len(points),
+                        sum(point[1] for point in points) / len(points)
+                    ))
+                else:
+                    coordinates.append((None, None))
+        return coordinates
+
+    @staticmethod
+    def fts_query(text, match_all=True):
+        """FTS5 MATCH expression for free text: every term quoted, so user input
+        never parses as FTS syntax, joined with AND (match_all) or OR"""
+        terms = ['"' + term.replace('"', '""') + '"' for term in text.split()]
+        return (' AND ' if match_all else ' OR ').join(terms)
+
+    @METHOD_SECONDS.timer('method')
+    def keyword_search(self, chat_id, query, limit=10, match_all=True):
+        """Messages of a chat matching the query terms, best BM25 score first"""
+        match = self.fts_query(query, match_all)
+        if not match:
+            return []
+        with self._connection() as conn:
+            return self._keyword_ranking(conn, chat_id, match, limit)
+
+    def _keyword_ranking(self, conn, chat_id, match, limit):
+        cursor = conn.execute('''
+            SELECT m.id, m.timestamp, m.sender, m.message, bm25(messages_fts) AS score
+            FROM messages_fts
+            JOIN messages m ON m.id = messages_fts.rowid
+            WHERE messages_fts MATCH ? AND messages_fts.chat_id = ?
+            ORDER BY score
+            LIMIT ?
+        ''', (match, chat_id, limit))
+        return [
+            {'id': row[0], 'timestamp': row[1], 'sender': row[2], 'message': row[3], 'bm25': row[4]}
             for row in cursor.fetchall()
         ]
 
-        conn.close()
-        return results
+    @METHOD_SECONDS.timer('method')
+    def hybrid_search(self, chat_id, query, query_embedding, limit=10, candidates=None, rrf_k=60):
+        """Fuse BM25 and vector rankings of a chat with reciprocal rank fusion.
+
+        Both rankings run over one connection, each fetching candidates rows
+        (4 * limit by default); a message scores sum(1 / (rrf_k + rank)) over
+        the rankings it appears in. Returns (results, timings) with the
+        milliseconds spent in each signal and in the fusion.
+        """
+        candidates = candidates or limit * 4
+        timings = {}
+        with self._connection() as conn:
+            start = time.perf_counter()
+            match = self.fts_query(query, match_all=False)
+            keyword = [row['id'] for row in self._keyword_ranking(conn, chat_id, match, candidates)] if match else []
+            timings['bm25_ms'] = round((time.perf_counter() - start) * 1000, 3)
+
+            start = time.perf_counter()
+            vector = [message_id for message_id, _ in self._vector_knn(conn, chat_id, query_embedding, candidates)]
+            timings['vector_ms'] = round((time.perf_counter() - start) * 1000, 3)
+
+            start = time.perf_counter()
+            scores = {}
+            ranks = {}
+            for signal, ranking in (('bm25_rank', keyword), ('vector_rank', vector)):
+                for rank, message_id in enumerate(ranking, 1):
+                    scores[message_id] = scores.get(message_id, 0.0) + 1.0 / (rrf_k + rank)
+                    ranks.setdefault(message_id, {})[signal] = rank
+            top = sorted(scores, key=scores.get, reverse=True)[:limit]
 
+            rows = {}
+            if top:
+                rows = {
+                    row[0]: row
+                    for row in conn.execute(f'''
+                        SELECT id, timestamp, sender, message FROM messages
+                        WHERE id IN ({','.join('?' * len(top))})
+                    ''', top)
+                }
+            results = [
+                {
+                    'id': message_id,
+                    'timestamp': rows[message_id][1],
+                    'sender': rows[message_id][2],
+                    'message': rows[message_id][3],
+                    'score': scores[message_id],
+                    'bm25_rank': ranks[message_id].get('bm25_rank'),
+                    'vector_rank': ranks[message_id].get('vector_rank')
+                }
+                for message_id in top
+                if message_id in rows
+            ]
+            timings['fusion_ms'] = round((time.perf_counter() - start) * 1000, 3)
+        return results, timings
 
+    @METHOD_SECONDS.timer('method')
     def get_message_embedding(self, message_id):
-        """Fetch the raw embedding blob for a given message id."""
-        conn = self._connect()
-        cursor = conn.cursor()
-        try:
-            cursor.execute('SELECT embedding FROM message_embeddings WHERE id = ?', (message_id,))
-            row = cursor.fetchone()
-            return row[0] if row else None
-        finally:
-            conn.close()
+        """Fetch the float32 embedding blob for a given message id."""
+        with self._connection() as conn:
+            embedding = self.vectors.fetch(conn, message_id)
+            return embedding.tobytes() if embedding is not None else None
 
+    @METHOD_SECONDS.timer('method')
     def search_similar_messages_by_id(self, chat_id, message_id, limit=10):
         """Search for similar messages using the embedding of an existing message id."""
-        embedding_blob = self.get_message_embedding(message_id)
-        if embedding_blob is None:
+        with self._connection() as conn:
+            embedding = self.vectors.fetch(conn, message_id)
+            if embedding is None:
+                return []
+            return self._knn(conn, chat_id, embedding, limit, exclude_id=message_id)
+
+    def _knn(self, conn, chat_id, query_embedding, limit, exclude_id=None):
+        """k nearest messages of one chat; the partition key restricts the scan to that chat"""
+        k = limit + 1 if exclude_id is not None else limit
+        neighbours = [
+            (message_id, distance)
+            for message_id, distance in self._vector_knn(conn, chat_id, query_embedding, k)
+            if message_id != exclude_id
+        ][:limit]
+        if not neighbours:
             return []
 
-        conn = self._connect()
-        cursor = conn.cursor()
+        placeholders = ','.join('?' * len(neighbours))
+        rows = {
+            row[0]: row
+            for row in conn.execute(f'''
+                SELECT id, timestamp, sender, message
+                FROM messages
+                WHERE id IN ({placeholders})
+            ''', [message_id for message_id, _ in neighbours])
+        }
 
-        cursor.execute('''
-            SELECT 
-                m.id,
-                m.timestamp,
-                m.sender,
-                m.message,
-                v.distance
-            FROM message_embeddings v
-            JOIN messages m ON m.id = v.id
-            WHERE v.embedding MATCH ? AND m.chat_id = ? AND v.k = ? AND m.id != ?
-            ORDER BY v.distance ASC
-        ''', (embedding_blob, chat_id, limit, message_id))
-
-        results = [
+        return [
             {
-                'id': row[0],
-                'timestamp': row[1],
-                'sender': row[2],
-                'message': row[3],
-                'distance': float(row[4])
+                'id': message_id,
+                'timestamp': rows[message_id][1],
+                'sender': rows[message_id][2],
+                'message': rows[message_id][3],
+                'distance': float(distance)
             }
-            for row in cursor.fetchall()
+            for message_id, distance in neighbours
+            if message_id in rows
         ]
 
-        conn.close()
-        return results
-
+    @METHOD_SECONDS.timer('method')
     def get_cluster_coordinates(self, chat_id):
         """Get cluster coordinates for visualization"""
-        conn = self._connect()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, sender, message, cluster_x, cluster_y, sentiment
-            FROM messages
-            WHERE chat_id = ? AND cluster_x IS NOT NULL AND cluster_y IS NOT NULL
-            ORDER BY timestamp
-        ''', (chat_id,))
-        
-        clusters = []
-        for row in cursor.fetchall():
-            clusters.append({
-                'id': row[0],
-                'sender': row[1],
-                'message': row[2],
-                'x': row[3],
-                'y': row[4],
-                'sentiment': row[5]
-            })
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT id, sender, message, cluster_x, cluster_y, sentiment
+                FROM messages
+                WHERE chat_id = ? AND cluster_x IS NOT NULL AND cluster_y IS NOT NULL
+                ORDER BY timestamp
+            ''', (chat_id,))
+            
+            clusters = []
+            for row in cursor.fetchall():
+                clusters.append({
+                    'id': row[0],
+                    'sender': row[1],
+                    'message': row[2],
+                    'x': row[3],
+                    'y': row[4],
+                    'sentiment': row[5]
+                })
         
-        conn.close()
         return clusters
     
+    @METHOD_SECONDS.timer('method')
+    def get_map_extent(self, chat_id):
+        """Bounding box and number of a chat's placed messages, or None if it has none"""
+        with self._connection() as conn:
+            row = conn.execute('''
+                SELECT MIN(cluster_x), MIN(cluster_y), MAX(cluster_x), MAX(cluster_y), COUNT(cluster_x)
+                FROM messages
+                WHERE chat_id = ? AND cluster_x IS NOT NULL
+            ''', (chat_id,)).fetchone()
+        if not row[4]:
+            return None
+        return {'x0': row[0], 'y0': row[1], 'x1': row[2], 'y1': row[3], 'count': row[4]}
+
+    @METHOD_SECONDS.timer('method')
+    def get_cluster_map(self, chat_id, extent, viewport=None, zoom=0, max_points=5000, base_bins=16):
+        """Level-of-detail view of a chat's cluster map inside a viewport.
+
+        extent is the chat's get_map_extent and viewport an (x0, y0, x1, y1)
+        box, the whole extent by default. When at most max_points messages
+        fall inside it they are returned as individual points, without their
+        text; otherwise as density bins on a grid of base_bins * 2**zoom
+        cells per axis laid over the extent, so bins stay put while panning.
+        Per-cluster counts and centroids are returned either way.
+        """
+        x0, y0, x1, y1 = viewport or (extent['x0'], extent['y0'], extent['x1'], extent['y1'])
+        where = 'chat_id = ? AND cluster_x BETWEEN ? AND ? AND cluster_y BETWEEN ? AND ?'
+        params = (chat_id, x0, x1, y0, y1)
+
+        with self._connection() as conn:
+            total = conn.execute(f'SELECT COUNT(*) FROM messages WHERE {where}', params).fetchone()[0]
+
+            if total <= max_points:
+                rows = conn.execute(f'''
+                    SELECT id, cluster_x, cluster_y, cluster, sentiment, sender
+                    FROM messages WHERE {where}
+                ''', params).fetchall()
+                return {
+                    'mode': 'points',
+                    'total': total,
+                    'points': [
+                        {'id': r[0], 'x': r[1], 'y': r[2], 'cluster': r[3], 'sentiment': r[4], 'sender': r[5]}
+                        for r in rows
+                    ],
+                    'bins': [],
+                    'clusters': self._cluster_aggregates(
+                        (r[3], 1, r[1], r[2], r[4] or 0.0, r[4] is not None) for r in rows
+                    )
+                }
+
+            cells = min(base_bins * 2 ** zoom, 1024)
+            cell_w = (extent['x1'] - extent['x0']) / cells or 1.0
+            cell_h = (extent['y1'] - extent['y0']) / cells or 1.0
+            # Points on the extent's far edge belong to the last cell, not one past the grid
+            rows = conn.execute(f'''
+                SELECT
+                    MIN(?, CAST((cluster_x - ?) / ? AS INTEGER)) AS cell_x,
+                    MIN(?, CAST((cluster_y - ?) / ? AS INTEGER)) AS cell_y,
+                    cluster,
+                    COUNT(*),
+                    SUM(cluster_x),
+                    SUM(cluster_y),
+                    TOTAL(sentiment),
+                    COUNT(sentiment)
+                FROM messages WHERE {where}
+                GROUP BY cell_x, cell_y, cluster
+            ''', (cells - 1, extent['x0'], cell_w, cells - 1, extent['y0'], cell_h) + params).fetchall()
+
+        bins = {}
+        for bx, by, cluster, count, sum_x, sum_y, sum_sentiment, sentiment_count in rows:
+            entry = bins.setdefault((bx, by), [0, 0.0, 0.0, 0.0, 0, {}])
+            entry[0] += count
+            entry[1] += sum_x
+            entry[2] += sum_y
+            entry[3] += sum_sentiment
+            entry[4] += sentiment_count
+            entry[5][cluster] = entry[5].get(cluster, 0) + count
+
+        return {
+            'mode': 'bins',
+            'total': total,
+            'points': [],
+            'bins': [
+                {
+                    'x0': extent['x0'] + bx * cell_w,
+                    'y0': extent['y0'] + by * cell_h,
+                    'x1': extent['x0'] + (bx + 1) * cell_w,
+                    'y1': extent['y0'] + (by + 1) * cell_h,
+                    'x': sum_x / count,
+                    'y': sum_y / count,
+                    'count': count,
+                    'cluster': max(labels, key=labels.get),
+                    'sentiment': sum_sentiment / sentiment_count if sentiment_count else None
+                }
+                for (bx, by), (count, sum_x, sum_y, sum_sentiment, sentiment_count, labels) in bins.items()
+            ],
+            'clusters': self._cluster_aggregates(row[2:] for row in rows)
+        }
+
+    @staticmethod
+    def _cluster_aggregates(groups):
+        """Fold (cluster, count, sum_x, sum_y, sum_sentiment, sentiment_count) groups per cluster"""
+        clusters = {}
+        for cluster, count, sum_x, sum_y, sum_sentiment, sentiment_count in groups:
+            entry = clusters.setdefault(cluster, [0, 0.0, 0.0, 0.0, 0])
+            entry[0] += count
+            entry[1] += sum_x
+            entry[2] += sum_y
+            entry[3] += sum_sentiment
+            entry[4] += sentiment_count
+        return [
+            {
+                'cluster': cluster,
+                'count': count,
+                'x': sum_x / count,
+                'y': sum_y / count,
+                'sentiment': sum_sentiment / sentiment_count if sentiment_count else None
+            }
+            for cluster, (count, sum_x, sum_y, sum_sentiment, sentiment_count) in clusters.items()
+        ]
+
+    @METHOD_SECONDS.timer('method')
+    def get_message(self, chat_id, message_id):
+        """One message of a chat with its text, or None"""
+        columns = self.MESSAGE_COLUMNS + ('cluster',)
+        with self._connection() as conn:
+            row = conn.execute(f'''
+                SELECT {', '.join(columns)}
+                FROM messages WHERE chat_id = ? AND id = ?
+            ''', (chat_id, message_id)).fetchone()
+        return dict(zip(columns, row)) if row else None
+
+    @METHOD_SECONDS.timer('method')
     def update_cluster_coordinates(self, chat_id, coordinates):
         """Update cluster coordinates for messages"""
-        conn = self._connect()
-        cursor = conn.cursor()
-        
-        try:
-            for coord in coordinates:
-                cursor.execute('''
-                    UPDATE messages
-                    SET cluster_x = ?, cluster_y = ?
-                    WHERE id = ?
-                ''', (coord['x'], coord['y'], coord['id']))
+        with self._connection() as conn:
+            cursor = conn.cursor()
             
-            conn.commit()
-            return True
+            try:
+                for coord in coordinates:
+                    cursor.execute('''
+                        UPDATE messages
+                        SET cluster_x = ?, cluster_y = ?, cluster = ?
+                        WHERE id = ?
+                    ''', (coord['x'], coord['y'], coord.get('cluster'), coord['id']))
+                self._bump_version(cursor, chat_id)
             
-        except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
+                conn.commit()
+                self._notify_chat_changed(chat_id)
+                return True
+            
+            except Exception as e:
+                conn.rollback()
+                raise e
     
+    @METHOD_SECONDS.timer('method')
     def update_message_embedding(self, message_id, embedding, sentiment, cluster_x, cluster_y):
         """Update a specific message with embedding and cluster data"""
-        conn = self._connect()
-        cursor = conn.cursor()
-        
-        try:
-            # Update message metadata
-            cursor.execute('''
-                UPDATE messages
-                SET sentiment = ?, cluster_x = ?, cluster_y = ?
-                WHERE id = ?
-            ''', (sentiment, cluster_x, cluster_y, message_id))
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            
+            try:
+                # Update message metadata
+                cursor.execute('''
+                    UPDATE messages
+                    SET sentiment = ?, cluster_x = ?, cluster_y = ?
+                    WHERE id = ?
+                ''', (sentiment, cluster_x, cluster_y, message_id))
 
-            # Upsert embedding in vector table
-            embedding_blob = np.array(embedding, dtype=np.float32).tobytes()
-            cursor.execute('''
-                INSERT INTO message_embeddings (id, embedding)
-                VALUES (?, ?)
-                ON CONFLICT(id) DO UPDATE SET embedding = excluded.embedding
-            ''', (message_id, embedding_blob))
+                # Replace the embedding; virtual tables do not support UPSERT
+                self.vectors.delete(conn, message_id)
+                row = cursor.execute('SELECT chat_id FROM messages WHERE id = ?', (message_id,)).fetchone()
+                if row:
+                    self.vectors.insert(cursor, [(message_id, row[0], embedding)])
             
-            conn.commit()
-            return True
+                conn.commit()
             
-        except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
+            except Exception as e:
+                conn.rollback()
+                raise e
+            
+            row = cursor.execute('SELECT chat_id, timestamp, sender FROM messages WHERE id = ?', (message_id,)).fetchone()
+            if row:
+                # Sentiment may have changed: recompute the one rollup row it feeds
+                self._rebuild_rollups(conn, row[0], day=row[1][:10], sender=row[2])
+                self._bump_version(conn, row[0])
+                conn.commit()
+                if self.matrices is not None and self.matrices.rows(row[0]) is not None:
+                    self._rebuild_matrix(conn, row[0])
+                self._notify_chat_changed(row[0])
+            return True
 
 if __name__ == "__main__":
     db = DatabaseService()
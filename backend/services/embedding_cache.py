@@ -0,0 +1,75 @@
+import hashlib
+import re
+import threading
+import unicodedata
+
+import numpy as np
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_text(text):
+    """Canonical form used both as the cache key and as the text sent to the model"""
+    return _WHITESPACE.sub(' ', unicodedata.normalize('NFC', text)).strip()
+
+
+def text_hash(text):
+    return hashlib.sha1(text.encode('utf-8')).digest()
+
+
+class EmbeddingCache:
+    """Persistent, size-capped LRU cache of sentence embeddings stored in SQLite.
+
+    Entries are keyed by model name plus a hash of the normalized text, so
+    repeated messages ("ok", "<Media omitted>") and re-uploaded exports skip
+    the model entirely.
+    """
+
+    def __init__(self, db_service, max_entries=100000):
+        self.db_service = db_service
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.encode_seconds = 0.0
+        self.encoded_texts = 0
+
+    def get_many(self, model_name, keys):
+        """Return {key: float32 vector} for the normalized texts found in the cache"""
+        hashes = {text_hash(key): key for key in keys}
+        found = self.db_service.get_cached_embeddings(model_name, list(hashes))
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return {hashes[h]: np.frombuffer(blob, dtype=np.float32) for h, blob in found.items()}
+
+    def put_many(self, model_name, items):
+        """Store (key, vector) pairs for normalized texts"""
+        entries = [(text_hash(key), np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items]
+        if not entries:
+            return
+        evicted = self.db_service.store_cached_embeddings(model_name, entries, self.max_entries)
+        with self._lock:
+            self.evictions += evicted
+
+    def record_encode(self, count, seconds):
+        """Account model time spent on cache misses, to estimate time saved by hits"""
+        with self._lock:
+            self.encoded_texts += count
+            self.encode_seconds += seconds
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            per_text = self.encode_seconds / self.encoded_texts if self.encoded_texts else 0.0
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'max_entries': self.max_entries,
+                'encoded_texts': self.encoded_texts,
+                'encode_seconds': round(self.encode_seconds, 3),
+                'estimated_seconds_saved': round(self.hits * per_text, 3)
+            }
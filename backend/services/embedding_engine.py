@@ -0,0 +1,159 @@
+import atexit
+import os
+import threading
+import time
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+
+class EmbeddingEngine:
+    """CPU sentence-embedding backend with explicit batching and optional parallelism.
+
+    backend:
+        'torch' - fp32 SentenceTransformer (the baseline)
+        'int8'  - same model with Linear layers dynamically quantized to int8
+        'onnx'  - ONNX Runtime export (needs sentence-transformers>=3.2, optimum, onnxruntime)
+
+    With processes > 1, large inputs are sorted by length, split into chunks
+    and spread over a pool of worker processes, one model copy each.
+    """
+
+    BACKENDS = ('torch', 'int8', 'onnx')
+
+    def __init__(self, model_name, batch_size=64, backend='torch', processes=0,
+                 min_parallel_texts=2048):
+        if backend not in self.BACKENDS:
+            raise ValueError(f'Unknown embedding backend {backend!r}, expected one of {self.BACKENDS}')
+
+        self.model_name = model_name
+        self.backend = backend
+        self.batch_size = batch_size
+        self.processes = processes if backend != 'onnx' else 0
+        self.min_parallel_texts = min_parallel_texts
+        self.model = self._load_model(model_name, backend)
+
+        self._pool = None
+        self._lock = threading.Lock()
+        self._texts = 0
+        self._seconds = 0.0
+        self._parallel_calls = 0
+
+    @property
+    def name(self):
+        """Identifier of the model and backend, used to key cached embeddings"""
+        return self.model_name if self.backend == 'torch' else f'{self.model_name}:{self.backend}'
+
+    def get_sentence_embedding_dimension(self):
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts):
+        """Encode texts into a float32 (n, dim) array"""
+        start = time.perf_counter()
+
+        if self.processes > 1 and len(texts) >= self.min_parallel_texts:
+            embeddings = self._encode_parallel(texts)
+            parallel = True
+        else:
+            # SentenceTransformer.encode already length-sorts within the call
+            embeddings = self.model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True)
+            parallel = False
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+
+        with self._lock:
+            self._texts += len(texts)
+            self._seconds += time.perf_counter() - start
+            self._parallel_calls += parallel
+
+        return embeddings
+
+    def measure_drift(self, texts, embeddings=None, baseline=None):
+        """Cosine similarity of this backend's embeddings to the fp32 baseline on texts.
+
+        Without baseline (the fp32 embeddings of texts) a second, fp32 copy
+        of the model is loaded to compute it, so this belongs in benchmarks
+        (see benchmarks.embedding_backends), not on a request path.
+        """
+        if embeddings is None:
+            embeddings = self.model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True)
+
+        if baseline is None:
+            baseline_model = SentenceTransformer(self.model_name, device='cpu')
+            baseline = baseline_model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True)
+            del baseline_model
+        baseline = np.asarray(baseline, dtype=np.float32)
+
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        cosine = np.sum(embeddings * baseline, axis=1) / (
+            np.linalg.norm(embeddings, axis=1) * np.linalg.norm(baseline, axis=1) + 1e-12
+        )
+        return {
+            'samples': len(texts),
+            'mean_cosine': float(cosine.mean()),
+            'min_cosine': float(cosine.min())
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                'model': self.model_name,
+                'backend': self.backend,
+                'batch_size': self.batch_size,
+                'processes': self.processes,
+                'texts': self._texts,
+                'seconds': round(self._seconds, 3),
+                'texts_per_second': self._texts / self._seconds if self._seconds else 0.0,
+                'parallel_calls': self._parallel_calls
+            }
+
+    def close(self):
+        """Stop the worker processes, if any were started"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            SentenceTransformer.stop_multi_process_pool(pool)
+
+    def _encode_parallel(self, texts):
+        # Sort by length before chunking so each worker's batches pad little
+        order = np.argsort([len(text) for text in texts], kind='stable')
+        sorted_texts = [texts[i] for i in order]
+        chunk_size = max(self.batch_size, len(texts) // (self.processes * 4))
+
+        encoded = self.model.encode_multi_process(
+            sorted_texts, self._get_pool(), batch_size=self.batch_size, chunk_size=chunk_size
+        )
+
+        embeddings = np.empty_like(encoded)
+        embeddings[order] = encoded
+        return embeddings
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # Split the cores between workers instead of letting every
+                # process start one intra-op thread per core
+                threads = str(max(1, (os.cpu_count() or 1) // self.processes))
+                previous = os.environ.get('OMP_NUM_THREADS')
+                os.environ['OMP_NUM_THREADS'] = threads
+                try:
+                    self._pool = self.model.start_multi_process_pool(target_devices=['cpu'] * self.processes)
+                finally:
+                    if previous is None:
+                        del os.environ['OMP_NUM_THREADS']
+                    else:
+                        os.environ['OMP_NUM_THREADS'] = previous
+                atexit.register(self.close)
+            return self._pool
+
+    @staticmethod
+    def _load_model(model_name, backend):
+        if backend == 'onnx':
+            return SentenceTransformer(model_name, device='cpu', backend='onnx')
+
+        if backend == 'torch':
+            return SentenceTransformer(model_name)
+
+        # Dynamic quantization only has CPU kernels
+        import torch
+        model = SentenceTransformer(model_name, device='cpu')
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
@@ -0,0 +1,146 @@
+import threading
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue already holds the maximum number of pending jobs"""
+
+
+class JobService:
+    """Background job queue with a bounded number of concurrently running jobs"""
+
+    def __init__(self, max_workers=2, max_pending=20, max_finished=200):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, fn, stages, *args, **kwargs):
+        """Queue fn(job, *args, **kwargs) and return the new job id.
+
+        fn receives a JobHandle it can use to report progress per stage and
+        must return a JSON-serializable result.
+        """
+        job_id = uuid.uuid4().hex
+        now = datetime.now().isoformat()
+
+        with self._lock:
+            pending = sum(1 for job in self._jobs.values() if job['status'] in ('queued', 'running'))
+            if pending >= self.max_pending:
+                raise QueueFullError(f'Too many pending jobs ({pending}), try again later')
+
+            self._jobs[job_id] = {
+                'id': job_id,
+                'status': 'queued',
+                'stage': None,
+                'progress': 0.0,
+                'stages': {
+                    stage: {'status': 'pending', 'progress': 0.0, 'started_at': None, 'finished_at': None}
+                    for stage in stages
+                },
+                'result': None,
+                'error': None,
+                'created_at': now,
+                'started_at': None,
+                'finished_at': None
+            }
+            self._evict_finished()
+
+        self._executor.submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def get(self, job_id):
+        """Return a snapshot of the job state, or None if the job is unknown"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            snapshot = dict(job)
+            snapshot['stages'] = {name: dict(stage) for name, stage in job['stages'].items()}
+            return snapshot
+
+    def update_stage(self, job_id, stage, progress):
+        """Record progress in [0, 1] for a stage; several stages may run at once"""
+        now = datetime.now().isoformat()
+        progress = max(0.0, min(1.0, float(progress)))
+
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+
+            state = job['stages'].setdefault(
+                stage, {'status': 'pending', 'progress': 0.0, 'started_at': None, 'finished_at': None}
+            )
+            if state['started_at'] is None:
+                state['started_at'] = now
+            state['progress'] = progress
+            if progress >= 1.0:
+                state['status'] = 'completed'
+                state['finished_at'] = now
+            else:
+                state['status'] = 'running'
+
+            job['stage'] = stage
+            job['progress'] = self._overall_progress(job)
+
+    def _run(self, job_id, fn, args, kwargs):
+        with self._lock:
+            job = self._jobs[job_id]
+            job['status'] = 'running'
+            job['started_at'] = datetime.now().isoformat()
+
+        try:
+            result = fn(JobHandle(self, job_id), *args, **kwargs)
+        except Exception as e:
+            traceback.print_exc()
+            self._finish(job_id, 'failed', error=str(e))
+        else:
+            self._finish(job_id, 'completed', result=result)
+
+    def _finish(self, job_id, status, result=None, error=None):
+        now = datetime.now().isoformat()
+        with self._lock:
+            job = self._jobs[job_id]
+            for state in job['stages'].values():
+                if state['status'] == 'running':
+                    state['status'] = 'completed' if status == 'completed' else 'failed'
+                    state['finished_at'] = now
+            if status == 'completed':
+                for state in job['stages'].values():
+                    state['status'] = 'completed'
+                    state['progress'] = 1.0
+                job['progress'] = 1.0
+            job['status'] = status
+            job['result'] = result
+            job['error'] = error
+            job['finished_at'] = now
+
+    def _evict_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job['status'] in ('completed', 'failed')]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+    @staticmethod
+    def _overall_progress(job):
+        stages = job['stages']
+        if not stages:
+            return 0.0
+        return sum(state['progress'] for state in stages.values()) / len(stages)
+
+
+class JobHandle:
+    """Progress reporter handed to a running job function"""
+
+    def __init__(self, service, job_id):
+        self.service = service
+        self.id = job_id
+
+    def report(self, stage, progress):
+        self.service.update_stage(self.id, stage, progress)
@@ -1,50 +1,272 @@
 import numpy as np
-from sentence_transformers import SentenceTransformer
-import umap
-from sklearn.cluster import KMeans
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
-import json
-import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from services.embedding_cache import normalize_text
+from services.embedding_engine import EmbeddingEngine
+from services.metrics import REGISTRY
+from services.sentiment import SentimentScorer
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'chat_pipeline_stage_seconds', 'Upload pipeline stage time (per batch for parse/embed/sentiment)'
+)
+ENCODE_SECONDS = REGISTRY.histogram('chat_model_encode_seconds', 'Embedding model call time')
+TEXTS_TOTAL = REGISTRY.counter(
+    'chat_model_texts_total', 'Texts to embed, by whether the model encoded them or they were reused (cache or duplicate)'
+)
+
+class StageProfile:
+    """Wall-clock seconds and peak traced memory of named pipeline stages.
+
+    A stage entered several times (once per batch) accumulates its seconds.
+    Every entry is also observed in the chat_pipeline_stage_seconds histogram.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, peak_mb=None):
+        STAGE_SECONDS.observe(seconds, stage=name)
+        with self._lock:
+            entry = self.stages.setdefault(name, {'seconds': 0.0})
+            entry['seconds'] = round(entry['seconds'] + seconds, 3)
+            if peak_mb is not None:
+                entry['peak_mb'] = max(entry.get('peak_mb', 0.0), peak_mb)
+
+    @contextmanager
+    def stage(self, name):
+        tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        elif self.trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            peak_mb = None
+            if self.trace_memory:
+                peak_mb = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 1)
+            if tracing:
+                tracemalloc.stop()
+            self.add(name, seconds, peak_mb)
+
 
 class LanguageProcessingService:
-    def __init__(self, model_name="all-mpnet-base-v2"):
-        """Initialize the embedding service with a pre-trained model"""
-        self.model = SentenceTransformer(model_name)
-        self.umap_reducer = None
-        self.kmeans = None
-        self.sentiment_analyzer = SentimentIntensityAnalyzer()
+    def __init__(self, model_name="all-mpnet-base-v2", embedding_cache=None,
+                 batch_size=64, backend='torch', processes=0, n_clusters=5,
+                 large_chat_threshold=50000, umap_sample_size=20000, pca_components=50,
+                 sentiment_processes=0, engine=None, profile_memory=False):
+        """Initialize the embedding service with a pre-trained model.
+
+        batch_size, backend ('torch', 'int8', 'onnx') and processes configure
+        the EmbeddingEngine that runs the model. Chats of at least
+        large_chat_threshold messages are clustered in the scalable mode.
+        sentiment_processes > 1 scores sentiment in a pool of that many processes.
+        An already built engine (anything with EmbeddingEngine's interface)
+        can be passed instead, e.g. a stand-in encoder for benchmarks.
+        profile_memory adds the peak traced memory of each stage to the
+        fit_stats of large-mode fits; tracemalloc slows allocation-heavy
+        code several times over, so it is meant for profiling runs only.
+        """
+        self.model_name = model_name
+        self.engine = engine or EmbeddingEngine(model_name, batch_size=batch_size, backend=backend, processes=processes)
+        self.model = self.engine.model
+        self.embedding_cache = embedding_cache
+        self.n_clusters = n_clusters
+        self.large_chat_threshold = large_chat_threshold
+        self.umap_sample_size = umap_sample_size
+        self.pca_components = pca_components
+        self.sentiment = SentimentScorer(processes=sentiment_processes)
+        self.profile_memory = profile_memory
     
     def generate_embeddings(self, texts):
         """Generate embeddings for a list of texts"""
         if not texts:
             return []
         
-        # Generate embeddings using sentence-transformers
-        embeddings = self.model.encode(texts, convert_to_tensor=False)
-        return embeddings.tolist()
+        return self.encode(texts).tolist()
+    
+    def encode(self, texts, use_cache=True):
+        """Generate embeddings for a list of texts as a float32 (n, dim) array.
+
+        Texts are normalized and deduplicated first; with an embedding cache
+        (and use_cache) only the unique texts missing from the cache reach
+        the model.
+        """
+        dim = self.engine.get_sentence_embedding_dimension()
+        if not texts:
+            return np.empty((0, dim), dtype=np.float32)
+        
+        keys = [normalize_text(text) for text in texts]
+        unique = list(dict.fromkeys(keys))
+        
+        cache = self.embedding_cache if use_cache else None
+        vectors = {}
+        if cache is not None:
+            vectors = cache.get_many(self.engine.name, unique)
+        misses = [key for key in unique if key not in vectors]
+        
+        TEXTS_TOTAL.inc(len(texts) - len(misses), source='reused')
+        if misses:
+            # Generate embeddings using sentence-transformers
+            start = time.perf_counter()
+            encoded = self.engine.encode(misses)
+            seconds = time.perf_counter() - start
+            ENCODE_SECONDS.observe(seconds)
+            TEXTS_TOTAL.inc(len(misses), source='model')
+            if cache is not None:
+                cache.record_encode(len(misses), seconds)
+                cache.put_many(self.engine.name, zip(misses, encoded))
+            vectors.update(zip(misses, encoded))
+        
+        embeddings = np.empty((len(keys), dim), dtype=np.float32)
+        for i, key in enumerate(keys):
+            embeddings[i] = vectors[key]
+        return embeddings
     
     def generate_clusters(self, embeddings, n_clusters=5):
         """Generate cluster coordinates using UMAP and KMeans"""
+        return self.fit_projection(embeddings, n_clusters)[0]
+    
+    def fit_projection(self, embeddings, n_clusters=None, strata=None, large=None):
+        """Fit UMAP and KMeans on embeddings; returns (coordinates, fitted models).
+
+        The models are returned rather than kept on the service, which is
+        shared by every request; callers save them per chat. Chats of at
+        least large_chat_threshold messages (or large=True) go through
+        fit_large_projection instead.
+        """
         if len(embeddings) < 2:
-            return []
+            return [], None
+        n_clusters = n_clusters or self.n_clusters
+        if large or (large is None and len(embeddings) >= self.large_chat_threshold):
+            return self.fit_large_projection(embeddings, n_clusters, strata)
         
-        embeddings_array = np.array(embeddings)
+        # Imported here: umap and scikit-learn are slow to import and only
+        # needed by uploads
+        import umap
+        from sklearn.cluster import KMeans
+        
+        profile = StageProfile()
+        embeddings_array = np.asarray(embeddings, dtype=np.float32)
         
         # Apply UMAP for dimensionality reduction
-        self.umap_reducer = umap.UMAP(
+        reducer = umap.UMAP(
             n_neighbors=min(5, len(embeddings) - 1),
             n_components=2,
             random_state=42
         )
         
         # Reduce to 2D
-        reduced_embeddings = self.umap_reducer.fit_transform(embeddings_array)
+        with profile.stage('umap'):
+            reduced_embeddings = reducer.fit_transform(embeddings_array)
         
         # Apply KMeans clustering
         n_clusters = min(n_clusters, len(embeddings))
-        self.kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-        cluster_labels = self.kmeans.fit_predict(reduced_embeddings)
+        kmeans = KMeans(n_clusters=n_clusters, random_state=42)
+        with profile.stage('kmeans'):
+            cluster_labels = kmeans.fit_predict(reduced_embeddings)
+        
+        projection = {'reducer': reducer, 'kmeans': kmeans, 'fit_stats': {'mode': 'full', 'stages': profile.stages}}
+        return self._coordinates(reduced_embeddings, cluster_labels), projection
+    
+    def fit_large_projection(self, embeddings, n_clusters=None, strata=None, chunk_size=10000):
+        """Scalable variant of fit_projection for very large chats.
+
+        Embeddings are first reduced to pca_components dimensions with PCA.
+        UMAP is fitted on a sample of umap_sample_size points, stratified by
+        strata (e.g. sender) or else by position in the chat, and every
+        point is then placed with transform in chunks. MiniBatchKMeans
+        clusters the 2D map. Per-stage seconds (and with profile_memory,
+        peak traced memory) are returned in the models' fit_stats.
+        """
+        import umap
+        from sklearn.cluster import MiniBatchKMeans
+        from sklearn.decomposition import PCA
+        
+        n_clusters = min(n_clusters or self.n_clusters, len(embeddings))
+        profile = StageProfile(trace_memory=self.profile_memory)
+        embeddings_array = np.asarray(embeddings, dtype=np.float32)
+        
+        pca = None
+        with profile.stage('pca'):
+            if embeddings_array.shape[1] > self.pca_components:
+                pca = PCA(n_components=self.pca_components, svd_solver='randomized', random_state=42)
+                pca.fit(embeddings_array[self._stratified_sample(len(embeddings_array), strata)])
+                embeddings_array = self._transform_chunked(pca, embeddings_array, chunk_size)
+        
+        with profile.stage('umap_fit'):
+            sample = self._stratified_sample(len(embeddings_array), strata)
+            reducer = umap.UMAP(
+                n_neighbors=min(5, len(sample) - 1),
+                n_components=2,
+                low_memory=True,
+                random_state=42
+            )
+            reducer.fit(embeddings_array[sample])
         
+        with profile.stage('umap_transform'):
+            reduced_embeddings = self._transform_chunked(reducer, embeddings_array, chunk_size)
+        
+        with profile.stage('kmeans'):
+            kmeans = MiniBatchKMeans(n_clusters=n_clusters, batch_size=4096, n_init=3, random_state=42)
+            cluster_labels = kmeans.fit_predict(reduced_embeddings)
+        
+        projection = {
+            'pca': pca,
+            'reducer': reducer,
+            'kmeans': kmeans,
+            'fit_stats': {'mode': 'large', 'sample_size': int(len(sample)), 'stages': profile.stages}
+        }
+        return self._coordinates(reduced_embeddings, cluster_labels), projection
+    
+    def _stratified_sample(self, n, strata=None):
+        """Sorted indices of up to umap_sample_size points drawn proportionally from each stratum.
+
+        Without strata, the chat is cut into equal consecutive blocks so the
+        sample covers its whole time span.
+        """
+        if n <= self.umap_sample_size:
+            return np.arange(n)
+        rng = np.random.default_rng(42)
+        
+        if strata is None:
+            blocks = np.array_split(np.arange(n), min(self.umap_sample_size, 100))
+        else:
+            _, labels = np.unique(np.asarray(strata), return_inverse=True)
+            order = np.argsort(labels, kind='stable')
+            blocks = np.split(order, np.flatnonzero(np.diff(labels[order])) + 1)
+        
+        picked = []
+        for block in blocks:
+            # At least one point per stratum, so rare senders stay on the map
+            take = max(1, round(len(block) * self.umap_sample_size / n))
+            picked.append(rng.choice(block, size=min(take, len(block)), replace=False))
+        return np.sort(np.concatenate(picked))
+    
+    @staticmethod
+    def _transform_chunked(model, data, chunk_size):
+        return np.vstack([model.transform(data[start:start + chunk_size]) for start in range(0, len(data), chunk_size)])
+    
+    def project(self, projection, embeddings):
+        """Place embeddings on an already fitted map with transform, without refitting"""
+        if len(embeddings) == 0:
+            return []
+        embeddings_array = np.asarray(embeddings, dtype=np.float32)
+        if projection.get('pca') is not None:
+            embeddings_array = projection['pca'].transform(embeddings_array)
+        reduced_embeddings = projection['reducer'].transform(embeddings_array)
+        cluster_labels = projection['kmeans'].predict(reduced_embeddings)
+        return self._coordinates(reduced_embeddings, cluster_labels)
+    
+    @staticmethod
+    def _coordinates(reduced_embeddings, cluster_labels):
         # Return coordinates and cluster assignments
         coordinates = []
         for i, (x, y) in enumerate(reduced_embeddings):
@@ -62,25 +284,96 @@ class LanguageProcessingService:
         if not texts:
             return []
 
-        sentiments = []
-        for text in texts:
-            scores = self.sentiment_analyzer.polarity_scores(text)
-            sentiments.append(float(scores.get('compound', 0.0)))
+        return self.sentiment.score(texts)
+    
+    def process_chat_data(self, messages, progress_callback=None, chunk_size=1024):
+        """Process chat data to generate embeddings, clusters, and sentiment.
 
-        return sentiments
+        If given, progress_callback(stage, progress) is called as each stage
+        ('embed', 'sentiment', 'cluster') advances, with progress in [0, 1].
+        """
+        total = len(messages)
+        
+        def batches():
+            for start in range(0, total, chunk_size):
+                if progress_callback:
+                    progress_callback('embed', start / total)
+                    progress_callback('sentiment', start / total)
+                yield messages[start:start + chunk_size]
+        
+        return self.process_message_batches(batches(), progress_callback)
     
-    def process_chat_data(self, messages):
-        """Process chat data to generate embeddings, clusters, and sentiment"""
-        texts = [msg['message'] for msg in messages]
+    def process_message_batches(self, batches, progress_callback=None):
+        """Process an iterable of message batches as they arrive.
+
+        Each batch is embedded and scored as soon as it is produced, so a lazy
+        parser feeding this method overlaps with the model. Clustering needs
+        every embedding and runs once the batches are exhausted.
+        """
+        return self.analyze_message_batches(batches, progress_callback)[0]
+    
+    def analyze_message_batches(self, batches, progress_callback=None, projection=None, refit=True):
+        """Like process_message_batches, but returns (processed_data, projection, timings).
+
+        Without a projection, UMAP and KMeans are fitted on these messages and
+        returned so they can be saved with the chat. With the fitted models
+        of an existing chat, the messages are placed on its map by transform.
+        With neither (refit=False), cluster coordinates are left as None.
+
+        Sentiment is scored on a background thread while the next batch is
+        embedded. timings holds the wall-clock seconds of each stage and of
+        the whole call; overlapping stages add up to more than the total.
+        """
+        def report(stage, progress):
+            if progress_callback:
+                progress_callback(stage, progress)
         
-        # Generate embeddings
-        embeddings = self.generate_embeddings(texts)
+        profile = StageProfile()
+        start = time.perf_counter()
         
-        # Generate cluster coordinates
-        cluster_coords = self.generate_clusters(embeddings)
+        def score(texts):
+            with profile.stage('sentiment'):
+                return self.calculate_sentiment(texts)
+        
+        messages = []
+        embedding_batches = []
+        sentiment_futures = []
+        
+        report('embed', 0.0)
+        report('sentiment', 0.0)
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='sentiment') as sentiment_thread:
+            batches = iter(batches)
+            while True:
+                with profile.stage('parse'):
+                    batch = next(batches, None)
+                if batch is None:
+                    break
+                texts = [msg['message'] for msg in batch]
+                sentiment_futures.append(sentiment_thread.submit(score, texts))
+                with profile.stage('embed'):
+                    embedding_batches.append(self.encode(texts))
+                messages.extend(batch)
+            sentiments = [value for future in sentiment_futures for value in future.result()]
+        report('embed', 1.0)
+        report('sentiment', 1.0)
         
-        # Calculate sentiment
-        sentiments = self.calculate_sentiment(texts)
+        if not messages:
+            profile.add('total', time.perf_counter() - start)
+            return [], projection, profile.stages
+        embeddings = np.vstack(embedding_batches)
+        
+        # Generate cluster coordinates
+        report('cluster', 0.0)
+        with profile.stage('cluster'):
+            if projection is not None:
+                cluster_coords = self.project(projection, embeddings)
+            elif refit:
+                cluster_coords, projection = self.fit_projection(
+                    embeddings, strata=[msg['sender'] for msg in messages]
+                )
+            else:
+                cluster_coords = []
+        report('cluster', 1.0)
         
         # Combine results
         processed_data = []
@@ -97,44 +390,5 @@ class LanguageProcessingService:
                 'cluster': cluster_coords[i]['cluster'] if i < len(cluster_coords) else None
             })
         
-        return processed_data
-
-def main():
-    """Command line interface for processing chat data"""
-    if len(sys.argv) != 2:
-        print("Usage: python language_processing.py <input_json>")
-        sys.exit(1)
-    
-    try:
-        # Read input JSON
-        input_data = json.loads(sys.argv[1])
-        messages = input_data.get('messages', [])
-        
-        # Process data
-        service = LanguageProcessingService()
-        processed_data = service.process_chat_data(messages)
-        
-        # Output results
-        output = {
-            'embeddings': [item['embedding'] for item in processed_data],
-            'sentiments': [item['sentiment'] for item in processed_data],
-            'clusters': [
-                {
-                    'id': item['id'],
-                    'x': item['cluster_x'],
-                    'y': item['cluster_y'],
-                    'cluster': item['cluster']
-                }
-                for item in processed_data
-            ]
-        }
-        
-        print(json.dumps(output))
-        
-    except Exception as e:
-        print(f"Error: {str(e)}", file=sys.stderr)
-        sys.exit(1)
-
-if __name__ == "__main__":
-    main()
-
+        profile.add('total', time.perf_counter() - start)
+        return processed_data, projection, profile.stages
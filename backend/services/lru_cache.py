@@ -0,0 +1,74 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Bounded, thread-safe LRU cache whose entries also expire after ttl seconds.
+
+    With max_bytes, entries set with an nbytes size are also evicted while
+    their total exceeds it, except the most recently set one.
+    """
+
+    def __init__(self, max_size=1024, ttl=3600.0, max_bytes=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] < now:
+                if entry is not None:
+                    self._bytes -= self._data.pop(key)[2]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, nbytes=0):
+        with self._lock:
+            previous = self._data.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[2]
+            self._data[key] = (value, time.monotonic() + self.ttl, nbytes)
+            self._bytes += nbytes
+            while len(self._data) > self.max_size or (
+                self.max_bytes is not None and self._bytes > self.max_bytes and len(self._data) > 1
+            ):
+                self._bytes -= self._data.popitem(last=False)[1][2]
+                self.evictions += 1
+
+    def invalidate(self, predicate=None):
+        """Drop every entry, or only those whose key matches predicate(key)"""
+        with self._lock:
+            if predicate is None:
+                self._data.clear()
+                self._bytes = 0
+                return
+            for key in [key for key in self._data if predicate(key)]:
+                self._bytes -= self._data.pop(key)[2]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions
+            }
+            if self.max_bytes is not None:
+                stats.update(bytes=self._bytes, max_bytes=self.max_bytes)
+            return stats
@@ -0,0 +1,134 @@
+import hashlib
+import os
+import re
+import tempfile
+import threading
+
+import numpy as np
+
+from services.lru_cache import TTLCache
+
+_UNSAFE = re.compile(r'[^A-Za-z0-9_.-]')
+
+
+class MatrixStore:
+    """Exact KNN over per-chat float32 embedding matrices memory-mapped from disk.
+
+    A chat's embeddings live in <db_path>.vectors/<name>.npy, one
+    contiguous (n, dim) float32 block, with the message id of each row in
+    <name>.ids.npy; <name> is the chat id made filename-safe plus a hash of
+    the original, so ids differing only in unsafe characters never share
+    files. Files are opened with mmap, so every server worker shares the OS
+    page cache instead of holding its own copy, and a search is a single
+    matrix-vector product followed by argpartition. Files are replaced
+    atomically; readers notice a replaced file by its inode and mtime and
+    reopen it. The max_open most recently searched chats stay mapped.
+    """
+
+    def __init__(self, db_path, max_open=64):
+        self.directory = db_path + '.vectors'
+        self._open = TTLCache(max_size=max_open, ttl=float('inf'))
+        self._lock = threading.Lock()
+
+    def paths(self, chat_id):
+        digest = hashlib.sha1(chat_id.encode('utf-8')).hexdigest()[:16]
+        base = os.path.join(self.directory, f"{_UNSAFE.sub('_', chat_id)[:64]}-{digest}")
+        return base + '.npy', base + '.ids.npy'
+
+    def write(self, chat_id, ids, vectors, append=False):
+        """Store (or with append, extend) a chat's matrix"""
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if append:
+            loaded = self._load(chat_id)
+            if loaded is None:
+                raise ValueError(f'No vector matrix to append to for chat {chat_id}')
+            ids = np.concatenate([loaded[1], ids])
+            vectors = np.concatenate([loaded[0], vectors])
+
+        os.makedirs(self.directory, exist_ok=True)
+        vector_path, ids_path = self.paths(chat_id)
+        # ids first: a reader pairs the files by row count and rejects a mismatch
+        self._replace(ids_path, ids)
+        self._replace(vector_path, vectors)
+        self._open.invalidate(lambda key: key == chat_id)
+
+    def _replace(self, path, array):
+        # Write to a temporary file and rename, so readers never map half a file
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, array)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def delete(self, chat_id):
+        self._open.invalidate(lambda key: key == chat_id)
+        for path in self.paths(chat_id):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def rows(self, chat_id):
+        """Number of vectors stored for a chat, or None without a matrix"""
+        loaded = self._load(chat_id)
+        return None if loaded is None else len(loaded[1])
+
+    def knn(self, chat_id, query, k):
+        """(id, L2 distance) of the k rows nearest to query, nearest first; None without a matrix"""
+        loaded = self._load(chat_id)
+        if loaded is None:
+            return None
+        vectors, ids, squared_norms, _ = loaded
+        if len(ids) == 0:
+            return []
+
+        query = np.asarray(query, dtype=np.float32)
+        # |x - q|^2 = |x|^2 - 2 x.q + |q|^2, with |x|^2 computed once per mapping.
+        # In float32 the expansion is off by ~1e-2 near zero, so it only picks
+        # candidates (with headroom for near ties); their exact distances rank them
+        scores = squared_norms - 2 * (vectors @ query)
+        k = min(k, len(ids))
+        candidates = min(len(ids), 2 * k + 8)
+        top = np.argpartition(scores, candidates - 1)[:candidates] if candidates < len(ids) else np.arange(len(ids))
+        top = np.sort(top)  # ascending offsets read the mapping sequentially
+        diffs = vectors[top] - query
+        distances = np.sqrt(np.einsum('ij,ij->i', diffs, diffs))
+        order = np.argsort(distances, kind='stable')[:k]
+        return [(int(ids[top[j]]), float(distances[j])) for j in order]
+
+    def _load(self, chat_id):
+        vector_path, ids_path = self.paths(chat_id)
+        try:
+            stat = os.stat(vector_path)
+        except FileNotFoundError:
+            return None
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+        loaded = self._open.get(chat_id)
+        if loaded is not None and loaded[3] == signature:
+            return loaded
+
+        with self._lock:
+            loaded = self._open.get(chat_id)
+            if loaded is not None and loaded[3] == signature:
+                return loaded
+            try:
+                vectors = np.load(vector_path, mmap_mode='r')
+                ids = np.load(ids_path)
+            except (FileNotFoundError, ValueError):
+                return None
+            if len(ids) != len(vectors):
+                # Caught between the two renames of a write
+                return None
+            squared_norms = np.einsum('ij,ij->i', vectors, vectors)
+            loaded = (vectors, ids, squared_norms, signature)
+            self._open.set(chat_id, loaded)
+            return loaded
+
+    def stats(self):
+        """Hit rate and size of the LRU of mapped chats"""
+        return self._open.stats()
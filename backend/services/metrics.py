@@ -0,0 +1,202 @@
+"""In-process counters, latency histograms and timing spans.
+
+Metrics are registered once, at import time of the module that records
+them, in the process-wide REGISTRY, and rendered in the Prometheus text
+exposition format by /api/metrics. With several server worker processes,
+each one reports its own.
+"""
+import bisect
+import functools
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+# Seconds; from sub-millisecond SQLite lookups to multi-minute UMAP fits
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+_UNSAFE_NAME = re.compile(r'[^a-zA-Z0-9_]')
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_value(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class Counter:
+    """Monotonic count per label set"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def samples(self):
+        with self._lock:
+            return [(self.name + _format_labels(key), value) for key, value in sorted(self._values.items())]
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of observed values per label set"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'buckets': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            series['buckets'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Span: observe the seconds spent in the with block, even if it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def timer(self, label):
+        """Decorator timing each call, labelled label=<function name>"""
+        def decorate(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.time(**{label: func.__name__}):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def samples(self):
+        with self._lock:
+            series = [(key, list(s['buckets']), s['sum'], s['count']) for key, s in sorted(self._series.items())]
+        lines = []
+        for key, buckets, total, count in series:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float('inf'),), buckets):
+                cumulative += bucket
+                le = '+Inf' if bound == float('inf') else _format_value(bound)
+                lines.append((self.name + '_bucket' + _format_labels(key, [('le', le)]), cumulative))
+            lines.append((self.name + '_sum' + _format_labels(key), total))
+            lines.append((self.name + '_count' + _format_labels(key), count))
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def counter(self, name, documentation):
+        return self._register(Counter, name, documentation)
+
+    def histogram(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, buckets)
+
+    def _register(self, cls, name, documentation, *args):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, *args)
+            elif not isinstance(metric, cls):
+                raise ValueError(f'Metric {name} is already registered as a {metric.kind}')
+            return metric
+
+    def add_collector(self, collect):
+        """Register collect() -> {component: stats dict}, read at every render.
+
+        Numeric values of the (possibly nested) stats dicts are exported as
+        gauges named <component>_<key>, so existing stats() methods (pool,
+        caches, model) show up without recording anything twice.
+        """
+        self._collectors.append(collect)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(f'{name} {_format_value(value)}' for name, value in metric.samples())
+
+        for collect in self._collectors:
+            for component, stats in collect().items():
+                for name, value in _flatten(component, stats):
+                    lines.append(f'# TYPE {name} gauge')
+                    lines.append(f'{name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _flatten(prefix, stats):
+    for key, value in stats.items():
+        name = _UNSAFE_NAME.sub('_', f'{prefix}_{key}')
+        if isinstance(value, dict):
+            yield from _flatten(name, value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and value == value:
+            yield name, value
+
+
+class SlowQueryLog:
+    """The last max_entries statements slower than threshold_ms, with their query plans"""
+
+    def __init__(self, threshold_ms, max_entries=100):
+        self.threshold_ms = threshold_ms
+        self._entries = deque(maxlen=max_entries)
+        self._lock = threading.Lock()
+
+    def record(self, sql, seconds, plan):
+        entry = {
+            'at': datetime.now().isoformat(timespec='seconds'),
+            'ms': round(seconds * 1000, 3),
+            'sql': ' '.join(sql.split()),
+            'plan': plan
+        }
+        with self._lock:
+            self._entries.append(entry)
+
+    def entries(self):
+        """Newest first"""
+        with self._lock:
+            return list(reversed(self._entries))
+
+
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,146 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from services.metrics import REGISTRY
+
+BATCH_SIZE = REGISTRY.histogram(
+    'chat_query_batch_size', 'Search queries encoded per model call', buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+QUEUE_SECONDS = REGISTRY.histogram(
+    'chat_query_queue_seconds', 'Time a search query waited for its micro-batch to start'
+)
+
+
+class MicroBatcher:
+    """Coalesces concurrent encode calls into one model call per micro-batch.
+
+    The first request to arrive opens a window of max_wait_ms; every request
+    arriving within it (up to max_batch texts) is encoded together on a
+    single worker thread, and each caller gets back the rows of its own
+    texts. The window closes as soon as every request in flight has joined,
+    so a lone request is encoded without waiting. A request larger than
+    max_batch is encoded as a batch of its own.
+    With max_wait_ms = 0, calls go straight to encode. A caller waits at
+    most timeout seconds for its batch; its texts are dropped from the batch
+    if that has not started by then.
+    """
+
+    def __init__(self, encode, max_wait_ms=2.0, max_batch=32, timeout=30.0):
+        self.encode_batch = encode
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._batches = 0
+        self._requests = 0
+        self._texts = 0
+        self._largest = 0
+        self._queue_seconds = 0.0
+
+    def encode(self, texts):
+        """Embeddings of texts, encoded along with whatever else is queued"""
+        if not texts:
+            return self.encode_batch(texts)
+        if self.max_wait <= 0:
+            self._record(1, len(texts), 0.0)
+            return self.encode_batch(texts)
+
+        future = Future()
+        self._ensure_worker()
+        with self._lock:
+            self._in_flight += 1
+        self._queue.put((list(texts), future, time.perf_counter()))
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise TimeoutError(f'Query encoding did not finish within {self.timeout}s')
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_wait_ms': self.max_wait * 1000,
+                'max_batch': self.max_batch,
+                'batches': self._batches,
+                'requests': self._requests,
+                'texts': self._texts,
+                'mean_batch_texts': self._texts / self._batches if self._batches else 0.0,
+                'largest_batch_texts': self._largest,
+                'mean_queue_ms': self._queue_seconds * 1000 / self._requests if self._requests else 0.0
+            }
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name='query-batcher', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        carried = None
+        while True:
+            first = carried or self._queue.get()
+            carried = None
+            batch = [first]
+            # Whatever fails, every caller in the batch gets the exception
+            # instead of waiting forever, and the worker keeps running
+            try:
+                size = len(first[0])
+                deadline = first[2] + self.max_wait
+                while size < self.max_batch:
+                    # Nobody else to wait for: the window would only add latency
+                    if len(batch) >= self._in_flight and self._queue.empty():
+                        break
+                    remaining = deadline - time.perf_counter()
+                    try:
+                        # Past the window, requests already queued still join
+                        request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if size + len(request[0]) > self.max_batch:
+                        # Would overflow this batch: it opens the next one instead
+                        carried = request
+                        break
+                    batch.append(request)
+                    size += len(request[0])
+                self._encode(batch)
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _encode(self, batch):
+        # Callers that timed out have cancelled their futures; skip their texts
+        batch = [request for request in batch if request[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        started = time.perf_counter()
+        waits = [started - enqueued for _, _, enqueued in batch]
+        texts = [text for request_texts, _, _ in batch for text in request_texts]
+        for wait in waits:
+            QUEUE_SECONDS.observe(wait)
+        BATCH_SIZE.observe(len(texts))
+        self._record(len(batch), len(texts), sum(waits))
+
+        embeddings = self.encode_batch(texts)
+        start = 0
+        for request_texts, future, _ in batch:
+            future.set_result(embeddings[start:start + len(request_texts)])
+            start += len(request_texts)
+
+    def _record(self, requests, texts, queue_seconds):
+        with self._lock:
+            self._batches += 1
+            self._requests += requests
+            self._texts += texts
+            self._largest = max(self._largest, texts)
+            self._queue_seconds += queue_seconds
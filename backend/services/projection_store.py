@@ -0,0 +1,96 @@
+import hashlib
+import os
+import pickle
+import re
+import tempfile
+import threading
+
+from services.lru_cache import TTLCache
+
+_UNSAFE = re.compile(r'[^A-Za-z0-9_.-]')
+
+
+class ProjectionStore:
+    """Fitted per-chat projection models (UMAP reducer + KMeans), pickled next to the database.
+
+    A chat's models live in <db_path>.models/<name>.pkl, so appending to
+    or searching a chat can reuse its 2D map without refitting it; <name>
+    is the chat id made filename-safe plus a hash of the original, as in
+    MatrixStore. The
+    models of up to max_loaded most recently used chats stay unpickled in
+    memory, within max_bytes counted by pickle size. A UMAP reducer keeps
+    its training data and neighbour graph for transform, so one model can
+    take well over 100 MB; the most recently used one is kept regardless.
+    """
+
+    def __init__(self, db_path, max_loaded=16, max_bytes=512 * 1024 * 1024):
+        self.directory = db_path + '.models'
+        self._loaded = TTLCache(max_size=max_loaded, ttl=float('inf'), max_bytes=max_bytes)
+        self._load_lock = threading.Lock()
+
+    def path(self, chat_id):
+        digest = hashlib.sha1(chat_id.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.directory, f"{_UNSAFE.sub('_', chat_id)[:64]}-{digest}.pkl")
+
+    def _legacy_path(self, chat_id):
+        # Models saved before names carried a hash; only an id that was already
+        # filename-safe owns its old name unambiguously
+        if _UNSAFE.search(chat_id):
+            return None
+        return os.path.join(self.directory, chat_id + '.pkl')
+
+    def save(self, chat_id, projection):
+        os.makedirs(self.directory, exist_ok=True)
+        # Write to a temporary file and rename, so readers never see half a pickle
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(projection, f, protocol=pickle.HIGHEST_PROTOCOL)
+                nbytes = f.tell()
+            os.replace(tmp_path, self.path(chat_id))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self._loaded.set(chat_id, projection, nbytes)
+
+    def load(self, chat_id):
+        """The chat's fitted models, or None if none were saved"""
+        projection = self._loaded.get(chat_id)
+        if projection is not None:
+            return projection
+
+        # One unpickle at a time: concurrent searches on a cold chat would
+        # otherwise each load their own copy of its models
+        with self._load_lock:
+            projection = self._loaded.get(chat_id)
+            if projection is not None:
+                return projection
+            projection = nbytes = None
+            for path in (self.path(chat_id), self._legacy_path(chat_id)):
+                if path is None:
+                    continue
+                try:
+                    with open(path, 'rb') as f:
+                        projection = pickle.load(f)
+                        nbytes = f.tell()
+                    break
+                except FileNotFoundError:
+                    pass
+            if projection is None:
+                return None
+            self._loaded.set(chat_id, projection, nbytes)
+            return projection
+
+    def delete(self, chat_id):
+        self._loaded.invalidate(lambda key: key == chat_id)
+        for path in (self.path(chat_id), self._legacy_path(chat_id)):
+            if path is None:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        """Hit rate and size of the in-memory LRU of loaded models"""
+        return self._loaded.stats()
@@ -0,0 +1,145 @@
+"""Process-wide service instances shared by every blueprint.
+
+The language model and its heavy imports (sentence-transformers, torch,
+umap, scikit-learn) are only loaded when a service first needs them, or
+by an explicit warmup(), so the server can answer /api/health right away.
+"""
+import os
+import threading
+import time
+import traceback
+
+from services.database import DatabaseService
+from services.embedding_cache import EmbeddingCache
+from services.micro_batcher import MicroBatcher
+from services.projection_store import ProjectionStore
+
+_lock = threading.Lock()
+# Separate lock so loading the model never blocks database-only requests
+_lp_lock = threading.Lock()
+_db_service = None
+_embedding_cache = None
+_projection_store = None
+_lp_service = None
+_query_batcher = None
+_lp_state = {'status': 'not_loaded', 'error': None, 'load_seconds': None}
+
+
+def get_db_service():
+    global _db_service
+    with _lock:
+        if _db_service is None:
+            # VECTOR_STORAGE (float/int8/bit) picks the mode of a new database; an
+            # existing one must already use it (see tools.convert_vector_storage).
+            # SLOW_QUERY_MS > 0 keeps slower statements with their query plans.
+            # Chats up to MATRIX_SEARCH_MAX_MESSAGES are searched exactly from
+            # memory-mapped matrices (0 searches every chat through vec0)
+            _db_service = DatabaseService(
+                db_path=os.environ.get('CHAT_DB_PATH', 'chat_data.db'),
+                vector_storage=os.environ.get('VECTOR_STORAGE') or None,
+                slow_query_ms=float(os.environ.get('SLOW_QUERY_MS', 0)) or None,
+                matrix_max_messages=int(os.environ.get('MATRIX_SEARCH_MAX_MESSAGES', 200000))
+            )
+        return _db_service
+
+
+def get_embedding_cache():
+    global _embedding_cache
+    db_service = get_db_service()
+    with _lock:
+        if _embedding_cache is None:
+            _embedding_cache = EmbeddingCache(
+                db_service, max_entries=int(os.environ.get('EMBEDDING_CACHE_MAX_ENTRIES', 100000))
+            )
+        return _embedding_cache
+
+
+def get_projection_store():
+    global _projection_store
+    db_service = get_db_service()
+    with _lock:
+        if _projection_store is None:
+            _projection_store = ProjectionStore(
+                db_service.db_path,
+                max_loaded=int(os.environ.get('PROJECTION_CACHE_SIZE', 16)),
+                max_bytes=int(os.environ.get('PROJECTION_CACHE_MB', 512)) * 1024 * 1024
+            )
+        return _projection_store
+
+
+def get_language_processing_service():
+    """Shared LanguageProcessingService, loading the model on first call"""
+    global _lp_service
+    if _lp_service is not None:
+        return _lp_service
+
+    embedding_cache = get_embedding_cache()
+    with _lp_lock:
+        if _lp_service is not None:
+            return _lp_service
+
+        _lp_state.update(status='loading', error=None)
+        start = time.perf_counter()
+        try:
+            from services.language_processing import LanguageProcessingService
+            _lp_service = LanguageProcessingService(
+                model_name=os.environ.get('EMBEDDING_MODEL', 'all-mpnet-base-v2'),
+                embedding_cache=embedding_cache,
+                batch_size=int(os.environ.get('EMBEDDING_BATCH_SIZE', 64)),
+                backend=os.environ.get('EMBEDDING_BACKEND', 'torch'),
+                processes=int(os.environ.get('EMBEDDING_PROCESSES', 0)),
+                n_clusters=int(os.environ.get('CLUSTER_COUNT', 5)),
+                large_chat_threshold=int(os.environ.get('CLUSTER_LARGE_THRESHOLD', 50000)),
+                umap_sample_size=int(os.environ.get('CLUSTER_SAMPLE_SIZE', 20000)),
+                sentiment_processes=int(os.environ.get('SENTIMENT_PROCESSES', 0)),
+                profile_memory=os.environ.get('CLUSTER_PROFILE_MEMORY') == '1'
+            )
+        except Exception as e:
+            _lp_state.update(status='failed', error=str(e))
+            raise
+        _lp_state.update(status='ready', load_seconds=round(time.perf_counter() - start, 3))
+        return _lp_service
+
+
+def get_query_batcher():
+    """Micro-batcher coalescing concurrent search query encodes into shared model calls"""
+    global _query_batcher
+    lp_service = get_language_processing_service()
+    with _lock:
+        if _query_batcher is None:
+            # QUERY_BATCH_WAIT_MS=0 turns batching off; one-off queries stay
+            # out of the persistent message embedding cache
+            _query_batcher = MicroBatcher(
+                lambda texts: lp_service.encode(texts, use_cache=False),
+                max_wait_ms=float(os.environ.get('QUERY_BATCH_WAIT_MS', 2)),
+                max_batch=int(os.environ.get('QUERY_BATCH_MAX', 32)),
+                timeout=float(os.environ.get('QUERY_BATCH_TIMEOUT_S', 30))
+            )
+        return _query_batcher
+
+
+def language_processing_loaded():
+    return _lp_service is not None
+
+
+def warmup(background=False):
+    """Load the model now instead of on the first request that needs it"""
+    if not background:
+        get_language_processing_service()
+        return
+
+    def run():
+        try:
+            get_language_processing_service()
+        except Exception:
+            traceback.print_exc()
+
+    threading.Thread(target=run, name='model-warmup', daemon=True).start()
+
+
+def readiness():
+    """State of the lazily loaded services, for the readiness probe"""
+    return {
+        'ready': _lp_state['status'] == 'ready',
+        'language_model': dict(_lp_state)
+    }
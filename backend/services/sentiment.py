@@ -0,0 +1,78 @@
+import atexit
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+
+from services.lru_cache import TTLCache
+
+_analyzer = None
+
+
+def score_texts(texts):
+    """VADER compound scores in [-1, 1]; also the task run by pool workers"""
+    global _analyzer
+    if _analyzer is None:
+        _analyzer = SentimentIntensityAnalyzer()
+    return [float(_analyzer.polarity_scores(text).get('compound', 0.0)) for text in texts]
+
+
+class SentimentScorer:
+    """VADER sentiment with a per-text memo, optionally spread over a process pool.
+
+    VADER is pure Python and holds the GIL, so with processes > 1 large
+    inputs are split into chunks of chunk_size texts scored by worker
+    processes. Repeated texts ("ok", "<Media omitted>") are scored once.
+    """
+
+    def __init__(self, processes=0, chunk_size=512, memo_size=100000):
+        self.processes = processes
+        self.chunk_size = chunk_size
+        # Scores never go stale, so entries only leave the memo by LRU eviction
+        self.memo = TTLCache(max_size=memo_size, ttl=float('inf'))
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def score(self, texts):
+        scores = [None] * len(texts)
+        missing = {}
+        for i, text in enumerate(texts):
+            score = self.memo.get(text)
+            if score is None:
+                missing.setdefault(text, []).append(i)
+            else:
+                scores[i] = score
+
+        unique = list(missing)
+        for text, score in zip(unique, self._score(unique)):
+            self.memo.set(text, score)
+            for i in missing[text]:
+                scores[i] = score
+        return scores
+
+    def stats(self):
+        return {'processes': self.processes, 'memo': self.memo.stats()}
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown()
+
+    def _score(self, texts):
+        if self.processes <= 1 or len(texts) < 2 * self.chunk_size:
+            return score_texts(texts)
+        chunks = [texts[start:start + self.chunk_size] for start in range(0, len(texts), self.chunk_size)]
+        return [score for chunk in self._get_pool().map(score_texts, chunks) for score in chunk]
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # spawn rather than fork: the server process runs model and
+                # request threads whose locks a forked child could inherit held
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.processes, mp_context=multiprocessing.get_context('spawn')
+                )
+                atexit.register(self.close)
+            return self._pool
@@ -0,0 +1,171 @@
+import numpy as np
+
+EMBEDDING_DIM = 768
+
+# Components of unit-length mpnet embeddings stay well inside +-0.5, so int8
+# codes use that range rather than +-1 to keep more resolution
+INT8_RANGE = 0.5
+
+
+class VectorStore:
+    """sqlite-vec storage for message embeddings, partitioned by chat.
+
+    storage:
+        'float' - FLOAT[768] vectors in vec0; KNN distances are exact (~3 KB/message)
+        'int8'  - INT8[768] codes in vec0 for a coarse KNN (768 B/message)
+        'bit'   - BIT[768] sign bits in vec0 for a coarse hamming KNN (96 B/message)
+
+    In the compact modes a float16 copy of every vector is kept in a plain
+    table, and the top rescore_oversample * k coarse candidates are re-ranked
+    by exact L2 distance against it. float16 keeps ~3 significant digits,
+    which is enough to order neighbours of the fp32 query.
+
+    The default oversample is per mode. On 4 x 3000 synthetic 768-d chats
+    (benchmarks.vector_search --storage), recall@10 for int8 was 1.0 from 4x
+    upward. For bit it was 0.62 at 4x, 0.86 at 8x and 1.0 from 16x upward.
+    Each doubling roughly halves bit QPS (600 at 8x, 340 at 16x, 175 at 32x).
+    """
+
+    STORAGES = ('float', 'int8', 'bit')
+    _COLUMN_TYPES = {'float': 'FLOAT', 'int8': 'INT8', 'bit': 'BIT'}
+    _PARAMS = {'float': '?', 'int8': 'vec_int8(?)', 'bit': 'vec_bit(?)'}
+    # Sign bits rank neighbours far more coarsely than int8 codes
+    DEFAULT_OVERSAMPLE = {'float': 1, 'int8': 8, 'bit': 32}
+
+    def __init__(self, storage='float', dim=EMBEDDING_DIM, rescore_oversample=None):
+        if storage not in self.STORAGES:
+            raise ValueError(f'Unknown vector storage {storage!r}, expected one of {self.STORAGES}')
+        self.storage = storage
+        self.dim = dim
+        self.rescore_oversample = rescore_oversample or self.DEFAULT_OVERSAMPLE[storage]
+
+    @property
+    def compact(self):
+        return self.storage != 'float'
+
+    def create_tables(self, conn):
+        conn.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS message_vectors
+            USING vec0(
+                id INTEGER PRIMARY KEY,
+                chat_id TEXT PARTITION KEY,
+                embedding {self._COLUMN_TYPES[self.storage]}[{self.dim}]
+            )
+        ''')
+        if self.compact:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS message_vectors_full (
+                    id INTEGER PRIMARY KEY,
+                    embedding BLOB NOT NULL
+                )
+            ''')
+
+    def drop_tables(self, conn):
+        conn.execute('DROP TABLE IF EXISTS message_vectors')
+        conn.execute('DROP TABLE IF EXISTS message_vectors_full')
+
+    def quantize(self, vectors):
+        """Encode a (n, dim) float32 array into the coarse index representation"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.storage == 'int8':
+            return np.clip(np.rint(vectors * (127 / INT8_RANGE)), -127, 127).astype(np.int8)
+        if self.storage == 'bit':
+            return np.packbits(vectors > 0, axis=-1, bitorder='little')
+        return vectors
+
+    def insert(self, cursor, rows):
+        """Insert (id, chat_id, float vector) rows"""
+        rows = list(rows)
+        if not rows:
+            return
+        vectors = np.stack([np.asarray(vector, dtype=np.float32) for _, _, vector in rows])
+
+        cursor.executemany(
+            f'INSERT INTO message_vectors (id, chat_id, embedding) VALUES (?, ?, {self._PARAMS[self.storage]})',
+            ((message_id, chat_id, code.tobytes()) for (message_id, chat_id, _), code in zip(rows, self.quantize(vectors)))
+        )
+        if self.compact:
+            cursor.executemany(
+                'INSERT INTO message_vectors_full (id, embedding) VALUES (?, ?)',
+                ((message_id, vector.astype(np.float16).tobytes()) for (message_id, _, _), vector in zip(rows, vectors))
+            )
+
+    def delete(self, conn, message_id):
+        conn.execute('DELETE FROM message_vectors WHERE id = ?', (message_id,))
+        if self.compact:
+            conn.execute('DELETE FROM message_vectors_full WHERE id = ?', (message_id,))
+
+    def delete_range(self, conn, first_id, end_id):
+        conn.execute('DELETE FROM message_vectors WHERE id >= ? AND id < ?', (first_id, end_id))
+        if self.compact:
+            conn.execute('DELETE FROM message_vectors_full WHERE id >= ? AND id < ?', (first_id, end_id))
+
+    def fetch(self, conn, message_id):
+        """Float32 vector of a message, or None"""
+        if self.compact:
+            row = conn.execute('SELECT embedding FROM message_vectors_full WHERE id = ?', (message_id,)).fetchone()
+            return np.frombuffer(row[0], dtype=np.float16).astype(np.float32) if row else None
+        row = conn.execute('SELECT embedding FROM message_vectors WHERE id = ?', (message_id,)).fetchone()
+        return np.frombuffer(row[0], dtype=np.float32) if row else None
+
+    def fetch_chat(self, conn, chat_id):
+        """(ids, float32 (n, dim) vectors) of every message of a chat, in id order"""
+        table = 'message_vectors_full' if self.compact else 'message_vectors'
+        rows = conn.execute(f'''
+            SELECT v.id, v.embedding FROM messages m JOIN {table} v ON v.id = m.id
+            WHERE m.chat_id = ?
+            ORDER BY m.id
+        ''', (chat_id,)).fetchall()
+        dtype = np.float16 if self.compact else np.float32
+        vectors = np.empty((len(rows), self.dim), dtype=np.float32)
+        for i, row in enumerate(rows):
+            vectors[i] = np.frombuffer(row[1], dtype=dtype)
+        return np.array([row[0] for row in rows], dtype=np.int64), vectors
+
+    def iter_all(self, conn, batch_size=5000):
+        """Yield batches of (id, chat_id, float32 vector) for every stored vector"""
+        if self.compact:
+            cursor = conn.execute('''
+                SELECT f.id, v.chat_id, f.embedding
+                FROM message_vectors_full f JOIN message_vectors v ON v.id = f.id
+            ''')
+            dtype = np.float16
+        else:
+            cursor = conn.execute('SELECT id, chat_id, embedding FROM message_vectors')
+            dtype = np.float32
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [(row[0], row[1], np.frombuffer(row[2], dtype=dtype).astype(np.float32)) for row in rows]
+
+    def knn(self, conn, chat_id, query, k):
+        """(id, distance) of the k messages of a chat nearest to query, nearest first"""
+        query = np.asarray(query, dtype=np.float32)
+        coarse_k = k * self.rescore_oversample if self.compact else k
+        code = self.quantize(query[None, :])[0]
+
+        cursor = conn.execute(f'''
+            SELECT id, distance
+            FROM message_vectors
+            WHERE embedding MATCH {self._PARAMS[self.storage]} AND k = ? AND chat_id = ?
+            ORDER BY distance
+        ''', (code.tobytes(), coarse_k, chat_id))
+        candidates = cursor.fetchall()
+        if not self.compact or not candidates:
+            return candidates
+
+        return self._rescore(conn, query, [row[0] for row in candidates], k)
+
+    def _rescore(self, conn, query, ids, k):
+        placeholders = ','.join('?' * len(ids))
+        rows = conn.execute(
+            f'SELECT id, embedding FROM message_vectors_full WHERE id IN ({placeholders})', ids
+        ).fetchall()
+        if not rows:
+            return []
+
+        full = np.stack([np.frombuffer(row[1], dtype=np.float16) for row in rows]).astype(np.float32)
+        distances = np.linalg.norm(full - query, axis=1)
+        order = np.argsort(distances)[:k]
+        return [(rows[i][0], float(distances[i])) for i in order]
@@ -0,0 +1,203 @@
+import hashlib
+import io
+import re
+from collections import Counter
+from datetime import datetime
+from itertools import chain
+
+# Time part shared by every layout: HH:MM[:SS] with an optional AM/PM marker.
+# Newer exports put a narrow no-break space (U+202F) before the marker.
+_TIME = r'(?P<time>\d{1,2}[:.]\d{2}(?:[:.]\d{2})?(?:[\s\u202f]?[AaPp]\.?\s?[Mm]\.?)?)'
+_DATE = r'(?P<date>\d{1,2}[/.\-]\d{1,2}[/.\-]\d{2,4})'
+
+# iOS:     [DD/MM/YYYY, HH:MM:SS] Sender: Message
+# Android: DD/MM/YYYY, HH:MM - Sender: Message
+FORMATS = {
+    'ios': re.compile(r'\[' + _DATE + r',? ' + _TIME + r'\] (?P<rest>.*)'),
+    'android': re.compile(_DATE + r',? ' + _TIME + r' - (?P<rest>.*)')
+}
+
+_AMPM = re.compile(r'[\s\u202f]?([AaPp])\.?\s?[Mm]\.?$')
+_DATE_SEP = re.compile(r'[/.\-]')
+_TIME_SEP = re.compile(r'[:.]')
+# Invisible direction marks WhatsApp sprinkles in front of lines and attachments
+_BIDI_MARKS = '\u200e\u200f\ufeff'
+
+DETECT_SAMPLE_LINES = 500
+
+
+class ExportFormat:
+    """Layout of a WhatsApp export, detected once from the first lines of the file"""
+
+    def __init__(self, name, day_first=True, twelve_hour=False):
+        self.name = name
+        self.pattern = FORMATS[name]
+        self.day_first = day_first
+        self.twelve_hour = twelve_hour
+
+    def parse_timestamp(self, date_str, time_str):
+        """Build a datetime from the matched date and time strings"""
+        first, second, year = (int(part) for part in _DATE_SEP.split(date_str))
+        day, month = (first, second) if self.day_first else (second, first)
+        if year < 100:
+            year += 2000
+
+        meridiem = None
+        marker = _AMPM.search(time_str)
+        if marker:
+            meridiem = marker.group(1).lower()
+            time_str = time_str[:marker.start()]
+
+        parts = [int(part) for part in _TIME_SEP.split(time_str)]
+        hour, minute = parts[0], parts[1]
+        second = parts[2] if len(parts) > 2 else 0
+        if meridiem == 'p' and hour < 12:
+            hour += 12
+        elif meridiem == 'a' and hour == 12:
+            hour = 0
+
+        return datetime(year, month, day, hour, minute, second)
+
+    def __repr__(self):
+        clock = '12h' if self.twelve_hour else '24h'
+        order = 'DD/MM' if self.day_first else 'MM/DD'
+        return f'ExportFormat({self.name}, {order}, {clock})'
+
+
+def detect_format(lines):
+    """Pick the export layout, date order and clock that best fit a sample of lines"""
+    best_name, best_matches = 'ios', []
+    for name, pattern in FORMATS.items():
+        matches = [m for m in (pattern.match(line.lstrip(_BIDI_MARKS)) for line in lines) if m]
+        if len(matches) > len(best_matches):
+            best_name, best_matches = name, matches
+
+    # A first field above 12 means DD/MM, a second field above 12 means MM/DD;
+    # without either hint keep the DD/MM order the original parser assumed
+    day_first = True
+    for match in best_matches:
+        first, second, _ = (int(part) for part in _DATE_SEP.split(match.group('date')))
+        if first > 12:
+            break
+        if second > 12:
+            day_first = False
+            break
+
+    twelve_hour = any(_AMPM.search(match.group('time')) for match in best_matches)
+    return ExportFormat(best_name, day_first=day_first, twelve_hour=twelve_hour)
+
+
+def iter_whatsapp_messages(lines, export_format=None):
+    """Yield messages from an iterable of export lines, joining multi-line messages.
+
+    Only the first DETECT_SAMPLE_LINES lines are held in memory (to detect the
+    format when export_format is not given); the rest is consumed lazily.
+    """
+    lines = iter(lines)
+    if export_format is None:
+        sample = []
+        for line in lines:
+            sample.append(line.rstrip('\r\n'))
+            if len(sample) >= DETECT_SAMPLE_LINES:
+                break
+        export_format = detect_format(sample)
+        lines = chain(sample, lines)
+
+    pattern = export_format.pattern
+    current = None
+
+    for line in lines:
+        line = line.rstrip('\r\n')
+        match = pattern.match(line.lstrip(_BIDI_MARKS))
+
+        if match is None:
+            # Not a new message header: continuation of the previous message
+            if current is not None:
+                current['message'] += '\n' + line
+            continue
+
+        if current is not None:
+            current['message'] = current['message'].strip()
+            if current['message']:
+                yield current
+            current = None
+
+        sender, sep, text = match.group('rest').partition(': ')
+        if not sep or ':' in sender:
+            # System notice ("Messages are end-to-end encrypted", "X joined", ...)
+            continue
+
+        try:
+            timestamp = export_format.parse_timestamp(match.group('date'), match.group('time'))
+        except ValueError:
+            continue
+
+        current = {
+            'timestamp': timestamp.isoformat(),
+            'sender': sender.strip(_BIDI_MARKS + ' '),
+            'message': text
+        }
+
+    if current is not None:
+        current['message'] = current['message'].strip()
+        if current['message']:
+            yield current
+
+
+def iter_message_batches(stream, batch_size=1024, encoding='utf-8-sig'):
+    """Yield lists of up to batch_size messages read incrementally from a text or binary stream"""
+    if isinstance(stream, str):
+        stream = io.StringIO(stream)
+    elif not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding=encoding, errors='replace', newline=None)
+
+    batch = []
+    for message in iter_whatsapp_messages(stream):
+        batch.append(message)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def message_fingerprint(timestamp, sender, message):
+    """(timestamp, sender, message hash) identifying a message across re-exports of a chat"""
+    return timestamp, sender, hashlib.sha1(' '.join(message.split()).encode('utf-8')).digest()
+
+
+def iter_new_message_batches(batches, last_timestamp, last_messages):
+    """Drop the messages of a re-export that a chat already holds, keeping what follows.
+
+    last_timestamp and last_messages, (sender, message) pairs, describe the
+    stored chat's tail. Older messages are skipped by timestamp and the ones
+    at last_timestamp are matched by fingerprint. Raises ValueError if the
+    export does not contain the stored tail, i.e. is not the same chat.
+    """
+    pending = Counter(message_fingerprint(last_timestamp, sender, message) for sender, message in last_messages)
+    for batch in batches:
+        new = []
+        for message in batch:
+            timestamp = message['timestamp']
+            if timestamp < last_timestamp:
+                continue
+            if timestamp == last_timestamp:
+                key = message_fingerprint(timestamp, message['sender'], message['message'])
+                if pending[key] > 0:
+                    pending[key] -= 1
+                    continue
+            elif +pending:
+                raise ValueError('The export does not contain the last stored messages of this chat')
+            new.append(message)
+        if new:
+            yield new
+    if +pending:
+        raise ValueError('The export does not contain the last stored messages of this chat')
+
+
+def parse_whatsapp_chat(content):
+    """Parse a whole WhatsApp chat export (string or stream) into a list of messages"""
+    messages = []
+    for batch in iter_message_batches(content):
+        messages.extend(batch)
+    return messages
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from services.database import DatabaseService
+
+DIM = 768
+
+
+def unit_vector(rng):
+    vector = rng.standard_normal(DIM).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+@pytest.fixture
+def db(tmp_path):
+    """A DatabaseService on a fresh database file, its pool closed afterwards"""
+    service = DatabaseService(db_path=str(tmp_path / 'chat.db'))
+    yield service
+    service.pool.close_all()
+
+
+@pytest.fixture
+def make_messages():
+    """Build processed messages (as store_messages takes them) from (timestamp, sender, text) rows"""
+    rng = np.random.default_rng(0)
+
+    def make(rows, sentiment=0.0):
+        return [
+            {
+                'timestamp': timestamp,
+                'sender': sender,
+                'message': text,
+                'sentiment': sentiment,
+                'cluster_x': None,
+                'cluster_y': None,
+                'embedding': unit_vector(rng)
+            }
+            for timestamp, sender, text in rows
+        ]
+
+    return make
@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+
+
+def rollup_rows(db, chat_id):
+    with db._connection() as conn:
+        return conn.execute(
+            'SELECT day, sender, message_count, sentiment_count, sentiment_sum, sentiment_min, sentiment_max '
+            'FROM chat_rollups WHERE chat_id = ? ORDER BY day, sender', (chat_id,)
+        ).fetchall()
+
+
+def recounted_rollup_rows(db, chat_id):
+    with db._connection() as conn:
+        db._rebuild_rollups(conn, chat_id)
+        conn.commit()
+    return rollup_rows(db, chat_id)
+
+
+def test_rollups_match_messages_after_a_failed_append(db, make_messages):
+    db.store_messages('chat', make_messages([
+        ('2024-01-01T09:00:00', 'Ann', 'one'),
+        ('2024-01-01T09:05:00', 'Bob', 'two'),
+        ('2024-01-02T09:00:00', 'Ann', 'three')
+    ], sentiment=0.5))
+    timeline = db.get_timeline('chat')
+    sentiment = db.get_sentiment_timeline('chat')
+
+    batch = make_messages([
+        ('2024-01-02T10:00:00', 'Bob', 'four'),
+        ('2024-01-03T10:00:00', 'Ann', 'five'),
+        ('2024-01-03T11:00:00', 'Bob', 'six'),
+        ('2024-01-04T10:00:00', 'Ann', 'seven')
+    ], sentiment=-0.5)
+    # The first batch of two commits before the second one fails
+    batch[3]['embedding'] = np.zeros(db.vectors.dim // 2, dtype=np.float32)
+    with pytest.raises(Exception):
+        db.store_messages('chat', batch, batch_size=2, append=True)
+
+    assert db.get_chat_stats('chat')['total_messages'] == 3
+    assert db.get_timeline('chat') == timeline
+    assert db.get_sentiment_timeline('chat') == sentiment
+    assert rollup_rows(db, 'chat') == recounted_rollup_rows(db, 'chat')
+
+
+def test_failed_first_store_leaves_no_rollups(db, make_messages):
+    batch = make_messages([
+        ('2024-01-01T09:00:00', 'Ann', 'one'),
+        ('2024-01-01T09:05:00', 'Bob', 'two'),
+        ('2024-01-02T09:00:00', 'Ann', 'three')
+    ])
+    batch[2]['embedding'] = np.zeros(db.vectors.dim // 2, dtype=np.float32)
+    with pytest.raises(Exception):
+        db.store_messages('chat', batch, batch_size=2)
+
+    assert db.get_chat_stats('chat')['total_messages'] == 0
+    assert rollup_rows(db, 'chat') == []
+
+
+def test_cursor_pages_cover_every_message_once_in_order(db, make_messages):
+    # Several messages per timestamp, so the id half of the cursor matters
+    rows = [(f'2024-01-01T09:{i // 4:02d}:00', f'user{i % 3}', f'message {i}') for i in range(23)]
+    db.store_messages('chat', make_messages(rows))
+    db.store_messages('other', make_messages(rows[:5]))
+
+    pages = []
+    after = None
+    while True:
+        page = list(db.iter_messages('chat', after=after, limit=5))
+        if not page:
+            break
+        pages.append(page)
+        after = (page[-1]['timestamp'], page[-1]['id'])
+
+    seen = [row for page in pages for row in page]
+    assert [len(page) for page in pages] == [5, 5, 5, 5, 3]
+    assert [row['message'] for row in seen] == [text for _, _, text in rows]
+    assert len({row['id'] for row in seen}) == len(rows)
+    assert [(row['timestamp'], row['id']) for row in seen] == sorted((row['timestamp'], row['id']) for row in seen)
+
+
+def test_hybrid_search_ranks_by_reciprocal_rank_fusion(db, make_messages):
+    rows = [
+        ('2024-01-01T09:00:00', 'Ann', 'apple apple apple'),
+        ('2024-01-01T09:01:00', 'Bob', 'nothing in common'),
+        ('2024-01-01T09:02:00', 'Ann', 'an apple with a much longer message around it'),
+    ] + [(f'2024-01-01T09:{i:02d}:00', 'Bob', f'filler {i}') for i in range(3, 9)]
+    messages = make_messages(rows)
+    query = messages[1]['embedding']
+    # Nearest to the query: the message without the keyword, then the longer apple one
+    nearby = query + 0.1 * messages[2]['embedding']
+    messages[2]['embedding'] = nearby / np.linalg.norm(nearby)
+    db.store_messages('chat', messages)
+
+    results, timings = db.hybrid_search('chat', 'apple', query, limit=5, rrf_k=60)
+
+    assert set(timings) == {'bm25_ms', 'vector_ms', 'fusion_ms'}
+    assert [r['message'] for r in results[:1]] == ['an apple with a much longer message around it']
+    assert results[0]['vector_rank'] == 2 and results[0]['bm25_rank'] in (1, 2)
+    for result in results:
+        expected = sum(1.0 / (60 + rank) for rank in (result['bm25_rank'], result['vector_rank']) if rank)
+        assert result['score'] == pytest.approx(expected)
+    assert [r['score'] for r in results] == sorted((r['score'] for r in results), reverse=True)
+    # The nearest message has no keyword match and still ranks below the fused one
+    only_vector = next(r for r in results if r['message'] == 'nothing in common')
+    assert only_vector['vector_rank'] == 1 and only_vector['bm25_rank'] is None
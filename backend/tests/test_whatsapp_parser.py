@@ -0,0 +1,50 @@
+import pytest
+
+from services.whatsapp_parser import iter_message_batches, iter_new_message_batches, parse_whatsapp_chat
+
+STORED = '''[01/02/2024, 10:00:00] Ann: hi
+[01/02/2024, 10:01:00] Bob: hey
+[01/02/2024, 10:01:00] Ann: same minute
+'''
+REEXPORT = STORED + '''[01/02/2024, 10:01:00] Bob: also same minute
+[01/02/2024, 10:02:00] Ann: later
+'''
+
+
+def new_messages(export, last_timestamp, last_messages, batch_size=2):
+    batches = iter_message_batches(export, batch_size=batch_size)
+    return [m for batch in iter_new_message_batches(batches, last_timestamp, last_messages) for m in batch]
+
+
+def test_reexport_keeps_only_messages_after_the_stored_tail():
+    new = new_messages(REEXPORT, '2024-02-01T10:01:00', [('Bob', 'hey'), ('Ann', 'same minute')])
+
+    assert [(m['sender'], m['message']) for m in new] == [('Bob', 'also same minute'), ('Ann', 'later')]
+
+
+def test_repeated_message_in_the_last_minute_is_kept_once_per_occurrence():
+    export = STORED + '[01/02/2024, 10:01:00] Bob: hey\n'
+
+    new = new_messages(export, '2024-02-01T10:01:00', [('Bob', 'hey'), ('Ann', 'same minute')])
+
+    assert [(m['sender'], m['message']) for m in new] == [('Bob', 'hey')]
+
+
+def test_same_export_again_adds_nothing():
+    assert new_messages(STORED, '2024-02-01T10:01:00', [('Bob', 'hey'), ('Ann', 'same minute')]) == []
+
+
+def test_export_of_another_chat_is_rejected():
+    with pytest.raises(ValueError):
+        new_messages(REEXPORT, '2024-02-01T10:01:00', [('Carl', 'not in this export')])
+
+
+def test_dedup_against_stored_tail(db, make_messages):
+    stored = parse_whatsapp_chat(STORED)
+    db.store_messages('chat', make_messages((m['timestamp'], m['sender'], m['message']) for m in stored))
+
+    last_timestamp, last_messages = db.get_chat_tail('chat')
+    new = new_messages(REEXPORT, last_timestamp, last_messages)
+
+    assert last_timestamp == '2024-02-01T10:01:00'
+    assert [m['message'] for m in new] == ['also same minute', 'later']
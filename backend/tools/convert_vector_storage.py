@@ -0,0 +1,32 @@
+"""Convert the message vectors of a chat database to another storage mode.
+
+    float - full fp32 vectors, exact KNN
+    int8  - int8 codes for the KNN, rescored against float16 copies
+    bit   - sign bits for a hamming KNN, rescored against float16 copies
+
+Usage (from backend/, with the server stopped):
+    python -m tools.convert_vector_storage chat_data.db int8
+"""
+import argparse
+
+from services.database import DatabaseService
+from services.vector_store import VectorStore
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('db_path')
+    parser.add_argument('storage', choices=VectorStore.STORAGES)
+    args = parser.parse_args()
+
+    db = DatabaseService(db_path=args.db_path)
+    previous = db.vectors.storage
+    result = db.convert_vector_storage(args.storage)
+
+    mb = 1024 * 1024
+    print(f'{args.db_path}: {previous} -> {result["storage"]}, '
+          f'{result["bytes_before"] / mb:.1f} MB -> {result["bytes_after"] / mb:.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+"""Embed, score and cluster many chats offline with one loaded model.
+
+Inputs are WhatsApp export files, or NDJSON on stdin (when no file is given
+or the only file is -), one chat per line:
+    {"chat_id": "...", "path": "export.txt"}
+    {"chat_id": "...", "messages": [{"timestamp": ..., "sender": ..., "message": ...}]}
+Exports are parsed as a stream, like uploads; a file's chat id is its name
+without the extension. A stdin line that is not valid JSON or lacks those
+fields is reported and skipped.
+
+Each chat goes either into a chat database (--db, through DatabaseService,
+with its fitted cluster map saved next to it as the server does), or into
+--out as <name>.npy (float32 embeddings, one row per message) plus
+<name>.ndjson (the messages with sentiment and map coordinates, in the
+same order); <name> is the chat id itself when it is a plain file name,
+else the id made safe plus a hash of it. A chat id that is already stored
+(--db) or was already seen in this run is refused unless --skip-existing
+is given. A chat that fails or is refused is reported and skipped; the
+exit status is 1 if any was.
+
+Usage (from backend/):
+    python -m tools.process_chats exports/*.txt --db chat_data.db --skip-existing
+    cat chats.ndjson | python -m tools.process_chats --out embeddings/ --no-clusters
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+from services.database import DatabaseService
+from services.embedding_cache import EmbeddingCache
+from services.language_processing import LanguageProcessingService
+from services.projection_store import ProjectionStore
+from services.whatsapp_parser import iter_message_batches
+
+MESSAGE_BATCH = 1024
+
+_UNSAFE = re.compile(r'[^A-Za-z0-9_.-]')
+
+
+def iter_chats(paths, stdin):
+    """(chat_id, batches factory) per input chat; batches are only read when processed"""
+    if not paths or paths == ['-']:
+        for line_number, line in enumerate(stdin, 1):
+            if not line.strip():
+                continue
+            try:
+                yield parse_line(line)
+            except ValueError as e:
+                # Reported (and counted as failed) when main processes it
+                yield f'stdin line {line_number}', lambda e=e: raise_error(e)
+        return
+
+    for path in paths:
+        yield chat_id_for(path), lambda path=path: iter_file_batches(path)
+
+
+def parse_line(line):
+    """(chat_id, batches factory) of one NDJSON line; ValueError if it is not a valid entry"""
+    entry = json.loads(line)
+    if not isinstance(entry, dict):
+        raise ValueError('expected a JSON object')
+    chat_id = entry.get('chat_id')
+    if chat_id is not None and (not isinstance(chat_id, str) or not chat_id):
+        raise ValueError('chat_id must be a non-empty string')
+    if isinstance(entry.get('path'), str):
+        path = entry['path']
+        return chat_id or chat_id_for(path), lambda: iter_file_batches(path)
+    messages = entry.get('messages')
+    if not chat_id or not isinstance(messages, list):
+        raise ValueError('needs chat_id and a path or messages')
+    return chat_id, lambda: iter_list_batches(messages)
+
+
+def raise_error(error):
+    raise error
+
+
+def chat_id_for(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def file_name_for(chat_id):
+    """Name of a chat's --out files: the chat id if it is a plain file name, else a safe, unique stand-in"""
+    name = _UNSAFE.sub('_', chat_id)
+    if name == chat_id and not name.startswith('.'):
+        return name
+    digest = hashlib.sha1(chat_id.encode('utf-8')).hexdigest()[:16]
+    return f'{name.lstrip(".")[:64]}-{digest}'
+
+
+def iter_file_batches(path):
+    with open(path, 'rb') as raw:
+        yield from iter_message_batches(raw, batch_size=MESSAGE_BATCH)
+
+
+def iter_list_batches(messages):
+    for start in range(0, len(messages), MESSAGE_BATCH):
+        yield messages[start:start + MESSAGE_BATCH]
+
+
+def write_files(out_dir, chat_id, processed_data, dim):
+    embeddings = np.empty((len(processed_data), dim), dtype=np.float32)
+    for i, data in enumerate(processed_data):
+        embeddings[i] = data['embedding']
+    name = file_name_for(chat_id)
+    np.save(os.path.join(out_dir, name + '.npy'), embeddings)
+
+    fields = ('timestamp', 'sender', 'message', 'sentiment', 'cluster_x', 'cluster_y', 'cluster')
+    with open(os.path.join(out_dir, name + '.ndjson'), 'w', encoding='utf-8') as f:
+        for data in processed_data:
+            f.write(json.dumps({field: data[field] for field in fields}, ensure_ascii=False) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='*', help='WhatsApp exports; NDJSON is read from stdin when omitted or -')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--db', help='store chats into this chat database')
+    target.add_argument('--out', help='write <chat_id>.npy and <chat_id>.ndjson into this directory')
+    parser.add_argument('--skip-existing', action='store_true', help='skip chats already stored (--db) or written (--out)')
+    parser.add_argument('--no-clusters', action='store_true', help='skip UMAP/KMeans; map coordinates are left empty')
+    parser.add_argument('--model', default=os.environ.get('EMBEDDING_MODEL', 'all-mpnet-base-v2'))
+    parser.add_argument('--backend', default=os.environ.get('EMBEDDING_BACKEND', 'torch'))
+    parser.add_argument('--batch-size', type=int, default=int(os.environ.get('EMBEDDING_BATCH_SIZE', 64)))
+    parser.add_argument('--processes', type=int, default=int(os.environ.get('EMBEDDING_PROCESSES', 0)))
+    parser.add_argument('--sentiment-processes', type=int, default=int(os.environ.get('SENTIMENT_PROCESSES', 0)))
+    parser.add_argument('--matrix-max-messages', type=int,
+                        default=int(os.environ.get('MATRIX_SEARCH_MAX_MESSAGES', 200000)),
+                        help='write search matrices for chats up to this size (--db), as the server does; 0 to skip')
+    args = parser.parse_args()
+
+    db_service = projection_store = embedding_cache = None
+    if args.db:
+        db_service = DatabaseService(db_path=args.db, matrix_max_messages=args.matrix_max_messages)
+        projection_store = ProjectionStore(args.db)
+        # Texts repeated across archived chats are embedded once
+        embedding_cache = EmbeddingCache(db_service)
+    else:
+        os.makedirs(args.out, exist_ok=True)
+
+    lp_service = LanguageProcessingService(
+        model_name=args.model,
+        embedding_cache=embedding_cache,
+        batch_size=args.batch_size,
+        backend=args.backend,
+        processes=args.processes,
+        sentiment_processes=args.sentiment_processes
+    )
+    dim = lp_service.engine.get_sentence_embedding_dimension()
+
+    done = failed = skipped = total_messages = 0
+    seen = set()
+    start = time.perf_counter()
+    for chat_id, batches in iter_chats(args.files, sys.stdin):
+        if args.skip_existing and (chat_id in seen or (
+            db_service.chat_exists(chat_id) if db_service
+            else os.path.exists(os.path.join(args.out, file_name_for(chat_id) + '.npy'))
+        )):
+            skipped += 1
+            continue
+        # Storing a chat id twice would add its messages again under the same chat
+        if chat_id in seen or (db_service and db_service.chat_exists(chat_id)):
+            failed += 1
+            print(f'{chat_id}: refused: already {"given" if chat_id in seen else "stored"}; '
+                  f'use --skip-existing to skip it', file=sys.stderr)
+            continue
+        seen.add(chat_id)
+
+        chat_start = time.perf_counter()
+        try:
+            processed_data, projection, timings = lp_service.analyze_message_batches(
+                batches(), refit=not args.no_clusters
+            )
+            if db_service:
+                db_service.store_messages(chat_id, processed_data)
+                if projection is not None:
+                    projection_store.save(chat_id, projection)
+            else:
+                write_files(args.out, chat_id, processed_data, dim)
+        except Exception as e:
+            failed += 1
+            print(f'{chat_id}: failed: {e}', file=sys.stderr)
+            continue
+
+        seconds = time.perf_counter() - chat_start
+        done += 1
+        total_messages += len(processed_data)
+        stages = ', '.join(f'{name} {stage["seconds"]:.1f}s' for name, stage in timings.items())
+        print(f'{chat_id}: {len(processed_data)} messages in {seconds:.1f}s ({stages})', file=sys.stderr)
+
+    seconds = time.perf_counter() - start
+    print(f'{done} chats, {total_messages} messages in {seconds:.1f}s '
+          f'({total_messages / seconds if seconds else 0.0:.0f} messages/s); {skipped} skipped, {failed} failed',
+          file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
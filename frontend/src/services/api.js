@@ -4,14 +4,19 @@ const API_BASE_URL = "/api";
 
 const api = axios.create({
   baseURL: API_BASE_URL,
-  timeout: 30000, // 30 seconds for file processing
+  timeout: 30000, // uploads are processed in the background, see getJob
 });
 
 export const chatAPI = {
-  // Upload WhatsApp chat file
-  uploadChat: async (file) => {
+  // Upload WhatsApp chat file, returns a job id to poll with getJob
+  // Pass appendTo (an existing chat id) to add only the messages of a newer export
+  uploadChat: async (file, { appendTo = null } = {}) => {
     const formData = new FormData();
     formData.append("file", file);
+    if (appendTo) {
+      formData.append("mode", "append");
+      formData.append("chat_id", appendTo);
+    }
 
     const response = await api.post("/messages", formData, {
       headers: {
@@ -21,15 +26,23 @@ export const chatAPI = {
     return response.data;
   },
 
+  // Get status and progress of a chat upload job
+  getJob: async (jobId) => {
+    const response = await api.get(`/messages/jobs/${jobId}`);
+    return response.data;
+  },
+
   // Get list of all chats
   getChats: async () => {
     const response = await api.get("/messages/chats");
     return response.data;
   },
 
-  // Get messages for a specific chat
-  getMessages: async (chatId, limit = null) => {
-    const params = limit ? { limit } : {};
+  // Get one page of messages; pass the returned next_cursor to get the next page
+  getMessagesPage: async (chatId, { cursor = null, limit = 1000, fields = null } = {}) => {
+    const params = { limit };
+    if (cursor) params.cursor = cursor;
+    if (fields) params.fields = fields.join(",");
     const response = await api.get(`/messages/${chatId}`, { params });
     return response.data;
   },
@@ -40,6 +53,22 @@ export const chatAPI = {
     return response.data;
   },
 
+  // Get message counts per sender per day, week or month
+  getTimeline: async (chatId, granularity = "day") => {
+    const response = await api.get(`/messages/${chatId}/timeline`, {
+      params: { granularity },
+    });
+    return response.data;
+  },
+
+  // Get average/min/max sentiment per day, week or month
+  getSentimentTimeline: async (chatId, granularity = "day") => {
+    const response = await api.get(`/messages/${chatId}/sentiment`, {
+      params: { granularity },
+    });
+    return response.data;
+  },
+
   // Search for similar messages
   searchMessages: async (chatId, query, limit = 10) => {
     const response = await api.post("/embeddings/search", {
@@ -50,6 +79,57 @@ export const chatAPI = {
     return response.data;
   },
 
+  // Full-text search of a chat, best BM25 match first; anyTerm matches any instead of all terms
+  keywordSearch: async (chatId, query, { limit = 50, anyTerm = false } = {}) => {
+    const params = { q: query, limit };
+    if (anyTerm) params.any = 1;
+    const response = await api.get(`/messages/${chatId}/search`, { params });
+    return response.data;
+  },
+
+  // Search by keywords and meaning at once (BM25 and vector ranks fused)
+  hybridSearch: async (chatId, query, limit = 10) => {
+    const response = await api.post("/embeddings/search/hybrid", {
+      chat_id: chatId,
+      query: query,
+      limit: limit,
+    });
+    return response.data;
+  },
+
+  // Run many searches in one request; queries are strings or
+  // { query, chat_id | chat_ids, limit } objects, results come back in order
+  searchMessagesBatch: async (queries, { chatId, chatIds, limit = 10 } = {}) => {
+    const response = await api.post("/embeddings/search/batch", {
+      queries,
+      chat_id: chatId,
+      chat_ids: chatIds,
+      limit,
+    });
+    return response.data.results;
+  },
+
+  // Place search queries on a chat's cluster map, returns [{ query, x, y, cluster }]
+  projectQueries: async (chatId, queries) => {
+    const response = await api.post(`/embeddings/${chatId}/project`, { queries });
+    return response.data;
+  },
+
+  // Level-of-detail cluster map for a viewport { x0, y0, x1, y1 } (whole map if null):
+  // density bins when zoomed out, points without text when zoomed in
+  getClusterMap: async (chatId, { viewport = null, zoom = 0 } = {}) => {
+    const response = await api.get(`/embeddings/${chatId}/map`, {
+      params: { ...(viewport || {}), zoom },
+    });
+    return response.data;
+  },
+
+  // Get one message with its text
+  getMessage: async (chatId, messageId) => {
+    const response = await api.get(`/messages/${chatId}/${messageId}`);
+    return response.data;
+  },
+
   // Get cluster coordinates for visualization
   getClusters: async (chatId) => {
     const response = await api.get(`/embeddings/${chatId}/clusters`);